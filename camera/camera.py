@@ -3,6 +3,20 @@ import time
 import numpy as np
 import logging
 from utils.socket_handler import Streamer
+from camera.capture import StereoCapture, LUMA_FORMATS
+from camera.frame_ring import StereoFrameRing
+from camera.recording import RecordingSession
+from camera.pretrigger import PreTriggerBuffer
+from camera.rectification import Rectifier
+from camera.depth import DepthStage
+from camera.sparse_stereo import SparseStereo
+from camera.capture_process import CaptureProcess
+from camera.frame_pool import FramePool
+from utils.command_handler import StreamOptions, CameraMode
+from utils.stream_codec import encode_frame, encode_keypoints
+from config.settings import SYNC_TOLERANCE_MS, RING_SLOTS, RECORDING_DIR, RECORDING_SEGMENT_SECONDS, \
+    RECORDING_SEGMENT_MB, RECORDING_FORMAT, PRETRIGGER_SECONDS, PRETRIGGER_MAX_MB, CAPTURE_PROCESS, CAPTURE_FORMAT, \
+    LORES_SIZE, LIVE_STREAM_LORES
 import threading
 import os
 
@@ -13,6 +27,8 @@ try:
 except Exception as e:
     class Picamera2:
         cap = cv2.VideoCapture(0)
+        # Both shim instances share one device, so reads must not interleave
+        lock = threading.Lock()
         def __init__(self,id):
             if not Picamera2.cap:
                 self.cap = cv2.VideoCapture(0)
@@ -22,14 +38,33 @@ except Exception as e:
             self.frame_size = (self.frame_width,self.frame_height)
             # Get frames per second (FPS)
             self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        def create_video_configuration(self,main,controls):
-            return None
+            self.format = "RGB888"
+            self.lores_size = None
+            self.scratch = None
+            self.last = None
+        def create_video_configuration(self,main,controls,lores=None):
+            return {"main": main, "lores": lores, "controls": controls}
         def configure(self,config):
-            pass
-        def capture_array(self):
-            return self.cap.read()[1]
-        def read(self):
-            return self.cap.read()[1]
+            self.format = config["main"].get("format", "RGB888") if config else "RGB888"
+            self.lores_size = tuple(config["lores"]["size"]) if config and config.get("lores") else None
+        def capture_array(self, name="main", out=None):
+            # Reads into out when it has the frame's shape, like cv2.VideoCapture.read()
+            with self.lock:
+                if name == "lores":
+                    # Downscaled from the last main frame, as YUV420 like the Picamera2 lores stream
+                    if self.last is None or self.lores_size is None:
+                        return None
+                    small = cv2.resize(self.last, self.lores_size, interpolation=cv2.INTER_AREA)
+                    return cv2.cvtColor(small, cv2.COLOR_BGR2YUV_I420)
+                if self.format not in LUMA_FORMATS:
+                    self.last = self.cap.read(out)[1]
+                    return self.last
+                # Planar YUV420 like Picamera2, converted from the device's BGR
+                ok, self.scratch = self.cap.read(self.scratch)
+                self.last = self.scratch if ok else None
+                return cv2.cvtColor(self.scratch, cv2.COLOR_BGR2YUV_I420, dst=out) if ok else None
+        def read(self, out=None):
+            return self.capture_array(out=out)
         def start(self):
             pass
         def stop(self):
@@ -72,6 +107,7 @@ class Camera(Streamer):
         HEIGHT (int): Image height for processing
         FPS (float): Frames per second for video capture
         STERIO (bool): Whether stereo vision is enabled
+        sync_tolerance_ms (float): Maximum left/right skew of a stereo pair
     """
 
     # Calibration and camera parameters
@@ -90,10 +126,20 @@ class Camera(Streamer):
     HEIGHT = 480
     FPS = 30.0
     STERIO = True
+    # Attributes set by set_config(), restored when a mode switch fails
+    MODE_ATTRIBUTES = ("fps", "img_width", "img_height", "size", "format", "luma", "fdl", "controls", "main", "lores")
 
-    def __init__(self):
+    def __init__(self, sync_tolerance_ms=SYNC_TOLERANCE_MS, ring_slots=RING_SLOTS, capture_process=CAPTURE_PROCESS):
         """
         Initializes the Camera object, setting up the camera configurations and logger.
+
+        Args:
+            sync_tolerance_ms (float, optional): Maximum left/right skew of a stereo pair.
+                Defaults to half a frame period.
+            ring_slots (int): Number of preallocated stereo frame slots shared by
+                live streaming, recording and still capture.
+            capture_process (bool): Run the capture loop in a process of its own,
+                which owns the sensors and publishes frames in shared memory.
         """
         self.state = {
             "record": False,
@@ -107,31 +153,89 @@ class Camera(Streamer):
         self.live_event = threading.Event()
         self.recording_event = threading.Event()
         self.logger = logging.getLogger()
+        self.sync_tolerance_ms = sync_tolerance_ms
+        self.capture = None
+        self.capture_users = 0
+        self.capture_lock = threading.Lock()
+        self.capture_pinned = False
+        self.use_capture_process = capture_process
+        self.ring_slots = ring_slots
+        self.ring = StereoFrameRing(ring_slots)
+        # Pairs of the lores stream, written by the same capture loop
+        self.lores_ring = StereoFrameRing(ring_slots)
+        # Recycled capture buffers, see get_sync_stats() for their counters
+        self.frame_pool = FramePool()
+        self.readers = {}
+        self.live_reader = None
+        self.live_rectified = False
+        self.live_lores = False
+        # Tables are loaded or built when rectified output is first asked for
+        self.rectifier = Rectifier()
+        self.depth_stage = None
+        self.sparse_stereo = SparseStereo()
+        self.recording_session = None
+        self.record_thread = None
+        self.pretrigger = None
+        # Finished recording files that can be downloaded, by file name
+        self.recorded_files = {}
+        self.recorded_files_lock = threading.Lock()
+        # Built Picamera2 configurations of both sensors by mode, see set_mode()
+        self.mode_configs = {}
         self.set_config()
         self.init_cam()
         
-        if TESTING:
-            self.fps = self.cam_left.fps
+        if TESTING and not self.use_capture_process:
+            self.fps = self.cam_left.fps or self.fps
             self.img_width = self.cam_left.frame_width
             self.img_height = self.cam_left.frame_height
             self.size =self.cam_left.frame_size
             
     def init_cam(self):
         self.is_closed = False
+        if self.use_capture_process:
+            self.init_capture_process()
+            return
         try:
             self.cam_left = Picamera2(self.camera_left_id)
-            video_config = self.cam_left.create_video_configuration(main=self.main, controls=self.controls)
-            self.cam_left.configure(video_config)
+            left_config = self.cam_left.create_video_configuration(main=self.main, lores=self.lores,
+                                                                   controls=self.controls)
+            self.cam_left.configure(left_config)
 
             self.cam_right = Picamera2(self.camera_right_id)
-            video_config = self.cam_right.create_video_configuration(main=self.main, controls=self.controls)
-            self.cam_right.configure(video_config)
+            right_config = self.cam_right.create_video_configuration(main=self.main, lores=self.lores,
+                                                                     controls=self.controls)
+            self.cam_right.configure(right_config)
+            # Configurations the sensors are in, to go back to if a mode switch fails
+            self.active_configs = (left_config, right_config)
+            self.capture = None
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Error initializing cameras: {e}")
             raise RuntimeError("Failed to initialize cameras")
 
-    def set_config(self, fps=20, img_width=720, img_height=720, color_format="RGB888"):
+    def init_capture_process(self):
+        """
+        Starts the capture process, which opens the sensors, and reads frames
+        from its shared frame ring from now on.
+        """
+        try:
+            process = CaptureProcess(
+                (self.camera_left_id, self.camera_right_id), self.main, self.controls, self.fps,
+                self.sync_tolerance_ms, self.ring_slots, lores=self.lores
+            )
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error initializing cameras: {e}")
+            raise RuntimeError("Failed to initialize cameras")
+        self.capture = process
+        self.ring = process.ring
+        if process.lores_ring is not None:
+            self.lores_ring = process.lores_ring
+        self.fps = process.fps or self.fps
+        self.size = process.size
+        self.img_width, self.img_height = process.size
+
+    def set_config(self, fps=20, img_width=720, img_height=720, color_format=CAPTURE_FORMAT, lores_size=LORES_SIZE):
         """
         Configures the camera settings including FPS, image dimensions, and color format.
         
@@ -139,69 +243,395 @@ class Camera(Streamer):
             fps (int): Frames per second.
             img_width (int): Width of the captured image.
             img_height (int): Height of the captured image.
-            color_format (str): Color format for the captured image.
+            color_format (str): Color format for the captured image. With 'YUV420'
+                only the Y plane is kept, and frames are single channel all the way
+                to the live stream and the recordings.
+            lores_size (tuple): (width, height) of the lores stream that live
+                streaming uses by default, None for no lores stream.
         """
         self.fps = fps
         self.img_width = img_width
         self.img_height = img_height
         self.size = (self.img_width,self.img_height)
         self.format = color_format
-        self.fdl = (33333, 33333)
-
-        if self.fps == 20:
-            self.fdl = (40000, 40000)
-        elif self.fps == 10:
-            self.fdl = (100000, 100000)
-        
+        self.luma = color_format in LUMA_FORMATS
+        frame_duration = round(1e6 / fps)
+        self.fdl = (frame_duration, frame_duration)
         self.controls = {"FrameDurationLimits": self.fdl}
-        self.main = {"size": self.size, "format": "RGB888"}
+        self.main = {"size": self.size, "format": color_format}
+        # The lores stream can only be YUV420 on most sensors; converted on capture, see lores_image().
+        # It can't be larger than the main one.
+        if lores_size:
+            lores_size = (min(lores_size[0], img_width), min(lores_size[1], img_height))
+        self.lores = {"size": lores_size, "format": "YUV420"} if lores_size else None
+
+    def get_mode(self):
+        """
+        Returns:
+            CameraMode: The current frame rate, resolution and format.
+        """
+        return CameraMode(self.fps, self.img_width, self.img_height, self.format)
+
+    def set_mode(self, mode: CameraMode):
+        """
+        Switches both sensors to another mode without closing them. Running
+        consumers keep their ring readers and get the new frames once capture
+        resumes. Pre-trigger frames of the old mode are discarded.
+
+        Picamera2 configurations are built once per mode and cached, so that
+        switching back and forth between modes only costs stopping,
+        reconfiguring and restarting the sensors.
+
+        Args:
+            mode (CameraMode): The mode to switch to.
 
-    def start_live_streaming(self):
+        Returns:
+            dict: The mode, whether its configuration was cached, the time the
+            sensors were stopped for (switch_ms) and the time until the first
+            frame of the new mode was in the ring (first_frame_ms, None if
+            nothing is capturing).
+
+        Raises:
+            ValueError: If the mode is invalid, beyond the sensor or too large for
+                the capture process' shared slots.
+            RuntimeError: While recording, or if the sensors failed to switch. The
+                previous mode is running again in that case.
+        """
+        mode.validate()
+        max_width, max_height = self.resolution
+        if int(mode.width) > max_width or int(mode.height) > max_height:
+            raise ValueError(f"Resolution is limited to {max_width}x{max_height}")
+        if self.is_recording():
+            raise RuntimeError("Cannot change the camera mode while recording")
         self.check_cam()
+
+        start = time.perf_counter()
+        with self.capture_lock:
+            running = self.capture_users > 0
+            reader = self.ring.reader("mode") if running else None
+            previous = {name: getattr(self, name) for name in self.MODE_ATTRIBUTES}
+            try:
+                self.set_config(float(mode.fps), int(mode.width), int(mode.height), mode.format)
+                if self.use_capture_process:
+                    # The process goes back to the previous mode by itself if the switch fails
+                    result = self.capture.configure(mode.key, self.main, self.lores, self.controls, self.fps)
+                    cached = result["cached"]
+                    if reader is not None:
+                        reader.seek(result["head"])
+                else:
+                    cached = self.switch_cameras(mode, running, reader)
+            except Exception as e:
+                for name, value in previous.items():
+                    setattr(self, name, value)
+                if isinstance(e, ValueError):
+                    # Refused before anything was switched, e.g. by CaptureProcess.fits()
+                    raise
+                self.logger.error(f"Error switching to {mode}, keeping the previous mode: {e}")
+                raise RuntimeError(f"Failed to switch to {mode}: {e}") from e
+            switch_ms = (time.perf_counter() - start) * 1000
+        if self.pretrigger:
+            self.pretrigger.clear()
+
+        first_frame_ms = None
+        if reader is not None and reader.read(timeout=2) is not None:
+            first_frame_ms = (time.perf_counter() - start) * 1000
+        self.logger.info(f"Switched to {mode} in {switch_ms:.1f} ms ({'cached' if cached else 'new'} configuration)")
+        return {"mode": mode.to_dict(), "cached": cached, "switch_ms": switch_ms, "first_frame_ms": first_frame_ms}
+
+    def switch_cameras(self, mode, running, reader=None):
+        """
+        Reconfigures both sensors for a mode set with set_config(), restarting
+        capture if it was running. If a sensor fails to take the new
+        configuration, both are put back into the previous one and the
+        previous capture engine is restarted before the error is raised.
+
+        Returns:
+            bool: Whether the mode's configurations were cached.
+        """
+        configs = self.mode_configs.get(mode.key)
+        cached = configs is not None
+        if not cached:
+            configs = [cam.create_video_configuration(main=self.main, lores=self.lores, controls=self.controls)
+                       for cam in (self.cam_left, self.cam_right)]
+        if running:
+            self.capture.stop()
+            reader.seek(self.ring.head)
+        try:
+            self.cam_left.configure(configs[0])
+            self.cam_right.configure(configs[1])
+        except Exception:
+            self.cam_left.configure(self.active_configs[0])
+            self.cam_right.configure(self.active_configs[1])
+            if running:
+                self.capture.start()
+            raise
+        self.mode_configs[mode.key] = self.active_configs = configs
+        self.capture = self.create_capture()
+        if running:
+            self.capture.start()
+        return cached
+
+    def create_capture(self):
+        return StereoCapture(
+            self.cam_left, self.cam_right, self.fps, self.sync_tolerance_ms, on_pair=self.on_pair,
+            pool=self.frame_pool, luma=self.luma, lores=self.lores is not None
+        )
+
+    def acquire_capture(self):
+        """
+        Registers a user of the capture engine, starting both sensors and their
+        grabber threads for the first one.
+
+        Returns:
+            StereoCapture: The running capture engine.
+        """
+        self.check_cam()
+        with self.capture_lock:
+            if self.capture is None:
+                self.capture = self.create_capture()
+            if self.capture_users == 0:
+                self.ring.open()
+                self.lores_ring.open()
+                self.capture.start()
+            self.capture_users += 1
+            return self.capture
+
+    def release_capture(self):
+        """
+        Unregisters a user of the capture engine, stopping the sensors once the
+        last one is gone.
+        """
+        with self.capture_lock:
+            if self.capture_users == 0:
+                return
+            self.capture_users -= 1
+            if self.capture_users == 0:
+                self.capture.stop()
+
+    def start_capture(self):
+        """
+        Keeps the capture loop running until stop_capture(), so that readers
+        coming and going never start or stop the sensors.
+        """
+        if not self.capture_pinned:
+            self.acquire_capture()
+            self.capture_pinned = True
+
+    def stop_capture(self):
+        if self.capture_pinned:
+            self.capture_pinned = False
+            self.release_capture()
+
+    def on_pair(self, pair):
+        """
+        Capture loop callback copying every synchronized pair into the frame ring,
+        and its lores frames into the lores ring.
+        """
+        self.ring.write(pair.left, pair.right, pair.ts_left, pair.ts_right)
+        if pair.lores is not None:
+            self.lores_ring.write(pair.lores[0], pair.lores[1], pair.ts_left, pair.ts_right)
+
+    def open_reader(self, name, lores=False):
+        """
+        Starts the capture loop if needed and returns a new reader of the frame ring.
+
+        Args:
+            name (str): Name of the consumer, used in get_state().
+            lores (bool): Read the lores ring instead of the full resolution one.
+
+        Returns:
+            RingReader: Reader positioned at the newest frame.
+        """
+        self.acquire_capture()
+        reader = (self.lores_ring if lores else self.ring).reader(name)
+        self.readers[name] = reader
+        return reader
+
+    def close_reader(self, reader):
+        """
+        Unregisters a reader and releases its hold on the capture loop.
+        """
+        if self.readers.get(reader.name) is reader:
+            del self.readers[reader.name]
+        self.release_capture()
+
+    def get_sync_stats(self):
+        """
+        Returns left/right synchronization statistics of the capture engine.
+
+        Returns:
+            dict: Statistics, or None if nothing has been captured yet.
+        """
+        if self.capture is None:
+            return None
+        return self.capture.get_stats()
+
+    def rectify(self, frame, out=None, ring=None):
+        """
+        Rectifies a frame read from the frame ring, see Rectifier.rectify().
+
+        Args:
+            ring (StereoFrameRing, optional): Ring the frame was read from, the
+                full resolution one by default.
+
+        Returns:
+            StereoFrame: The rectified pair, or None if the slot was overwritten meanwhile.
+        """
+        rectified = self.rectifier.rectify(frame, out)
+        return rectified if (ring or self.ring).is_valid(frame) else None
+
+    def start_live_streaming(self, rectified=False, lores=LIVE_STREAM_LORES):
+        """
+        Args:
+            rectified (bool): Stream rectified frames. Applies to all viewers,
+                also when the stream is already running.
+            lores (bool): Stream the lores frames if there is a lores stream,
+                full resolution frames otherwise. Only applies when the stream starts.
+        """
+        self.live_rectified = rectified
+        if self.live_event.is_set():
+            return
+        self.live_lores = bool(lores and self.lores)
+        self.live_reader = self.open_reader("live", lores=self.live_lores)
         self.live_event.set()
 
     def stop_live_streaming(self):
+        if not self.live_event.is_set():
+            return
         self.live_event.clear()
+        self.close_reader(self.live_reader)
 
-    def get_stream(self):
+    def get_frame(self):
         """
-        Retrieves a pair of stereo images (left and right) from the cameras if the system is live.
-        
+        Retrieves the newest stereo frame from the frame ring if the system is live.
+
         Returns:
-            tuple: (left_image, right_image) if live, otherwise None.
+            StereoFrame: The frame with its sequence number and capture timestamps,
+            or None once live streaming has stopped.
         """
-        if self.live_event.is_set():
+        while self.live_event.is_set():
             try:
-                img_left = self.cam_left.read()
-                img_right = self.cam_right.read()
-                return True,(img_left, img_right)
+                reader = self.live_reader
+                frame = reader.read(latest=True) if reader else None
+                if frame is not None and self.live_rectified:
+                    frame = self.rectify(frame, ring=reader.ring)
+                if frame is not None:
+                    return frame
             except Exception as e:
                 if self.logger:
                     self.logger.error(f"Error getting stream: {e}")
-        return False,(None,None)
+                break
+        return None
+
+    def get_stream(self):
+        """
+        Retrieves a pair of stereo images (left and right) from the cameras if the system is live.
+        
+        Returns:
+            tuple: (left_image, right_image) if live, otherwise None.
+        """
+        frame = self.get_frame()
+        if frame is None:
+            return False,(None,None)
+        return True,(frame.left, frame.right)
 
     def is_live_streaming(self):
         return self.live_event.is_set()
     
-    def start_recording(self,use_separate_thread=True):
+    def arm_pretrigger(self, seconds=PRETRIGGER_SECONDS, max_mb=PRETRIGGER_MAX_MB):
+        """
+        Starts keeping the last seconds of capture in memory, so that the next
+        recording begins with them.
+
+        Args:
+            seconds (float): Capture time kept.
+            max_mb (float): Memory cap of the kept frames, in MB.
+
+        Returns:
+            PreTriggerBuffer: The armed buffer.
+        """
+        self.check_cam()
+        self.disarm_pretrigger()
+        buffer = PreTriggerBuffer(seconds, max_mb)
+        buffer.start(self.open_reader("pretrigger"))
+        self.pretrigger = buffer
+        return buffer
+
+    def disarm_pretrigger(self):
+        """
+        Stops the pre-trigger buffer and frees its frames.
+        """
+        buffer, self.pretrigger = self.pretrigger, None
+        if buffer:
+            buffer.stop()
+            self.close_reader(buffer.reader)
+
+    def start_depth(self, options=None):
+        """
+        Starts computing depth from the rectified frames in a worker of its
+        own, replacing a running depth stage.
+
+        Args:
+            options (DepthOptions, optional): Algorithm, downscale, disparity range and ROI.
+
+        Returns:
+            DepthStage: The running stage.
+        """
+        self.check_cam()
+        stage = DepthStage(self, options)
+        self.stop_depth()
+        stage.start()
+        self.depth_stage = stage
+        return stage
+
+    def stop_depth(self):
+        stage, self.depth_stage = self.depth_stage, None
+        if stage:
+            stage.stop()
+
+    def get_depth(self, after_seq=None, timeout=1.0):
+        """
+        Returns:
+            DepthFrame: The newest depth frame newer than after_seq, None if the
+            depth stage isn't running or nothing arrived in time.
+        """
+        stage = self.depth_stage
+        return stage.get(after_seq, timeout) if stage else None
+
+    def start_recording(self,use_separate_thread=True,segment_seconds=RECORDING_SEGMENT_SECONDS,
+                        segment_mb=RECORDING_SEGMENT_MB,format=RECORDING_FORMAT,pretrigger=True,rectified=False):
         """
         Starts the recording process, saving both left and right camera streams to video files.
+
+        Args:
+            segment_seconds (float, optional): Start a new pair of files after this much capture time.
+            segment_mb (float, optional): Start a new pair of files once the current one reaches this size.
+            format (str): 'xvid' video files or 'raw' memory-mappable frames, see RecordingSession.
+            pretrigger (bool): Begin with the frames of the pre-trigger buffer, if it is armed.
+            rectified (bool): Record rectified frames.
         """
         self.check_cam()
+        session = RecordingSession(
+            RECORDING_DIR, self.fps, self.size, segment_seconds, segment_mb, on_segment=self.on_segment_closed,
+            format=format, rectified=rectified, color=not self.luma
+        )
+        self.recording_session = session
         self.recording_event.set()
 
         if use_separate_thread:
-            th = threading.Thread(target=self.record)
-            th.start()
+            self.record_thread = threading.Thread(target=self.record, args=(pretrigger,))
+            self.record_thread.start()
             # th.join()
         else:
-            self.record()
+            self.record(pretrigger)
     
     def end_recording(self):
         """
         Ends the recording process and waits for it to stop.
         """
         self.recording_event.clear()
+        if self.record_thread and self.record_thread is not threading.current_thread():
+            self.record_thread.join(timeout=5)
 
     def set_state(self, recording_left=None, recording_right=None, active=None):
         """
@@ -226,6 +656,11 @@ class Camera(Streamer):
         Returns:
             dict: The current state.
         """
+        self.state['sync'] = self.get_sync_stats()
+        self.state['readers'] = {name: reader.get_stats() for name, reader in list(self.readers.items())}
+        self.state['recorder'] = self.recording_session.get_stats() if self.recording_session else None
+        self.state['pretrigger'] = self.pretrigger.get_stats() if self.pretrigger else None
+        self.state['depth'] = self.depth_stage.get_stats() if self.depth_stage else None
         return self.state
 
     def is_recording(self):
@@ -237,48 +672,87 @@ class Camera(Streamer):
         """
         return self.recording_event.is_set()
 
-    def record(self):
+    def record(self, pretrigger=True):
         """
-        Captures frames from both cameras and saves them as video files in the current directory.
+        Captures frames from both cameras and saves them as video files in RECORDING_DIR,
+        split into segments if the session asks for it.
+
+        Args:
+            pretrigger (bool): Write the frames of the armed pre-trigger buffer first.
         """
         try:
-            file_name = str(int(time.time()))
-            fname_l = f"left_{file_name}.avi"
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out_l = cv2.VideoWriter(fname_l, fourcc, self.fps, self.size)
-
-            fname_r = f"right_{file_name}.avi"
-            out_r = cv2.VideoWriter(fname_r, fourcc, self.fps, self.size)
-
-            self.cam_left.start()
-            self.cam_right.start()
+            session = self.recording_session
+            reader = self.open_reader("record")
+            if pretrigger and self.pretrigger:
+                last_seq = self.write_pretrigger(session, self.pretrigger)
+                if last_seq is not None:
+                    # Carry on with the live frame after the history
+                    reader.seek(last_seq)
 
             while self.recording_event.is_set():
-                frame_l = self.cam_left.capture_array()
-                frame_r = self.cam_right.capture_array()
-
-                out_r.write(frame_r)
-                out_l.write(frame_l)
+                shape = self.ring.frame_shape
+                buffers = session.reserve(shape, self.ring.left.dtype) if shape else None
+                if shape and buffers is None:
+                    # Encoders are behind: skip this frame rather than fall behind capture
+                    if reader.read() is not None:
+                        session.drop()
+                    continue
+                out = buffers[1:] if buffers else None
+                try:
+                    if session.rectified:
+                        # Rectified straight into the buffers, saving the copy
+                        frame = reader.read()
+                        frame = self.rectify(frame, out) if frame is not None else None
+                    else:
+                        frame = reader.read(out=out)
+                except ValueError:
+                    # The frame size changed since the buffers were reserved
+                    frame = None
+                session.ring_dropped = reader.dropped
+                if frame is None:
+                    if buffers:
+                        session.cancel(buffers)
+                    continue
+
+                session.write(frame, buffers)
 
             self.logger.info('Ending recording...')
 
-            self.cam_left.stop()
-            self.cam_right.stop()
-
-            out_l.release()
-            out_r.release()
+            self.close_reader(reader)
+            session.close()
 
             # self.cam_left.close()
             # self.cam_right.close()
-
-            self.set_state(
-                {'state': True, 'fname': fname_l},
-                {'state': True, 'fname': fname_r}
-            )
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Error during recording: {e}")
 
+    def write_pretrigger(self, session, buffer):
+        """
+        Writes the frames kept by a pre-trigger buffer to a recording. The
+        buffer keeps filling meanwhile, so it is drained until it has no
+        newer frame, and the recording then continues from the ring.
+
+        Returns:
+            int: Sequence number of the last frame written, None if there was none.
+        """
+        last_seq = None
+        while self.recording_event.is_set():
+            pending = buffer.frames_after(last_seq)
+            if not pending:
+                break
+            for compressed in pending:
+                if not self.recording_event.is_set():
+                    break
+                frame = compressed.decode()
+                if session.rectified:
+                    frame = self.rectifier.rectify(frame)
+                session.write(frame, wait=True)
+                session.pretrigger_frames += 1
+                last_seq = compressed.seq
+        self.logger.info(f"Wrote {session.pretrigger_frames} pre-trigger frames")
+        return last_seq
+
     def get_recorded_file(self, sterio=True):
         """
         Retrieves the recorded video files for left and right cameras.
@@ -294,29 +768,82 @@ class Camera(Streamer):
         else:
             return self.state['recording']['left']['fname'], self.state['recording']['right']['fname']
 
-    def clear_recordings(self):
-        os.remove(self.state['recording']['left']['fname'])
-        os.remove(self.state['recording']['right']['fname'])
-        
-        self.state['recording']['left']['fname'] = None
-        self.state['recording']['right']['fname'] = None
+    def on_segment_closed(self, segment):
+        """
+        Makes a finished recording segment available for download.
+        """
+        with self.recorded_files_lock:
+            for path in segment.files:
+                self.recorded_files[os.path.basename(path)] = path
+        self.set_state(
+            {'state': True, 'fname': segment.left},
+            {'state': True, 'fname': segment.right}
+        )
+
+    def get_recording_files(self):
+        """
+        Returns the finished recording files that can be downloaded, including
+        the closed segments of a recording still in progress.
 
-    def capture_image(self):
+        Returns:
+            dict: File paths by file name.
+        """
+        with self.recorded_files_lock:
+            return {name: path for name, path in self.recorded_files.items() if os.path.exists(path)}
+
+    def get_recording_manifest(self):
+        """
+        Returns:
+            dict: Manifest of the current or last recording session, None if nothing was recorded.
+        """
+        if self.recording_session is None:
+            return None
+        return self.recording_session.to_dict(finished=not self.is_recording())
+
+    def clear_recordings(self, names=None):
+        """
+        Deletes finished recording files.
+
+        Args:
+            names (list, optional): File names to delete, all finished files by default.
+
+        Returns:
+            list: Names of the deleted files.
+        """
+        with self.recorded_files_lock:
+            names = list(self.recorded_files) if names is None else [n for n in names if n in self.recorded_files]
+            paths = [self.recorded_files.pop(name) for name in names]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        for side in ('left', 'right'):
+            if self.state['recording'][side]['fname'] in paths:
+                self.state['recording'][side]['fname'] = None
+        return names
+
+    def capture_image(self, rectified=False):
         """
         Captures a single pair of stereo images from both cameras.
 
+        Args:
+            rectified (bool): Return the rectified pair.
+
         Returns:
             tuple: A pair of images from the left and right cameras.
         """
-        self.check_cam()
         try:
-            self.cam_left.start()
-            self.cam_right.start()
-            img_left = self.cam_left.capture_array()
-            img_right = self.cam_right.capture_array()
-            self.cam_left.stop()
-            self.cam_right.stop()
-            return img_left, img_right
+            reader = self.open_reader("capture")
+            try:
+                # Only accept a pair captured after the request
+                frame = reader.read()
+                if frame is not None and rectified:
+                    frame = self.rectify(frame)
+                    return (frame.left, frame.right) if frame is not None else (None, None)
+                if frame is None:
+                    return None, None
+                return frame.left.copy(), frame.right.copy()
+            finally:
+                self.close_reader(reader)
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Error capturing image: {e}")
@@ -333,7 +860,7 @@ class Camera(Streamer):
             ndarray: The edge-detected image.
         """
         try:
-            grayScaleImage = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            grayScaleImage = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
             bluredGSImage = cv2.GaussianBlur(grayScaleImage, (5, 5), 0)
             canny = cv2.Canny(bluredGSImage, 50, 150)
             return canny
@@ -342,13 +869,83 @@ class Camera(Streamer):
                 self.logger.error(f"Error applying Canny edge detection: {e}")
             return None
 
+    def sparse_keypoints(self, frame, rectified=False, ring=None):
+        """
+        Sparse stereo: depth at the features of the left image only, see SparseStereo.
+
+        Args:
+            frame (StereoFrame): Stereo pair, usually read from the frame ring.
+            rectified (bool): The pair is already rectified.
+            ring (StereoFrameRing, optional): Ring the frame was read from, see rectify().
+
+        Returns:
+            ndarray: float32 Nx4 array of (u, v, disparity, depth in mm), or None
+            if the frame was overwritten meanwhile or matching failed.
+        """
+        try:
+            if not rectified:
+                frame = self.rectify(frame, ring=ring)
+                if frame is None:
+                    return None
+            height, width = frame.left.shape[:2]
+            return self.sparse_stereo.compute(frame, self.rectifier.maps((width, height)))
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error matching keypoints: {e}")
+            return None
+
+    def capture_keypoints(self):
+        """
+        Captures a single stereo pair and returns its sparse stereo keypoints.
+
+        Returns:
+            tuple: (frame, keypoints), the StereoFrame with its sequence number and
+            timestamps and the Nx4 keypoints, or (None, None).
+        """
+        reader = self.open_reader("capture")
+        try:
+            frame = reader.read()
+            if frame is None:
+                return None, None
+            frame = self.rectify(frame)
+            if frame is None:
+                return None, None
+            return frame, self.sparse_keypoints(frame, rectified=True)
+        finally:
+            self.close_reader(reader)
+
+    def encode_frame(self, frame, options):
+        """
+        Encodes a live frame for the stream, as sparse stereo keypoints for the
+        keypoints codec and as images otherwise.
+        """
+        if options.codec != StreamOptions.CODEC_KEYPOINTS:
+            return encode_frame(frame, options)
+        ring = self.lores_ring if self.live_lores else self.ring
+        keypoints = self.sparse_keypoints(frame, rectified=self.live_rectified, ring=ring)
+        if keypoints is None:
+            raise ValueError(f"No keypoints for frame {frame.seq}")
+        return encode_keypoints(frame, keypoints)
+
     def close(self):
         """
         Closes the camera connections.
         """
         try:
-            self.cam_left.close()
-            self.cam_right.close()
+            self.disarm_pretrigger()
+            self.stop_depth()
+            with self.capture_lock:
+                if self.capture_users:
+                    self.capture.stop()
+                    self.capture_users = 0
+                self.capture_pinned = False
+            self.ring.close()
+            self.lores_ring.close()
+            if self.use_capture_process:
+                self.capture.close()
+            else:
+                self.cam_left.close()
+                self.cam_right.close()
             self.is_closed  = True
 
         except Exception as e:
@@ -0,0 +1,386 @@
+import threading
+import time
+import inspect
+import logging
+from collections import deque
+import cv2
+import numpy as np
+
+try:
+    from picamera2 import MappedArray
+except Exception:
+    MappedArray = None
+
+# Formats captured for their luma only: planar YUV420, whose first two thirds of rows are the Y plane
+LUMA_FORMATS = ("YUV420",)
+
+
+def luma_plane(frame):
+    """
+    Returns:
+        numpy.ndarray: The Y plane of a planar YUV420 frame, as a view.
+    """
+    return frame[:frame.shape[0] * 2 // 3]
+
+
+def lores_image(frame, luma=False):
+    """
+    Converts a frame of the YUV420 lores stream for the pipeline.
+
+    Returns:
+        numpy.ndarray: Its Y plane in luma mode, a BGR image like the main
+        stream's otherwise.
+    """
+    return luma_plane(frame) if luma else cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+
+
+class StereoFrame:
+    """
+    A synchronized pair of left and right frames.
+
+    Attributes:
+        left (ndarray): Frame from the left camera.
+        right (ndarray): Frame from the right camera.
+        seq (int): Sequence number of the pair.
+        ts_left (int): Capture timestamp of the left frame (ns).
+        ts_right (int): Capture timestamp of the right frame (ns).
+        lores (tuple): (left, right) frames of the lores stream, None without one.
+    """
+
+    def __init__(self, left, right, seq, ts_left, ts_right, lores=None):
+        self.left = left
+        self.right = right
+        self.seq = seq
+        self.ts_left = ts_left
+        self.ts_right = ts_right
+        # (left, right) frames of the low resolution stream, captured with these
+        self.lores = lores
+
+    @property
+    def timestamp(self):
+        """Capture time of the pair (ns), the mean of both eyes."""
+        return (self.ts_left + self.ts_right) // 2
+
+    @property
+    def skew(self):
+        """Right minus left capture time (ns)."""
+        return self.ts_right - self.ts_left
+
+    def __str__(self):
+        return f"seq : {self.seq}, timestamp : {self.timestamp}, skew : {self.skew / 1e6:.2f} ms"
+
+
+class FrameGrabber:
+    """
+    Reads frames from a single camera on a dedicated thread and hands each
+    frame, together with its capture timestamp, to a callback.
+
+    With a FramePool, frames are read into recycled buffers where the backend
+    allows it: copied out of the mapped request buffer with Picamera2, read
+    straight into the buffer by backends whose capture_array() takes an `out`
+    array. The callback then owns the buffer's reference.
+
+    In luma mode the camera delivers planar YUV420 and only a view of its Y
+    plane is passed on, without any conversion.
+
+    With a lores stream configured, its frame is taken from the same request
+    as the main one and passed along with it. It is small enough to be
+    allocated every time rather than pooled.
+    """
+
+    def __init__(self, cam, side, on_frame, pool=None, luma=False, lores=False):
+        """
+        Args:
+            cam (Picamera2): Started camera to read from.
+            side (str): 'left' or 'right'.
+            on_frame (callable): Called as on_frame(side, frame, timestamp_ns, lores_frame).
+            pool (FramePool, optional): Buffers to read frames into.
+            luma (bool): The camera is configured for YUV420, pass on the Y plane only.
+            lores (bool): The camera has a YUV420 lores stream to read as well.
+        """
+        self.cam = cam
+        self.side = side
+        self.on_frame = on_frame
+        self.pool = pool
+        self.luma = luma
+        self.lores = lores
+        self.logger = logging.getLogger()
+        self.running = threading.Event()
+        self.thread = None
+        self.frame_count = 0
+        # Shape and dtype of the last frame, the size of the next buffer
+        self.format = None
+        try:
+            self.reads_into = "out" in inspect.signature(cam.capture_array).parameters
+        except (TypeError, ValueError):
+            self.reads_into = False
+
+    def buffer(self):
+        """
+        Returns:
+            numpy.ndarray: A pool buffer for the next frame, or None if it has to be allocated.
+        """
+        if self.pool is None or self.format is None:
+            return None
+        return self.pool.acquire(*self.format)
+
+    def read_request(self, request, out):
+        if out is not None and MappedArray is not None:
+            with MappedArray(request, "main") as mapped:
+                if mapped.array.shape == out.shape:
+                    np.copyto(out, mapped.array)
+                    return out
+        return request.make_array("main")
+
+    def grab(self):
+        """
+        Reads one frame from the camera.
+
+        Uses the sensor timestamp from the request metadata when the backend
+        provides one, otherwise stamps the frame when the read returns. Either
+        way the timestamp is on the time.monotonic_ns() clock.
+
+        Returns:
+            tuple: (frame, timestamp_ns, lores_frame), lores_frame None without a lores stream.
+        """
+        out = self.buffer()
+        try:
+            frame, timestamp, lores = self._grab(out)
+        except Exception:
+            if out is not None:
+                self.pool.release(out)
+            raise
+        if out is not None and frame is not out:
+            # The backend allocated the frame after all
+            self.pool.release(out)
+        if frame is not None:
+            self.format = (frame.shape, frame.dtype)
+            if self.pool is not None and frame is not out:
+                self.pool.note_unpooled()
+            if self.luma:
+                frame = luma_plane(frame)
+        if lores is not None:
+            lores = lores_image(lores, self.luma)
+        return frame, timestamp, lores
+
+    def _grab(self, out):
+        if hasattr(self.cam, "capture_request"):
+            request = self.cam.capture_request()
+            try:
+                frame = self.read_request(request, out)
+                lores = request.make_array("lores") if self.lores else None
+                timestamp = request.get_metadata().get("SensorTimestamp")
+            finally:
+                request.release()
+            if timestamp is None:
+                return frame, time.monotonic_ns(), lores
+            # Sensor timestamps count from boot, including time spent suspended
+            return frame, timestamp - (time.clock_gettime_ns(time.CLOCK_BOOTTIME) - time.monotonic_ns()), lores
+        if out is not None and self.reads_into:
+            frame = self.cam.capture_array(out=out)
+        else:
+            frame = self.cam.capture_array()
+        timestamp = time.monotonic_ns()
+        # Backends without requests hand out the lores frame of the last main one
+        lores = self.cam.capture_array("lores") if self.lores and frame is not None else None
+        return frame, timestamp, lores
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name=f"grabber-{self.side}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    def loop(self):
+        while self.running.is_set():
+            try:
+                frame, timestamp, lores = self.grab()
+            except Exception as e:
+                self.logger.error(f"Error reading {self.side} camera: {e}")
+                time.sleep(0.01)
+                continue
+            if frame is None:
+                continue
+            self.frame_count += 1
+            self.on_frame(self.side, frame, timestamp, lores)
+
+
+class StereoCapture:
+    """
+    Capture engine running one FrameGrabber per sensor and pairing their frames
+    by capture timestamp.
+
+    A left and a right frame form a pair when their timestamps differ by no more
+    than the sync tolerance. Frames that can no longer be matched are dropped and
+    counted per eye.
+
+    With a FramePool, the buffers of a pair are held while on_pair runs and
+    while the pair is the latest one, and go back to the pool after that;
+    dropped frames go back right away. Lores frames travel with their main
+    frame and end up in the pair's lores attribute.
+    """
+
+    QUEUE_SIZE = 4
+
+    def __init__(self, cam_left, cam_right, fps, tolerance_ms=None, on_pair=None, pool=None, luma=False,
+                 lores=False):
+        """
+        Args:
+            cam_left (Picamera2): Left camera.
+            cam_right (Picamera2): Right camera.
+            fps (float): Configured frame rate, used for the default tolerance.
+            tolerance_ms (float, optional): Maximum left/right skew of a pair.
+                Defaults to half a frame period.
+            on_pair (callable, optional): Called with every new StereoFrame. Its
+                frames are only valid during the call when capturing into a pool.
+            pool (FramePool, optional): Recycled buffers to capture into.
+            luma (bool): The cameras deliver YUV420, pair their Y planes only.
+            lores (bool): Read the cameras' lores stream along with the main one.
+        """
+        self.cam_left = cam_left
+        self.cam_right = cam_right
+        self.fps = fps
+        if tolerance_ms is None:
+            tolerance_ms = 500.0 / fps
+        self.tolerance = int(tolerance_ms * 1e6)
+        self.on_pair = on_pair
+        self.pool = pool
+        self.logger = logging.getLogger()
+
+        self.cond = threading.Condition()
+        self.pending = {"left": deque(maxlen=self.QUEUE_SIZE), "right": deque(maxlen=self.QUEUE_SIZE)}
+        self.latest = None
+        self.seq = 0
+        self.dropped = {"left": 0, "right": 0}
+        self.skew_sum = 0
+        self.max_skew = 0
+        self.started_at = None
+        self.start_seq = 0
+
+        self.grabbers = [
+            FrameGrabber(cam_left, "left", self._on_frame, pool, luma, lores),
+            FrameGrabber(cam_right, "right", self._on_frame, pool, luma, lores),
+        ]
+
+    def start(self):
+        """Starts both sensors and their grabber threads."""
+        with self.cond:
+            for side in self.pending:
+                self._clear(side)
+            self.started_at = time.monotonic()
+            self.start_seq = self.seq
+        self.cam_left.start()
+        self.cam_right.start()
+        for grabber in self.grabbers:
+            grabber.start()
+
+    def stop(self):
+        """Stops the grabber threads and both sensors."""
+        for grabber in self.grabbers:
+            grabber.stop()
+        self.cam_left.stop()
+        self.cam_right.stop()
+        with self.cond:
+            self.started_at = None
+            self.cond.notify_all()
+
+    def is_running(self):
+        return self.started_at is not None
+
+    def _release(self, *frames):
+        if self.pool is not None:
+            for frame in frames:
+                self.pool.release(frame)
+
+    def _clear(self, side):
+        while self.pending[side]:
+            self._release(self.pending[side].popleft()[0])
+
+    def _on_frame(self, side, frame, timestamp, lores=None):
+        pairs = []
+        with self.cond:
+            if len(self.pending[side]) == self.QUEUE_SIZE:
+                # Pushed out of the full queue below
+                self._release(self.pending[side][0][0])
+                self.dropped[side] += 1
+            self.pending[side].append((frame, timestamp, lores))
+            left, right = self.pending["left"], self.pending["right"]
+            while left and right:
+                dt = right[0][1] - left[0][1]
+                if abs(dt) <= self.tolerance:
+                    frame_l, ts_l, lores_l = left.popleft()
+                    frame_r, ts_r, lores_r = right.popleft()
+                    self.seq += 1
+                    lores = (lores_l, lores_r) if lores_l is not None and lores_r is not None else None
+                    pair = StereoFrame(frame_l, frame_r, self.seq, ts_l, ts_r, lores)
+                    self.skew_sum += abs(dt)
+                    self.max_skew = max(self.max_skew, abs(dt))
+                    if self.latest is not None:
+                        self._release(self.latest.left, self.latest.right)
+                    # The pair keeps the capture's reference while it is the latest one
+                    self.latest = pair
+                    if self.pool is not None:
+                        self.pool.retain(frame_l)
+                        self.pool.retain(frame_r)
+                    pairs.append(pair)
+                elif dt > 0:
+                    # Left frame is older than anything the right camera can still deliver
+                    self._release(left.popleft()[0])
+                    self.dropped["left"] += 1
+                else:
+                    self._release(right.popleft()[0])
+                    self.dropped["right"] += 1
+            if pairs:
+                self.cond.notify_all()
+
+        for pair in pairs:
+            try:
+                if self.on_pair:
+                    self.on_pair(pair)
+            finally:
+                self._release(pair.left, pair.right)
+
+    def read(self, last_seq=0, timeout=1.0):
+        """
+        Waits for a pair newer than last_seq.
+
+        Args:
+            last_seq (int): Sequence number of the last pair seen by the caller.
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            StereoFrame: The newest pair, or None on timeout.
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: (self.latest is not None and self.latest.seq > last_seq) or not self.is_running(),
+                timeout=timeout
+            )
+            if self.latest is not None and self.latest.seq > last_seq:
+                return self.latest
+            return None
+
+    def get_stats(self):
+        """
+        Returns synchronization statistics.
+
+        Returns:
+            dict: Pair count, achieved fps, skew and dropped frames per eye.
+        """
+        with self.cond:
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0
+            return {
+                "pairs": self.seq,
+                "fps": (self.seq - self.start_seq) / elapsed if elapsed else 0.0,
+                "tolerance_ms": self.tolerance / 1e6,
+                "last_skew_ms": self.latest.skew / 1e6 if self.latest else None,
+                "mean_skew_ms": self.skew_sum / self.seq / 1e6 if self.seq else None,
+                "max_skew_ms": self.max_skew / 1e6,
+                "dropped": dict(self.dropped),
+                "pool": self.pool.get_stats() if self.pool is not None else None,
+            }
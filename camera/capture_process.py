@@ -0,0 +1,316 @@
+import logging
+import threading
+import multiprocessing
+from camera.capture import StereoCapture, LUMA_FORMATS
+from camera.shared_ring import SharedFrameRing
+from camera.frame_pool import FramePool
+from config.settings import RING_SLOTS, CAPTURE_PROCESS_TIMEOUT, CAPTURE_PROCESS_MAX_SIZE, LORES_SIZE
+
+# Bytes per pixel of the frames published for each Picamera2 format, to size the shared slots
+# (only the Y plane of YUV420)
+FORMAT_CHANNELS = {"RGB888": 3, "BGR888": 3, "XRGB8888": 4, "XBGR8888": 4, "YUV420": 1}
+# Most bytes per pixel of a published lores frame, BGR
+LORES_CHANNELS = 3
+
+
+def run(conn, camera_ids, main, controls, fps, tolerance_ms, lores=None):
+    """
+    Main function of the capture process: opens both sensors, then runs the
+    StereoCapture engine into the shared frame ring on command of the parent.
+
+    Commands arrive on conn as tuples and each gets a ("ok", result) or
+    ("error", message) reply:
+        ("start", ring_name, lores_ring_name): Attach to the rings if needed and
+            start capturing. lores_ring_name is None without a lores stream.
+        ("stop",): Stop capturing.
+        ("stats",): Synchronization statistics of the capture engine.
+        ("configure", key, main, lores, controls, fps): Switch both sensors to
+            another mode, restarting capture if it was running. Configurations
+            are built once per key and cached. If a sensor rejects its new
+            configuration, the previous mode is restored before the error reply.
+        ("close",): Stop, close the sensors and exit.
+    """
+    # Imported here: the camera backend is only opened in this process
+    from camera.camera import Picamera2
+    logger = logging.getLogger()
+    try:
+        cams = []
+        # Configurations the sensors are in, to go back to if a mode switch fails
+        active = []
+        for cam_id in camera_ids:
+            cam = Picamera2(cam_id)
+            active.append(cam.create_video_configuration(main=main, lores=lores, controls=controls))
+            cam.configure(active[-1])
+            cams.append(cam)
+    except Exception as e:
+        conn.send(("error", f"Error initializing cameras: {e}"))
+        return
+
+    ring = None
+    lores_ring = None
+
+    def publish(pair):
+        try:
+            ring.write(pair.left, pair.right, pair.ts_left, pair.ts_right)
+            if pair.lores is not None and lores_ring is not None:
+                lores_ring.write(pair.lores[0], pair.lores[1], pair.ts_left, pair.ts_right)
+        except ValueError as e:
+            logger.error(f"Dropping frame {pair.seq}: {e}")
+
+    cam_left, cam_right = cams
+    pool = FramePool()
+    # Built configurations of both sensors by mode
+    configs = {}
+
+    def create_capture(main, lores, fps):
+        return StereoCapture(
+            cam_left, cam_right, fps, tolerance_ms, on_pair=publish, pool=pool,
+            luma=main.get("format") in LUMA_FORMATS, lores=lores is not None
+        )
+
+    def configure(key, main, lores, controls, fps):
+        nonlocal capture, active
+        cached = key in configs
+        new = configs[key] if cached else [
+            cam.create_video_configuration(main=main, lores=lores, controls=controls) for cam in cams
+        ]
+        running = capture.is_running()
+        head = None
+        if running:
+            capture.stop()
+            # The last frame of the old mode
+            head = ring.head
+        try:
+            for cam, config in zip(cams, new):
+                cam.configure(config)
+        except Exception:
+            # Back to the previous mode before reporting the error
+            for cam, config in zip(cams, active):
+                cam.configure(config)
+            if running:
+                capture.start()
+            raise
+        configs[key] = active = new
+        capture = create_capture(main, lores, fps)
+        if running:
+            capture.start()
+        return {"size": tuple(main["size"]), "fps": fps, "cached": cached, "head": head}
+
+    fps = getattr(cam_left, "fps", None) or fps
+    capture = create_capture(main, lores, fps)
+    conn.send(("ok", {"size": tuple(getattr(cam_left, "frame_size", main["size"])), "fps": fps}))
+    try:
+        while True:
+            command, *args = conn.recv()
+            if command == "close":
+                break
+            try:
+                result = None
+                if command == "start":
+                    if ring is None:
+                        ring = SharedFrameRing.attach(args[0])
+                        if args[1] is not None:
+                            lores_ring = SharedFrameRing.attach(args[1])
+                    capture.start()
+                elif command == "stop":
+                    capture.stop()
+                elif command == "stats":
+                    result = capture.get_stats()
+                elif command == "configure":
+                    result = configure(*args)
+                else:
+                    raise ValueError(f"Unknown command {command}")
+                conn.send(("ok", result))
+            except Exception as e:
+                conn.send(("error", str(e)))
+    except (EOFError, OSError):
+        # The parent is gone
+        pass
+    finally:
+        if capture.is_running():
+            capture.stop()
+        for cam in cams:
+            cam.close()
+        for shared in (ring, lores_ring):
+            if shared is not None:
+                shared.release()
+    try:
+        conn.send(("ok", None))
+    except (EOFError, OSError):
+        pass
+
+
+class CaptureProcess:
+    """
+    Runs the capture loop in a child process, so that capture doesn't compete
+    for the GIL with encoding, socket I/O and command handling.
+
+    The child owns both sensors and writes every synchronized pair into a
+    SharedFrameRing created here, and its lores frames into a second one if
+    there is a lores stream; the server reads them with ordinary
+    RingReaders and other processes can attach to it by name. Offers the
+    start()/stop()/is_running()/get_stats() interface of StereoCapture.
+    """
+
+    def __init__(self, camera_ids, main, controls, fps, tolerance_ms=None, ring_slots=RING_SLOTS,
+                 timeout=CAPTURE_PROCESS_TIMEOUT, lores=None, max_size=CAPTURE_PROCESS_MAX_SIZE):
+        """
+        Starts the process and waits until it has opened the sensors.
+
+        Args:
+            camera_ids (tuple): (left, right) camera IDs.
+            main (dict): Picamera2 main stream configuration, size and format.
+            controls (dict): Picamera2 controls.
+            fps (float): Configured frame rate.
+            tolerance_ms (float, optional): Maximum left/right skew of a pair.
+            ring_slots (int): Number of shared stereo frame slots.
+            timeout (float): Maximum time to wait for an answer of the process (s).
+            lores (dict, optional): Picamera2 lores stream configuration, size and format.
+            max_size (tuple, optional): Largest (width, height) of the modes configure()
+                can switch to, which the shared slots are sized for. The first mode by default.
+
+        Raises:
+            RuntimeError: If the process couldn't open the sensors.
+        """
+        self.logger = logging.getLogger()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.running = False
+        self.ring = None
+        self.lores_ring = None
+        # Spawned rather than forked: the camera stack doesn't survive a fork of a threaded process
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=run, args=(child_conn, camera_ids, main, controls, fps, tolerance_ms, lores),
+            name="stereo-capture", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        try:
+            info = self.reply()
+        except RuntimeError:
+            self.process.join(timeout=1)
+            raise
+        self.size = tuple(info["size"])
+        self.fps = info["fps"]
+        if max_size:
+            width, height = max_size
+            capacity = width * height * max(FORMAT_CHANNELS.values())
+        else:
+            width, height = self.size
+            capacity = width * height * FORMAT_CHANNELS.get(main.get("format"), 4)
+        self.ring = SharedFrameRing(ring_slots, capacity)
+        if lores:
+            # Lores frames are published as their Y plane or as BGR, see lores_image(). They are
+            # clamped to the main size, so a later mode can bring them up to LORES_SIZE.
+            width, height = (max(a, b) for a, b in zip(lores["size"], LORES_SIZE or lores["size"]))
+            self.lores_ring = SharedFrameRing(ring_slots, width * height * LORES_CHANNELS)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def reply(self):
+        if not self.conn.poll(self.timeout):
+            raise RuntimeError("Capture process is not answering")
+        status, result = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def request(self, *command):
+        """
+        Sends a command to the process and waits for its result.
+
+        Raises:
+            RuntimeError: If the process failed the command or didn't answer in time.
+        """
+        with self.lock:
+            try:
+                self.conn.send(command)
+            except (EOFError, OSError):
+                raise RuntimeError("Capture process has exited")
+            return self.reply()
+
+    def start(self):
+        """Starts both sensors in the capture process."""
+        self.request("start", self.ring.name, self.lores_ring.name if self.lores_ring else None)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        self.request("stop")
+
+    def is_running(self):
+        return self.running
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: StereoCapture statistics of the process, with its pid and ring names.
+        """
+        stats = self.request("stats")
+        stats["process"] = {"pid": self.pid, "ring": self.ring.name,
+                            "lores_ring": self.lores_ring.name if self.lores_ring else None}
+        return stats
+
+    def fits(self, main, lores=None):
+        """
+        Args:
+            main (dict): Picamera2 main stream configuration of a mode.
+            lores (dict, optional): Its lores stream configuration.
+
+        Returns:
+            bool: Whether frames of the mode fit the shared slots of both rings.
+        """
+        width, height = main["size"]
+        if width * height * FORMAT_CHANNELS.get(main["format"], 4) > self.ring.capacity:
+            return False
+        if lores:
+            width, height = lores["size"]
+            return self.lores_ring is not None and width * height * LORES_CHANNELS <= self.lores_ring.capacity
+        return True
+
+    def configure(self, key, main, lores, controls, fps):
+        """
+        Switches both sensors to another mode, see run().
+
+        Args:
+            key (tuple): Identifies the mode in the process' configuration cache.
+            main (dict): Picamera2 main stream configuration, size and format.
+            lores (dict): Picamera2 lores stream configuration, None for none.
+            controls (dict): Picamera2 controls.
+            fps (float): Frame rate of the mode.
+
+        Returns:
+            dict: Size and fps of the mode, whether its configurations were cached and
+            the ring head when capture stopped (None if it wasn't running).
+
+        Raises:
+            ValueError: If the mode's frames don't fit the shared slots.
+            RuntimeError: If the process failed to switch.
+        """
+        if not self.fits(main, lores):
+            raise ValueError(f"{main['size'][0]}x{main['size'][1]} {main['format']} frames or their lores frames "
+                             f"don't fit the capture process' shared slots, see CAPTURE_PROCESS_MAX_SIZE")
+        result = self.request("configure", key, main, lores, controls, fps)
+        self.size = tuple(result["size"])
+        self.fps = result["fps"]
+        return result
+
+    def close(self):
+        """Stops the process and removes the shared rings."""
+        self.running = False
+        if self.process.is_alive():
+            try:
+                self.request("close")
+            except RuntimeError as e:
+                self.logger.error(f"Error closing capture process: {e}")
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        for ring in (self.ring, self.lores_ring):
+            if ring is not None:
+                ring.release()
@@ -0,0 +1,395 @@
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+from utils.command_handler import DepthOptions
+from config.settings import DEPTH_TILE_SIZE, DEPTH_CHANGE_THRESHOLD, DEPTH_REFRESH_FRAMES, DEPTH_MAX_CHANGED
+
+
+class DepthFrame:
+    """
+    Disparity and depth of one stereo frame.
+
+    The maps cover the region of interest at the engine's downscaled
+    resolution; focal, cx and cy describe that pixel grid, so a pixel (u, v)
+    of the maps looks along ((u - cx) / focal, (v - cy) / focal, 1).
+
+    Attributes:
+        seq (int): Sequence number of the stereo frame.
+        timestamp (int): Capture timestamp of the stereo frame (ns).
+        disparity (numpy.ndarray): float32 disparity (px), <= 0 where there is no match.
+        depth (numpy.ndarray): float32 depth along the optical axis (mm), 0 where invalid.
+        roi (tuple): (x, y, width, height) of the full-size frame covered by the maps.
+        scale (float): Downscale factor of the maps relative to the full-size frame.
+        focal (float): Focal length at the maps' resolution (px).
+        cx, cy (float): Principal point in the maps' pixel grid.
+        baseline (float): Stereo baseline (mm).
+        compute_ms (float): Time taken to compute the maps.
+        left (numpy.ndarray): Full-size rectified left image the maps were computed from.
+        recomputed (float): Fraction of the map matched for this frame, the rest
+            was reused from the previous one.
+    """
+
+    def __init__(self, seq, timestamp, disparity, depth, roi, scale, focal, cx, cy, baseline, compute_ms, left=None,
+                 recomputed=1.0):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.disparity = disparity
+        self.depth = depth
+        self.roi = roi
+        self.scale = scale
+        self.focal = focal
+        self.cx = cx
+        self.cy = cy
+        self.baseline = baseline
+        self.compute_ms = compute_ms
+        self.left = left
+        self.recomputed = recomputed
+
+    @property
+    def valid(self):
+        """Mask of the pixels with a depth."""
+        return self.depth > 0
+
+    def to_dict(self, disparity=False):
+        """
+        Wire format of GET_DEPTH: depth as uint16 millimetres, which halves the
+        size and is exact enough for the working range.
+        """
+        data = {
+            "seq": self.seq,
+            "timestamp": self.timestamp,
+            "depth": np.clip(np.rint(self.depth), 0, 65535).astype(np.uint16),
+            "roi": self.roi,
+            "scale": self.scale,
+            "focal": self.focal,
+            "cx": self.cx,
+            "cy": self.cy,
+            "baseline": self.baseline,
+            "compute_ms": self.compute_ms,
+            "recomputed": self.recomputed,
+        }
+        if disparity:
+            data["disparity"] = self.disparity
+        return data
+
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class DisparityEngine:
+    """
+    Computes disparity and depth from rectified stereo pairs with OpenCV's
+    block matcher or semi-global matcher.
+
+    Matching runs on grayscale images downscaled by options.scale and
+    restricted to the region of interest, plus the margin to its left that
+    the disparity search needs. Depth is focal * baseline / disparity with
+    the rectified calibration (see camera/rectification.py), in millimetres.
+    """
+
+    def __init__(self, options: DepthOptions = None):
+        self.options = (options or DepthOptions()).validate()
+        self.matcher = self.create_matcher(self.options)
+
+    @staticmethod
+    def create_matcher(options):
+        block_size = int(options.block_size)
+        if options.algorithm == DepthOptions.ALGORITHM_BM:
+            matcher = cv2.StereoBM_create(numDisparities=int(options.num_disparities), blockSize=block_size)
+            matcher.setMinDisparity(int(options.min_disparity))
+            return matcher
+        return cv2.StereoSGBM_create(
+            minDisparity=int(options.min_disparity),
+            numDisparities=int(options.num_disparities),
+            blockSize=block_size,
+            P1=8 * block_size * block_size,
+            P2=32 * block_size * block_size,
+            disp12MaxDiff=1,
+            uniquenessRatio=10,
+            speckleWindowSize=100,
+            speckleRange=2,
+            mode=cv2.STEREO_SGBM_MODE_SGBM_3WAY,
+        )
+
+    def region(self, width, height):
+        """
+        Returns:
+            tuple: (x, y, width, height) of the region of interest, clipped to the frame.
+        """
+        if self.options.roi is None:
+            return 0, 0, width, height
+        x, y, w, h = (int(v) for v in self.options.roi)
+        x, y = min(x, width - 1), min(y, height - 1)
+        return x, y, min(w, width - x), min(h, height - y)
+
+    def prepare(self, image, scale):
+        image = to_gray(image)
+        if scale != 1:
+            height, width = image.shape[:2]
+            image = cv2.resize(image, (max(1, int(width / scale)), max(1, int(height / scale))),
+                               interpolation=cv2.INTER_AREA)
+        return image
+
+    def compute(self, frame, maps):
+        """
+        Args:
+            frame (StereoFrame): Rectified stereo pair.
+            maps (RectificationMaps): Rectification of the pair, for the focal length,
+                principal point and baseline.
+
+        Returns:
+            DepthFrame: Disparity and depth of the region of interest.
+        """
+        start = time.perf_counter()
+        options = self.options
+        scale = float(options.scale)
+        height, width = frame.left.shape[:2]
+        x, y, w, h = self.region(width, height)
+
+        # Crop rows first so only the region of interest gets converted and resized
+        left = self.prepare(frame.left[y:y + h], scale)
+        right = self.prepare(frame.right[y:y + h], scale)
+        x0, x1 = int(x / scale), int((x + w) / scale)
+        # Pixels left of the ROI are needed to match its left edge
+        margin = min(x0, self.search_width)
+        disparity, recomputed = self.match(left[:, x0 - margin:x1], right[:, x0 - margin:x1])
+        disparity = disparity[:, margin:]
+
+        focal = maps.focal / scale
+        depth = np.zeros_like(disparity)
+        # Unmatched pixels are marked min_disparity - 1, which is positive for min_disparity > 1
+        valid = (disparity >= int(options.min_disparity)) & (disparity > 0)
+        depth[valid] = focal * maps.baseline / disparity[valid]
+
+        compute_ms = (time.perf_counter() - start) * 1000
+        return DepthFrame(
+            frame.seq, frame.timestamp, disparity, depth, (x, y, w, h), scale, focal,
+            maps.P1[0, 2] / scale - x0, (maps.P1[1, 2] - y) / scale, maps.baseline, compute_ms, frame.left,
+            recomputed
+        )
+
+    @property
+    def search_width(self):
+        """Columns to the left of a pixel that its disparity search looks at."""
+        return int(self.options.min_disparity) + int(self.options.num_disparities)
+
+    def match(self, left, right):
+        """
+        Matches a pair of prepared grayscale images.
+
+        Returns:
+            tuple: (float32 disparity in px, fraction of it computed for this pair).
+        """
+        return self.matcher.compute(left, right).astype(np.float32) / 16.0, 1.0
+
+
+class IncrementalDisparityEngine(DisparityEngine):
+    """
+    DisparityEngine reusing the previous disparity where the scene is static.
+
+    Both images are compared with the previous pair tile by tile; only tiles
+    whose mean absolute grey-level change exceeds change_threshold (and
+    their neighbours, which the matching window reaches into) are matched
+    again, one horizontal run of tiles at a time. Everything is matched
+    again every refresh_frames frames, and whenever more than max_changed
+    of the tiles moved, since matching many small runs is then slower than
+    one pass over the frame.
+    """
+
+    def __init__(self, options: DepthOptions = None, tile_size=DEPTH_TILE_SIZE, change_threshold=DEPTH_CHANGE_THRESHOLD,
+                 refresh_frames=DEPTH_REFRESH_FRAMES, max_changed=DEPTH_MAX_CHANGED):
+        super().__init__(options)
+        self.tile_size = tile_size
+        self.change_threshold = change_threshold
+        self.refresh_frames = refresh_frames
+        self.max_changed = max_changed
+        self.previous = None
+        self.since_full = 0
+        self.full_recomputes = 0
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+
+    def reset(self):
+        """Forgets the previous frame, so the next one is matched in full."""
+        self.previous = None
+
+    def changed_tiles(self, left, right):
+        """
+        Returns:
+            numpy.ndarray: Boolean mask with one entry per tile, True where either image changed.
+        """
+        prev_left, prev_right, _ = self.previous
+        diff = cv2.max(cv2.absdiff(left, prev_left), cv2.absdiff(right, prev_right))
+        height, width = diff.shape
+        tiles = (-(-width // self.tile_size), -(-height // self.tile_size))
+        means = cv2.resize(diff.astype(np.float32), tiles, interpolation=cv2.INTER_AREA)
+        changed = (means > self.change_threshold).astype(np.uint8)
+        return cv2.dilate(changed, self.kernel) > 0
+
+    def match(self, left, right):
+        previous = self.previous
+        if (previous is None or previous[0].shape != left.shape or self.since_full + 1 >= self.refresh_frames):
+            return self.match_full(left, right)
+        changed = self.changed_tiles(left, right)
+        fraction = float(changed.mean())
+        if fraction > self.max_changed:
+            return self.match_full(left, right)
+
+        disparity = previous[2].copy()
+        tile = self.tile_size
+        height, width = left.shape
+        pad = int(self.options.block_size) // 2 + 1
+        for row in np.flatnonzero(changed.any(axis=1)):
+            y0, y1 = row * tile, min(height, (row + 1) * tile)
+            sy0, sy1 = max(0, y0 - pad), min(height, y1 + pad)
+            columns = np.flatnonzero(changed[row])
+            # Split the row into runs of adjacent changed tiles
+            for run in np.split(columns, np.flatnonzero(np.diff(columns) > 1) + 1):
+                x0, x1 = run[0] * tile, min(width, (run[-1] + 1) * tile)
+                sx0 = max(0, x0 - self.search_width)
+                strip = self.matcher.compute(left[sy0:sy1, sx0:x1], right[sy0:sy1, sx0:x1])
+                disparity[y0:y1, x0:x1] = strip[y0 - sy0:y1 - sy0, x0 - sx0:].astype(np.float32) / 16.0
+        self.previous = (left.copy(), right.copy(), disparity)
+        self.since_full += 1
+        return disparity, fraction
+
+    def match_full(self, left, right):
+        disparity, _ = super().match(left, right)
+        self.previous = (left.copy(), right.copy(), disparity)
+        self.since_full = 0
+        self.full_recomputes += 1
+        return disparity, 1.0
+
+
+def create_engine(options: DepthOptions = None):
+    """
+    Returns:
+        DisparityEngine: The engine for the options, incremental if they ask for it.
+    """
+    if options is not None and options.incremental:
+        return IncrementalDisparityEngine(options)
+    return DisparityEngine(options)
+
+
+class DepthStage:
+    """
+    Pipeline stage computing depth in its own worker thread.
+
+    The worker reads the newest frame from the frame ring, rectifies it and
+    runs the DisparityEngine on it. Frames arriving while it is busy are
+    skipped, so depth never holds up capture or the other consumers, and
+    get() always returns the newest result.
+    """
+
+    def __init__(self, camera, options: DepthOptions = None):
+        """
+        Args:
+            camera (Camera): Camera providing the frames and their rectification.
+            options (DepthOptions, optional): Engine options.
+        """
+        self.camera = camera
+        self.engine = create_engine(options)
+        self.logger = logging.getLogger()
+        self.cond = threading.Condition()
+        self.latest = None
+        self.frames = 0
+        self.compute_time = 0.0
+        self.recomputed = 0.0
+        self.first_ts = None
+        self.reader = None
+        self.running = threading.Event()
+        self.thread = None
+
+    @property
+    def options(self):
+        return self.engine.options
+
+    def start(self):
+        self.reader = self.camera.open_reader("depth")
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name="depth", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.reader:
+            self.camera.close_reader(self.reader)
+            self.reader = None
+        with self.cond:
+            self.cond.notify_all()
+
+    def is_running(self):
+        return self.running.is_set()
+
+    def loop(self):
+        while self.running.is_set():
+            try:
+                frame = self.reader.read(latest=True)
+                if frame is None:
+                    continue
+                # Rectifying copies the frame out of the ring
+                frame = self.camera.rectify(frame)
+                if frame is None:
+                    continue
+                height, width = frame.left.shape[:2]
+                result = self.engine.compute(frame, self.camera.rectifier.maps((width, height)))
+            except Exception as e:
+                self.logger.error(f"Error computing depth: {e}")
+                continue
+            with self.cond:
+                self.latest = result
+                self.frames += 1
+                self.compute_time += result.compute_ms
+                self.recomputed += result.recomputed
+                if self.first_ts is None:
+                    self.first_ts = time.monotonic_ns()
+                self.cond.notify_all()
+
+    def get(self, after_seq=None, timeout=1.0):
+        """
+        Returns the newest depth frame, waiting for one newer than after_seq.
+
+        Returns:
+            DepthFrame: The frame, or None if none arrived in time.
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: not self.running.is_set() or (
+                    self.latest is not None and (after_seq is None or self.latest.seq > after_seq)
+                ),
+                timeout=timeout
+            )
+            latest = self.latest
+        if latest is None or (after_seq is not None and latest.seq <= after_seq):
+            return None
+        return latest
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Frames computed, depth rate, last and mean compute time,
+            frames skipped while the engine was busy, and the last and mean
+            fraction of the map matched per frame.
+        """
+        with self.cond:
+            latest = self.latest
+            span = (time.monotonic_ns() - self.first_ts) / 1e9 if self.first_ts else 0
+            return {
+                "running": self.running.is_set(),
+                "options": self.options.to_dict(),
+                "frames": self.frames,
+                "fps": (self.frames - 1) / span if span and self.frames > 1 else None,
+                "compute_ms": latest.compute_ms if latest else None,
+                "mean_compute_ms": self.compute_time / self.frames if self.frames else None,
+                "skipped": self.reader.dropped if self.reader else 0,
+                "recomputed": latest.recomputed if latest else None,
+                "mean_recomputed": self.recomputed / self.frames if self.frames else None,
+                "full_recomputes": getattr(self.engine, "full_recomputes", self.frames),
+            }
@@ -0,0 +1,115 @@
+import threading
+import numpy as np
+from config.settings import FRAME_POOL_SIZE
+
+
+class FramePool:
+    """
+    Recycled single-eye frame buffers for the capture loop, so that grabbing a
+    frame doesn't allocate a new ~1.5 MB array every time.
+
+    Buffers are reference counted: acquire() hands one out with one reference,
+    every further consumer retain()s it and each one release()s it when done.
+    Once the count drops to zero the buffer goes back to the free list. The
+    pool grows up to its size on demand; when all buffers are in use acquire()
+    returns None and the caller falls back to a fresh array, which is counted
+    as an exhaustion. Views of a pool buffer stand for the buffer in retain()
+    and release(), arrays that aren't from the pool are ignored, so they can
+    all flow through the same code.
+    """
+
+    def __init__(self, size=FRAME_POOL_SIZE):
+        """
+        Args:
+            size (int): Most buffers the pool allocates.
+        """
+        self.size = size
+        self.lock = threading.Lock()
+        self.shape = None
+        self.dtype = None
+        self.free = []
+        # Pool buffers by id(), with their reference counts
+        self.buffers = {}
+        self.refs = {}
+        self.allocated = 0
+        self.reused = 0
+        self.exhausted = 0
+        self.unpooled = 0
+
+    def acquire(self, shape, dtype):
+        """
+        Returns:
+            numpy.ndarray: A buffer of the given shape and dtype with one
+            reference, or None if all buffers are in use.
+        """
+        dtype = np.dtype(dtype)
+        with self.lock:
+            if (tuple(shape), dtype) != (self.shape, self.dtype):
+                # New frame format: buffers of the old one are dropped as they come back
+                for buffer in self.free:
+                    del self.buffers[id(buffer)]
+                self.free = []
+                self.shape, self.dtype = tuple(shape), dtype
+            if self.free:
+                buffer = self.free.pop()
+                self.reused += 1
+            elif len(self.buffers) < self.size:
+                buffer = np.empty(shape, dtype)
+                self.buffers[id(buffer)] = buffer
+                self.allocated += 1
+            else:
+                self.exhausted += 1
+                return None
+            self.refs[id(buffer)] = 1
+            return buffer
+
+    def _owner(self, array):
+        # The pool buffer an array is, or is a view of
+        while array is not None and id(array) not in self.refs:
+            array = getattr(array, "base", None)
+        return array
+
+    def retain(self, buffer):
+        """Adds a reference to a pool buffer."""
+        with self.lock:
+            buffer = self._owner(buffer)
+            if buffer is not None:
+                self.refs[id(buffer)] += 1
+
+    def release(self, buffer):
+        """Drops a reference to a pool buffer, freeing it with the last one."""
+        with self.lock:
+            buffer = self._owner(buffer)
+            if buffer is None:
+                return
+            key = id(buffer)
+            self.refs[key] -= 1
+            if self.refs[key] > 0:
+                return
+            del self.refs[key]
+            if buffer.shape == self.shape and buffer.dtype == self.dtype:
+                self.free.append(buffer)
+            else:
+                del self.buffers[key]
+
+    def note_unpooled(self):
+        """Counts a frame the backend had to allocate itself."""
+        with self.lock:
+            self.unpooled += 1
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Buffers allocated, reused, in use and free, acquisitions that
+            found the pool exhausted and frames allocated outside the pool.
+        """
+        with self.lock:
+            return {
+                "size": self.size,
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "in_use": len(self.refs),
+                "free": len(self.free),
+                "exhausted": self.exhausted,
+                "unpooled": self.unpooled,
+            }
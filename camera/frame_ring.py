@@ -0,0 +1,179 @@
+import threading
+import numpy as np
+from camera.capture import StereoFrame
+
+
+class StereoFrameRing:
+    """
+    Fixed-size ring of preallocated stereo frame slots.
+
+    A single capture loop copies every new pair into the next slot and any
+    number of RingReader objects consume from it, each tracking its own
+    position. Frames handed to readers are views into the slots, so a reader
+    has to finish with a frame (or copy it) before the writer wraps around to
+    that slot again.
+    """
+
+    def __init__(self, slots):
+        """
+        Args:
+            slots (int): Number of stereo frame slots.
+        """
+        self.slots = slots
+        self.cond = threading.Condition()
+        self.left = None
+        self.right = None
+        self.seqs = np.zeros(slots, dtype=np.int64)
+        self.ts_left = np.zeros(slots, dtype=np.int64)
+        self.ts_right = np.zeros(slots, dtype=np.int64)
+        self.head = 0
+        self.closed = False
+
+    def allocate(self, shape, dtype):
+        """
+        (Re)allocates the slots for frames of the given shape and dtype.
+        Any frames already in the ring are discarded.
+        """
+        with self.cond:
+            self.left = np.empty((self.slots,) + tuple(shape), dtype=dtype)
+            self.right = np.empty((self.slots,) + tuple(shape), dtype=dtype)
+            self.seqs[:] = 0
+
+    @property
+    def frame_shape(self):
+        return None if self.left is None else self.left.shape[1:]
+
+    def write(self, left, right, ts_left, ts_right):
+        """
+        Copies a stereo pair into the next slot and wakes up waiting readers.
+        Only the capture loop may call this.
+
+        Returns:
+            int: Sequence number assigned to the pair.
+        """
+        if self.left is None or self.left.shape[1:] != left.shape or self.left.dtype != left.dtype:
+            self.allocate(left.shape, left.dtype)
+
+        seq = self.head + 1
+        idx = seq % self.slots
+        # Invalidate the slot while it is being overwritten
+        self.seqs[idx] = 0
+        np.copyto(self.left[idx], left)
+        np.copyto(self.right[idx], right)
+
+        with self.cond:
+            self.ts_left[idx] = ts_left
+            self.ts_right[idx] = ts_right
+            self.seqs[idx] = seq
+            self.head = seq
+            self.cond.notify_all()
+        return seq
+
+    def get(self, seq):
+        """
+        Returns the frame with the given sequence number if it is still in the ring.
+
+        Returns:
+            StereoFrame: Views into the slot, or None if the slot was overwritten.
+        """
+        idx = seq % self.slots
+        if seq <= 0 or self.seqs[idx] != seq:
+            return None
+        return StereoFrame(self.left[idx], self.right[idx], seq, int(self.ts_left[idx]), int(self.ts_right[idx]))
+
+    def is_valid(self, frame):
+        """Whether the slot behind a frame still holds that frame."""
+        return self.seqs[frame.seq % self.slots] == frame.seq
+
+    def reader(self, name=None):
+        """
+        Creates an independent reader positioned at the newest frame.
+
+        Returns:
+            RingReader: The new reader.
+        """
+        return RingReader(self, name)
+
+    def close(self):
+        """Wakes up all readers; further reads return None until reopened."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def open(self):
+        with self.cond:
+            self.closed = False
+
+
+class RingReader:
+    """
+    A consumer of a StereoFrameRing with its own read position.
+
+    Attributes:
+        name (str): Name used in statistics.
+        position (int): Sequence number of the last frame read.
+        dropped (int): Frames overwritten before this reader got to them.
+    """
+
+    def __init__(self, ring, name=None):
+        self.ring = ring
+        self.name = name
+        self.position = ring.head
+        self.dropped = 0
+        self.frames_read = 0
+
+    def read(self, timeout=1.0, latest=False, out=None):
+        """
+        Waits for the next frame after this reader's position.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+            latest (bool): Skip straight to the newest frame instead of reading in order.
+            out (tuple, optional): (left, right) arrays to copy the frame into. When
+                given, the returned frame refers to these arrays instead of the slot.
+
+        Returns:
+            StereoFrame: The frame, or None on timeout or when the ring is closed.
+        """
+        ring = self.ring
+        with ring.cond:
+            ring.cond.wait_for(lambda: ring.head > self.position or ring.closed, timeout=timeout)
+            if ring.closed or ring.head <= self.position:
+                return None
+
+            if latest:
+                seq = ring.head
+            else:
+                seq = self.position + 1
+                # The slot after head may be getting overwritten right now
+                oldest = ring.head - ring.slots + 2
+                if seq < oldest:
+                    seq = max(oldest, 1)
+            self.dropped += seq - self.position - 1
+            self.position = seq
+            self.frames_read += 1
+            frame = ring.get(seq)
+
+        if frame is not None and out is not None:
+            np.copyto(out[0], frame.left)
+            np.copyto(out[1], frame.right)
+            if not ring.is_valid(frame):
+                return None
+            frame = StereoFrame(out[0], out[1], frame.seq, frame.ts_left, frame.ts_right)
+        return frame
+
+    def seek(self, seq):
+        """
+        Moves the read position, so that the next read() returns the frame after seq
+        (or the oldest one still in the ring).
+        """
+        with self.ring.cond:
+            self.position = seq
+
+    def get_stats(self):
+        return {
+            "position": self.position,
+            "frames_read": self.frames_read,
+            "dropped": self.dropped,
+            "lag": self.ring.head - self.position,
+        }
@@ -0,0 +1,170 @@
+import threading
+import cv2
+import numpy as np
+from camera import parameters
+
+# parameters.T_0_cam is given in cm, depth maps are in mm
+T_0_CAM_UNIT_MM = 10.0
+# Voxel grids up to this size are downsampled with a dense count instead of a sort
+DENSE_VOXELS = 1 << 22
+
+
+def base_transform(T_0_cam=parameters.T_0_cam, unit_mm=T_0_CAM_UNIT_MM):
+    """
+    Returns:
+        numpy.ndarray: 4x4 camera-to-robot-base transform with its translation in mm.
+    """
+    transform = np.array(T_0_cam, dtype=np.float64)
+    transform[:3, 3] *= unit_mm
+    return transform
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def pixel_grid(height, width):
+    """
+    Returns the pixel coordinates of an image size, built once per size.
+
+    Returns:
+        tuple: (u, v) float32 arrays of shape (height, width).
+    """
+    key = (height, width)
+    grid = _grids.get(key)
+    if grid is None:
+        v, u = np.indices((height, width), dtype=np.float32)
+        grid = (u, v)
+        with _grids_lock:
+            _grids[key] = grid
+    return grid
+
+
+def valid_depth(depth, min_depth=None, max_depth=None):
+    """
+    Returns:
+        numpy.ndarray: Mask of the pixels with a usable depth: positive, finite
+        and within [min_depth, max_depth] when given.
+    """
+    mask = np.isfinite(depth) & (depth > 0)
+    if min_depth is not None:
+        mask &= depth >= min_depth
+    if max_depth is not None:
+        mask &= depth <= max_depth
+    return mask
+
+
+def voxel_downsample(points, voxel_size):
+    """
+    Replaces the points of every occupied voxel by their centroid (and mean colour).
+
+    Args:
+        points (numpy.ndarray): Nx3 or Nx6 points, xyz first.
+        voxel_size (float): Edge of the voxels, in the unit of the points.
+
+    Returns:
+        numpy.ndarray: One point per occupied voxel.
+    """
+    if len(points) == 0:
+        return points
+    # One integer per voxel, built a column at a time (reductions along axis 0 are slow)
+    flat = None
+    voxels = 1
+    for column in range(3):
+        key = np.floor(points[:, column] / voxel_size).astype(np.int64)
+        key -= key.min()
+        size = int(key.max()) + 1
+        flat = key if flat is None else flat * size + key
+        voxels *= size
+    if voxels <= max(DENSE_VOXELS, 4 * len(points)):
+        # Small grid: count into every voxel directly instead of sorting the points
+        counts = np.bincount(flat)
+        occupied = np.flatnonzero(counts)
+        lookup = np.empty(len(counts), dtype=np.int64)
+        lookup[occupied] = np.arange(len(occupied))
+        inverse = lookup[flat]
+        counts = counts[occupied]
+    else:
+        _, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+    out = np.empty((len(counts), points.shape[1]), dtype=points.dtype)
+    for column in range(points.shape[1]):
+        out[:, column] = np.bincount(inverse, weights=points[:, column], minlength=len(counts)) / counts
+    return out
+
+
+def depth_to_points(depth, focal, cx, cy, colors=None, mask=None, transform=None, voxel_size=None):
+    """
+    Back-projects a depth map into a point cloud, without a per-pixel loop.
+
+    Args:
+        depth (numpy.ndarray): HxW depth along the optical axis (mm).
+        focal (float): Focal length of the depth map's pixel grid (px).
+        cx, cy (float): Principal point of the depth map's pixel grid.
+        colors (numpy.ndarray, optional): HxWx3 image aligned with the depth map,
+            adds its values as three more columns.
+        mask (numpy.ndarray, optional): Pixels to use, valid_depth(depth) by default.
+        transform (numpy.ndarray, optional): 4x4 transform applied to the points,
+            in mm; None keeps them in the camera frame.
+        voxel_size (float, optional): Downsample to one point per voxel of this size (mm).
+
+    Returns:
+        numpy.ndarray: float32 Nx3 (x, y, z) or Nx6 (x, y, z, c0, c1, c2) points.
+    """
+    height, width = depth.shape
+    if mask is None:
+        mask = valid_depth(depth)
+    u, v = pixel_grid(height, width)
+    z = depth[mask].astype(np.float32)
+    scale = z / np.float32(focal)
+    points = np.empty((len(z), 3 if colors is None else 6), dtype=np.float32)
+    points[:, 0] = (u[mask] - np.float32(cx)) * scale
+    points[:, 1] = (v[mask] - np.float32(cy)) * scale
+    points[:, 2] = z
+    if transform is not None:
+        transform = np.asarray(transform, dtype=np.float32)
+        points[:, :3] = points[:, :3] @ transform[:3, :3].T + transform[:3, 3]
+    if colors is not None:
+        points[:, 3:] = colors[mask]
+    if voxel_size:
+        points = voxel_downsample(points, voxel_size)
+    return points
+
+
+def colors_for(depth_frame, image):
+    """
+    Returns:
+        numpy.ndarray: The part of a full-size rectified image covered by a
+        depth frame, at the depth map's resolution.
+    """
+    x, y, w, h = depth_frame.roi
+    height, width = depth_frame.depth.shape
+    crop = image[y:y + h, x:x + w]
+    if crop.shape[:2] != (height, width):
+        crop = cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA)
+    if crop.ndim == 2:
+        crop = crop[:, :, None].repeat(3, axis=2)
+    return crop
+
+
+def point_cloud(depth_frame, colors=False, voxel_size=None, min_depth=None, max_depth=None, frame="base"):
+    """
+    Turns a DepthFrame into a point cloud.
+
+    Args:
+        depth_frame (DepthFrame): Output of the depth engine.
+        colors (bool): Add the colour of the rectified left image (in its channel
+            order, BGR), Nx6 instead of Nx3.
+        voxel_size (float, optional): Downsample to one point per voxel of this size (mm).
+        min_depth, max_depth (float, optional): Depth range kept (mm).
+        frame (str): 'base' for the robot base frame (parameters.T_0_cam), 'camera'
+            for the rectified left camera frame.
+
+    Returns:
+        numpy.ndarray: float32 points in mm.
+    """
+    image = colors_for(depth_frame, depth_frame.left) if colors else None
+    return depth_to_points(
+        depth_frame.depth, depth_frame.focal, depth_frame.cx, depth_frame.cy, colors=image,
+        mask=valid_depth(depth_frame.depth, min_depth, max_depth),
+        transform=base_transform() if frame == "base" else None, voxel_size=voxel_size
+    )
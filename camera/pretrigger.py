@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+from collections import deque
+import cv2
+from camera.capture import StereoFrame
+from utils import frame_protocol
+from utils.stream_codec import encode_image
+from config.settings import PRETRIGGER_SECONDS, PRETRIGGER_MAX_MB, PRETRIGGER_QUALITY
+
+
+class CompressedFrame:
+    """
+    A JPEG-compressed stereo frame held by the PreTriggerBuffer.
+
+    Attributes:
+        seq (int): Frame sequence number.
+        ts_left (int): Capture timestamp of the left image (ns).
+        ts_right (int): Capture timestamp of the right image (ns).
+        left (numpy.ndarray): Encoded left image.
+        right (numpy.ndarray): Encoded right image.
+    """
+
+    def __init__(self, seq, ts_left, ts_right, left, right):
+        self.seq = seq
+        self.ts_left = ts_left
+        self.ts_right = ts_right
+        self.left = left
+        self.right = right
+
+    @property
+    def timestamp(self):
+        return (self.ts_left + self.ts_right) // 2
+
+    @property
+    def nbytes(self):
+        return self.left.nbytes + self.right.nbytes
+
+    @classmethod
+    def encode(cls, frame, quality):
+        return cls(frame.seq, frame.ts_left, frame.ts_right,
+                   encode_image(frame.left, frame_protocol.CODEC_JPEG, quality),
+                   encode_image(frame.right, frame_protocol.CODEC_JPEG, quality))
+
+    def decode(self):
+        """
+        Returns:
+            StereoFrame: The decompressed frame with its original sequence number and timestamps.
+        """
+        return StereoFrame(cv2.imdecode(self.left, cv2.IMREAD_UNCHANGED), cv2.imdecode(self.right, cv2.IMREAD_UNCHANGED),
+                           self.seq, self.ts_left, self.ts_right)
+
+
+class PreTriggerBuffer:
+    """
+    Keeps the last few seconds of capture in memory, compressed, so that a
+    recording started by a trigger (a robot fault, say) also contains what
+    happened just before it.
+
+    While armed, a worker thread reads every frame from the frame ring,
+    compresses both images and appends them to a queue. The oldest frames
+    are evicted once the queue spans more than `seconds` of capture time or
+    holds more than `max_mb` of compressed data, so memory use never exceeds
+    the cap whatever the scene. When encoding can't keep up, frames are
+    skipped by the ring reader and counted in its stats.
+
+    On trigger the recorder drains the buffer with frames_after() and then
+    continues with live frames from the ring, see Camera.record().
+    """
+
+    def __init__(self, seconds=PRETRIGGER_SECONDS, max_mb=PRETRIGGER_MAX_MB, quality=PRETRIGGER_QUALITY):
+        """
+        Args:
+            seconds (float): Capture time kept in memory.
+            max_mb (float): Upper bound on the compressed frames kept, in MB.
+            quality (int): JPEG quality of the kept frames.
+        """
+        self.seconds = seconds
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.quality = quality
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.frames = deque()
+        self.bytes = 0
+        self.evicted = 0
+        self.added = 0
+        self.encode_time = 0.0
+        self.reader = None
+        self.running = threading.Event()
+        self.thread = None
+
+    def add(self, frame):
+        """
+        Compresses a stereo frame and appends it, evicting the oldest frames
+        beyond the time and memory limits.
+        """
+        start = time.perf_counter()
+        compressed = CompressedFrame.encode(frame, self.quality)
+        with self.lock:
+            self.encode_time += time.perf_counter() - start
+            self.frames.append(compressed)
+            self.bytes += compressed.nbytes
+            self.added += 1
+            newest = compressed.timestamp
+            while self.frames and (
+                self.bytes > self.max_bytes or newest - self.frames[0].timestamp > self.seconds * 1e9
+            ):
+                self.bytes -= self.frames.popleft().nbytes
+                self.evicted += 1
+
+    def frames_after(self, seq=None):
+        """
+        Returns:
+            list: The kept CompressedFrames newer than seq, oldest first, all of them if seq is None.
+        """
+        with self.lock:
+            return [f for f in self.frames if seq is None or f.seq > seq]
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+    def start(self, reader):
+        """
+        Starts filling the buffer from a frame ring reader.
+
+        Args:
+            reader (RingReader): Reader the frames are taken from.
+        """
+        self.reader = reader
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name="pretrigger", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops filling the buffer and frees the kept frames."""
+        self.running.clear()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.clear()
+
+    def is_running(self):
+        return self.running.is_set()
+
+    def loop(self):
+        while self.running.is_set():
+            try:
+                frame = self.reader.read()
+                if frame is not None:
+                    self.add(frame)
+            except Exception as e:
+                self.logger.error(f"Error buffering pre-trigger frame: {e}")
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Frames and bytes held, the capture time they cover, the
+            limits, and the number of frames evicted so far.
+        """
+        with self.lock:
+            span = (self.frames[-1].timestamp - self.frames[0].timestamp) / 1e9 if self.frames else 0.0
+            return {
+                "armed": self.running.is_set(),
+                "frames": len(self.frames),
+                "bytes": self.bytes,
+                "seconds": span,
+                "max_seconds": self.seconds,
+                "max_bytes": self.max_bytes,
+                "evicted": self.evicted,
+                "encode_ms": self.encode_time * 1000 / self.added if self.added else None,
+                "ring_dropped": self.reader.dropped if self.reader else 0,
+            }
@@ -0,0 +1,157 @@
+import os
+import json
+import numpy as np
+from camera.capture import StereoFrame
+
+# Raw stereo recording format.
+#
+# A raw segment is four files sharing a base name:
+#
+#   left_<name>.raw, right_<name>.raw  frames of each eye back to back, uncompressed
+#   stereo_<name>.idx                  one INDEX_DTYPE record per stereo frame
+#   stereo_<name>.json                 frame shape and dtype, fps
+#
+# Every frame of a segment has the same size, so each .raw file can be
+# opened as a (frames, height, width[, channels]) np.memmap, and frame i of
+# both eyes starts at index[i]['offset'].
+
+RAW_FORMAT_VERSION = 1
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("seq", "<u8"),
+    ("ts_left", "<i8"),
+    ("ts_right", "<i8"),
+])
+
+
+def sidecar_paths(left_path):
+    """
+    Returns:
+        tuple: (index path, metadata path) belonging to a segment's left .raw file.
+    """
+    directory, name = os.path.split(left_path)
+    base = os.path.join(directory, "stereo_" + name[len("left_"):-len(".raw")])
+    return base + ".idx", base + ".json"
+
+
+class RawWriter:
+    """
+    Appends the frames of one eye to a .raw file, with the same write() and
+    release() interface as cv2.VideoWriter.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb", buffering=0)
+
+    def write(self, image):
+        self.file.write(memoryview(np.ascontiguousarray(image)).cast("B"))
+
+    def release(self):
+        self.file.close()
+
+
+class RawIndexWriter:
+    """
+    Writes the index and metadata of a raw segment. Used by the capture stage,
+    which knows the sequence numbers and timestamps of the frames.
+    """
+
+    def __init__(self, left_path, fps):
+        self.index_path, self.meta_path = sidecar_paths(left_path)
+        self.fps = fps
+        self.file = open(self.index_path, "wb")
+        self.record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.frames = 0
+        self.shape = None
+        self.dtype = None
+
+    def add(self, frame):
+        if self.shape is None:
+            self.shape = frame.left.shape
+            self.dtype = frame.left.dtype
+            self.write_meta()
+        record = self.record[0]
+        record["offset"] = self.frames * frame.left.nbytes
+        record["seq"] = frame.seq
+        record["ts_left"] = frame.ts_left
+        record["ts_right"] = frame.ts_right
+        self.file.write(self.record.tobytes())
+        self.frames += 1
+
+    def write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump({
+                "version": RAW_FORMAT_VERSION,
+                "shape": list(self.shape),
+                "dtype": np.dtype(self.dtype).str,
+                "fps": self.fps,
+            }, f, indent=2)
+
+    def close(self):
+        self.file.close()
+
+
+class RawStereoReader:
+    """
+    Random access to the frames of a raw stereo segment.
+
+    The .raw files are memory-mapped, so opening a segment reads nothing and
+    any frame pair is available in O(1) without decoding:
+
+        reader = RawStereoReader("left_1700000000_0003.raw")
+        frame = reader[120]
+        depth_input = reader.left[100:200]
+    """
+
+    def __init__(self, left_path, right_path=None):
+        """
+        Args:
+            left_path (str): Path of the segment's left .raw file.
+            right_path (str, optional): Path of the right .raw file, by default
+                found next to the left one.
+        """
+        right_path = right_path or os.path.join(
+            os.path.dirname(left_path), "right_" + os.path.basename(left_path)[len("left_"):]
+        )
+        index_path, meta_path = sidecar_paths(left_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.fps = meta.get("fps")
+        self.index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        # A crash may leave the eyes a few frames apart, only complete pairs count
+        frames = min(len(self.index), os.path.getsize(left_path) // frame_bytes,
+                     os.path.getsize(right_path) // frame_bytes)
+        self.index = self.index[:frames]
+        self.left = self._map(left_path, frames)
+        self.right = self._map(right_path, frames)
+
+    def _map(self, path, frames):
+        if frames == 0:
+            return np.empty((0,) + self.shape, dtype=self.dtype)
+        return np.memmap(path, dtype=self.dtype, mode="r", shape=(frames,) + self.shape)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            StereoFrame: Frame pair i, backed by the memory map.
+        """
+        record = self.index[i]
+        return StereoFrame(self.left[i], self.right[i], int(record["seq"]),
+                           int(record["ts_left"]), int(record["ts_right"]))
+
+    def find(self, seq):
+        """
+        Returns:
+            int: Position of the frame with sequence number seq, or None.
+        """
+        i = int(np.searchsorted(self.index["seq"], seq))
+        if i < len(self.index) and self.index["seq"][i] == seq:
+            return i
+        return None
@@ -0,0 +1,456 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import cv2
+import numpy as np
+from camera.raw_recording import RawWriter, RawIndexWriter, sidecar_paths
+from config.settings import RECORDING_QUEUE_SIZE, RECORDING_FORMAT
+
+
+class Segment:
+    """
+    A pair of left/right video files covering one stretch of a recording.
+
+    Attributes:
+        index (int): Position of the segment in its session, from 0.
+        left (str): Path of the left video file.
+        right (str): Path of the right video file.
+        start_ts (int): Capture timestamp of the first frame (ns).
+        end_ts (int): Capture timestamp of the last frame (ns).
+        first_seq (int): Sequence number of the first frame.
+        last_seq (int): Sequence number of the last frame.
+        frames (int): Number of stereo frames.
+        closed (bool): Whether the files are complete and can be downloaded.
+        files (list): Paths of all files of the segment, including sidecar files.
+    """
+
+    def __init__(self, index, left, right, files=None):
+        self.index = index
+        self.left = left
+        self.right = right
+        self.files = files or [left, right]
+        self.start_ts = None
+        self.end_ts = None
+        self.first_seq = None
+        self.last_seq = None
+        self.frames = 0
+        self.closed = False
+        self.bytes = None
+        # Encoders that have not finished their file yet
+        self.open_eyes = 2
+
+    def add(self, frame):
+        if self.frames == 0:
+            self.start_ts = frame.timestamp
+            self.first_seq = frame.seq
+        self.end_ts = frame.timestamp
+        self.last_seq = frame.seq
+        self.frames += 1
+
+    @property
+    def duration(self):
+        """Time between the first and the last frame (s)."""
+        return (self.end_ts - self.start_ts) / 1e9 if self.frames else 0.0
+
+    def size(self):
+        """Bytes written to both files so far."""
+        return sum(os.path.getsize(path) for path in self.files if os.path.exists(path))
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "left": os.path.basename(self.left),
+            "right": os.path.basename(self.right),
+            "files": [os.path.basename(path) for path in self.files],
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts,
+            "first_seq": self.first_seq,
+            "last_seq": self.last_seq,
+            "frames": self.frames,
+            "duration": self.duration,
+            "bytes": self.bytes if self.closed else self.size(),
+            "closed": self.closed,
+        }
+
+
+class BufferPool:
+    """
+    Preallocated stereo frame buffers handed from the capture stage to the
+    encoders of both eyes.
+
+    A pair of buffers is free again once both eyes released it. The pool size
+    bounds the number of frames waiting to be encoded.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.buffers = None
+        self.free = list(range(size))
+        self.refs = [0] * size
+
+    def acquire(self, shape, dtype, timeout=0):
+        """
+        Args:
+            timeout (float): Time to wait for a pair to be released, None waits indefinitely.
+
+        Returns:
+            tuple: (index, left, right) of a free pair of buffers, or None if all are in use.
+        """
+        with self.lock:
+            if timeout != 0:
+                self.released.wait_for(lambda: len(self.free) == self.size or (
+                    self.free and self.buffers is not None and self.buffers[0][0].shape == shape
+                    and self.buffers[0][0].dtype == dtype
+                ), timeout=timeout)
+            if self.buffers is None or self.buffers[0][0].shape != shape or self.buffers[0][0].dtype != dtype:
+                if len(self.free) < self.size:
+                    return None
+                self.buffers = [(np.empty(shape, dtype), np.empty(shape, dtype)) for _ in range(self.size)]
+            if not self.free:
+                return None
+            index = self.free.pop()
+            self.refs[index] = 2
+            return (index,) + self.buffers[index]
+
+    def release(self, index):
+        """Releases one eye's hold on a pair of buffers."""
+        with self.lock:
+            self.refs[index] -= 1
+            if self.refs[index] == 0:
+                self.free.append(index)
+                self.released.notify_all()
+
+    def cancel(self, index):
+        """Returns a pair that was acquired but never queued."""
+        with self.lock:
+            self.refs[index] = 0
+            self.free.append(index)
+            self.released.notify_all()
+
+    def in_use(self):
+        with self.lock:
+            return self.size - len(self.free)
+
+
+class EyeEncoder:
+    """
+    Encoding stage of one eye: a worker thread writing that eye's frames to
+    its current video (or raw) file, fed through a queue by the capture stage.
+    """
+
+    def __init__(self, side, session):
+        self.side = side
+        self.session = session
+        self.logger = logging.getLogger()
+        self.queue = queue.Queue()
+        self.writer = None
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.thread = threading.Thread(target=self.loop, name=f"record-{side}", daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            action, value = item
+            try:
+                if action == "open":
+                    self.writer = self.session.open_writer(value)
+                elif action == "frame":
+                    index, image = value
+                    try:
+                        start = time.perf_counter()
+                        self.writer.write(image)
+                        self.encode_time += time.perf_counter() - start
+                        self.encoded += 1
+                    finally:
+                        self.session.pool.release(index)
+                elif action == "close":
+                    self.writer.release()
+                    self.writer = None
+                    self.session.eye_closed(value)
+            except Exception as e:
+                self.logger.error(f"Error encoding {self.side} frame: {e}")
+
+    def get_stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "encoded": self.encoded,
+            "encode_ms": self.encode_time * 1000 / self.encoded if self.encoded else None,
+        }
+
+
+class RecordingSession:
+    """
+    Writes a stereo recording as a series of segments.
+
+    A new pair of files is started every segment_seconds of capture time or
+    once the current pair has grown past segment_mb, whichever comes first.
+    Each closed segment is added to a JSON manifest next to the files, so
+    finished segments can be listed and downloaded while recording goes on.
+    Without limits the whole recording is a single segment.
+
+    Recording runs in two stages. write() is the capture stage: it copies
+    each frame into a buffer from a bounded pool and queues it for the two
+    EyeEncoder threads, which encode the left and the right video in
+    parallel. When the encoders fall behind and the pool is exhausted the
+    frame is dropped and counted instead of stalling capture.
+
+    With the 'raw' format the frames are stored uncompressed with an index
+    instead, see camera/raw_recording.py.
+    """
+
+    MANIFEST_VERSION = 1
+    FOURCC = 'XVID'
+    FORMAT_XVID = 'xvid'
+    FORMAT_RAW = 'raw'
+    FORMATS = (FORMAT_XVID, FORMAT_RAW)
+    # Frames between two file size checks
+    SIZE_CHECK_INTERVAL = 15
+
+    def __init__(self, directory, fps, size, segment_seconds=None, segment_mb=None, on_segment=None,
+                 queue_size=RECORDING_QUEUE_SIZE, format=RECORDING_FORMAT, rectified=False, color=True):
+        """
+        Args:
+            directory (str): Directory the files and the manifest are written to.
+            fps (float): Frame rate of the video files.
+            size (tuple): Frame size (width, height).
+            segment_seconds (float, optional): Maximum capture time of a segment.
+            segment_mb (float, optional): Maximum size of a segment's two files, in MB.
+            on_segment (callable, optional): Called with each Segment once it is closed.
+            queue_size (int): Frames that can wait for the encoders before frames are dropped.
+            format (str): FORMAT_XVID for video files, FORMAT_RAW for raw frames with an index.
+            rectified (bool): Whether the frames written are rectified, recorded in the manifest.
+            color (bool): Whether the frames have three channels, False for luma-only capture.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown recording format '{format}', expected one of {', '.join(self.FORMATS)}")
+        self.format = format
+        self.rectified = rectified
+        self.color = color
+        self.directory = os.path.abspath(directory)
+        self.fps = fps
+        self.size = size
+        self.segment_seconds = segment_seconds or None
+        self.segment_bytes = int(segment_mb * 1024 * 1024) if segment_mb else None
+        self.on_segment = on_segment
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.name = str(int(time.time()))
+        self.segments = []
+        self.current = None
+        self.index_writer = None
+        self.manifest_lock = threading.Lock()
+        self.pool = BufferPool(queue_size)
+        self.frames = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.ring_dropped = 0
+        self.pretrigger_frames = 0
+        self.first_ts = None
+        self.last_ts = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_path = os.path.join(self.directory, f"recording_{self.name}.json")
+        self.encoders = (EyeEncoder("left", self), EyeEncoder("right", self))
+
+    @property
+    def segmented(self):
+        return bool(self.segment_seconds or self.segment_bytes)
+
+    def _file_name(self, side, index):
+        extension = "raw" if self.format == self.FORMAT_RAW else "avi"
+        if self.segmented:
+            return os.path.join(self.directory, f"{side}_{self.name}_{index:04d}.{extension}")
+        return os.path.join(self.directory, f"{side}_{self.name}.{extension}")
+
+    def open_writer(self, path):
+        """
+        Returns:
+            A writer for one eye's file, cv2.VideoWriter or RawWriter.
+        """
+        if self.format == self.FORMAT_RAW:
+            return RawWriter(path)
+        fourcc = cv2.VideoWriter_fourcc(*self.FOURCC)
+        return cv2.VideoWriter(path, fourcc, self.fps, self.size, self.color)
+
+    def _open_segment(self):
+        index = len(self.segments)
+        left, right = self._file_name("left", index), self._file_name("right", index)
+        files = [left, right]
+        if self.format == self.FORMAT_RAW:
+            self.index_writer = RawIndexWriter(left, self.fps)
+            files += list(sidecar_paths(left))
+        segment = Segment(index, left, right, files)
+        self.encoders[0].put(("open", segment.left))
+        self.encoders[1].put(("open", segment.right))
+        with self.lock:
+            self.segments.append(segment)
+            self.current = segment
+        return segment
+
+    def _close_segment(self):
+        segment = self.current
+        if segment is None:
+            return
+        with self.lock:
+            self.current = None
+        if self.index_writer:
+            self.index_writer.close()
+            self.index_writer = None
+        for encoder in self.encoders:
+            encoder.put(("close", segment))
+
+    def eye_closed(self, segment):
+        """
+        Called by each encoder once it has finished its file of a segment.
+        The segment is closed when both files are.
+        """
+        with self.lock:
+            segment.open_eyes -= 1
+            if segment.open_eyes:
+                return
+        segment.bytes = segment.size()
+        with self.lock:
+            segment.closed = True
+        self.write_manifest()
+        self.logger.info(f"Recording segment {segment.index} closed: {segment.frames} frames, {segment.duration:.1f}s")
+        if self.on_segment:
+            self.on_segment(segment)
+
+    def _segment_full(self, segment):
+        if self.segment_seconds and segment.duration >= self.segment_seconds:
+            return True
+        if self.segment_bytes and segment.frames % self.SIZE_CHECK_INTERVAL == 0:
+            return segment.size() >= self.segment_bytes
+        return False
+
+    def reserve(self, shape, dtype):
+        """
+        Takes a free pair of buffers for the next frame, so the frame can be
+        read straight into it (see RingReader.read()).
+
+        Returns:
+            tuple: (index, left, right), or None if the encoders are too far behind.
+        """
+        return self.pool.acquire(shape, dtype)
+
+    def cancel(self, buffers):
+        """Gives back reserved buffers that did not receive a frame."""
+        self.pool.cancel(buffers[0])
+
+    def write(self, frame, buffers=None, wait=False):
+        """
+        Queues a stereo frame for encoding, starting a new segment when the
+        current one is full. Only waits for the encoders if asked to.
+
+        Args:
+            frame (StereoFrame): Frame to record.
+            buffers (tuple, optional): Reserved buffers the frame has already been
+                copied into. Otherwise the frame is copied into a free pair.
+            wait (bool): Wait for a free pair instead of dropping the frame, for
+                frames that are not coming from live capture (pre-trigger history).
+
+        Returns:
+            bool: False if the frame was dropped because the encoders are behind.
+        """
+        if buffers is None:
+            buffers = self.pool.acquire(frame.left.shape, frame.left.dtype, timeout=None if wait else 0)
+            if buffers is None:
+                self.dropped += 1
+                return False
+            np.copyto(buffers[1], frame.left)
+            np.copyto(buffers[2], frame.right)
+        index, left, right = buffers
+        self.high_water = max(self.high_water, self.pool.in_use())
+
+        segment = self.current or self._open_segment()
+        self.encoders[0].put(("frame", (index, left)))
+        self.encoders[1].put(("frame", (index, right)))
+        if self.index_writer:
+            self.index_writer.add(frame)
+        segment.add(frame)
+        self.frames += 1
+        if self.first_ts is None:
+            self.first_ts = frame.timestamp
+        self.last_ts = frame.timestamp
+        if self.segmented and self._segment_full(segment):
+            self._close_segment()
+        return True
+
+    def drop(self):
+        """Counts a frame the capture stage could not queue."""
+        self.dropped += 1
+
+    def close(self):
+        """Closes the current segment, waits for the encoders and finalizes the manifest."""
+        self._close_segment()
+        for encoder in self.encoders:
+            encoder.put(None)
+        for encoder in self.encoders:
+            encoder.thread.join()
+        self.write_manifest(finished=True)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Frames queued, dropped and encoded, the current and high-water
+            number of frames waiting for the encoders, and the frame rate
+            recorded over capture time.
+        """
+        encoded = min(encoder.encoded for encoder in self.encoders)
+        span = (self.last_ts - self.first_ts) / 1e9 if self.frames > 1 else 0
+        return {
+            "name": self.name,
+            "target_fps": self.fps,
+            "fps": (self.frames - 1) / span if span else None,
+            "frames": self.frames,
+            "encoded": encoded,
+            "dropped": self.dropped,
+            "ring_dropped": self.ring_dropped,
+            "pretrigger_frames": self.pretrigger_frames,
+            "queue_size": self.pool.size,
+            "queued": self.pool.in_use(),
+            "high_water": self.high_water,
+            "encoders": {encoder.side: encoder.get_stats() for encoder in self.encoders},
+            "segments": len(self.get_segments()),
+        }
+
+    def get_segments(self, closed_only=True):
+        """
+        Returns:
+            list: The session's segments, by default only the closed ones.
+        """
+        with self.lock:
+            return [s for s in self.segments if s.closed or not closed_only]
+
+    def to_dict(self, finished=False):
+        return {
+            "version": self.MANIFEST_VERSION,
+            "name": self.name,
+            "format": self.format,
+            "rectified": self.rectified,
+            "fps": self.fps,
+            "size": list(self.size),
+            "segment_seconds": self.segment_seconds,
+            "segment_bytes": self.segment_bytes,
+            "finished": finished,
+            "segments": [s.to_dict() for s in self.get_segments()],
+        }
+
+    def write_manifest(self, finished=False):
+        """Rewrites the manifest atomically, so readers never see a partial file."""
+        with self.manifest_lock:
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.to_dict(finished), f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,230 @@
+import os
+import math
+import hashlib
+import logging
+import threading
+import cv2
+import numpy as np
+from camera import parameters
+from camera.capture import StereoFrame
+from config.settings import CALIBRATION_FILE, RECTIFY_CACHE_DIR, RECTIFY_ALPHA
+
+# Bumped whenever the content of the cached tables changes
+RECTIFY_CACHE_VERSION = 1
+
+
+class StereoCalibration:
+    """
+    Intrinsics of both cameras and the pose of the right camera relative to
+    the left one, as returned by cv2.stereoCalibrate().
+
+    Attributes:
+        size (tuple): Image size (width, height) the calibration was made at.
+        K_left, K_right (numpy.ndarray): 3x3 camera matrices (px).
+        D_left, D_right (numpy.ndarray): Distortion coefficients.
+        R (numpy.ndarray): 3x3 rotation from the left to the right camera.
+        T (numpy.ndarray): Translation from the left to the right camera (mm).
+    """
+
+    def __init__(self, size, K_left, D_left, K_right, D_right, R, T):
+        self.size = (int(size[0]), int(size[1]))
+        self.K_left = np.asarray(K_left, dtype=np.float64).reshape(3, 3)
+        self.D_left = np.asarray(D_left, dtype=np.float64).ravel()
+        self.K_right = np.asarray(K_right, dtype=np.float64).reshape(3, 3)
+        self.D_right = np.asarray(D_right, dtype=np.float64).ravel()
+        self.R = np.asarray(R, dtype=np.float64).reshape(3, 3)
+        self.T = np.asarray(T, dtype=np.float64).reshape(3)
+
+    @classmethod
+    def from_parameters(cls):
+        """
+        Ideal calibration from camera/parameters.py: focal lengths from the
+        fields of view, the principal point offset by (u0, v0), no distortion
+        and parallel cameras `b` mm apart.
+        """
+        width, height = parameters.resolution
+        fx = width / 2 / math.tan(math.radians(parameters.FOV_H) / 2)
+        fy = height / 2 / math.tan(math.radians(parameters.FOV_V) / 2)
+        K = [[fx, 0, width / 2 + parameters.u0], [0, fy, height / 2 + parameters.v0], [0, 0, 1]]
+        return cls(parameters.resolution, K, np.zeros(5), K, np.zeros(5), np.eye(3), [-parameters.b, 0, 0])
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Loads a calibration saved with np.savez(path, size=..., K1=..., D1=..., K2=..., D2=..., R=..., T=...).
+        """
+        with np.load(path) as data:
+            return cls(data["size"], data["K1"], data["D1"], data["K2"], data["D2"], data["R"], data["T"])
+
+    @classmethod
+    def load(cls, path=CALIBRATION_FILE):
+        """
+        Returns:
+            StereoCalibration: The calibration file if there is one, otherwise the ideal one.
+        """
+        if path and os.path.exists(path):
+            return cls.from_file(path)
+        return cls.from_parameters()
+
+    def scaled(self, size):
+        """
+        Returns:
+            tuple: (K_left, K_right) for images of another size.
+        """
+        sx, sy = size[0] / self.size[0], size[1] / self.size[1]
+        scale = np.array([[sx], [sy], [1.0]])
+        return self.K_left * scale, self.K_right * scale
+
+    def digest(self):
+        """
+        Returns:
+            str: Hash identifying the calibration.
+        """
+        sha = hashlib.sha1()
+        sha.update(np.asarray(self.size, dtype=np.int64).tobytes())
+        for array in (self.K_left, self.D_left, self.K_right, self.D_right, self.R, self.T):
+            sha.update(array.tobytes())
+        return sha.hexdigest()
+
+
+class RectificationMaps:
+    """
+    Fixed-point remap tables of both cameras for one image size.
+
+    Attributes:
+        size (tuple): Image size (width, height).
+        left, right (tuple): (map1, map2) of each camera, CV_16SC2 and CV_16UC1.
+        P1, P2 (numpy.ndarray): 3x4 projection matrices of the rectified cameras.
+        Q (numpy.ndarray): 4x4 disparity-to-depth matrix.
+    """
+
+    def __init__(self, size, left, right, P1, P2, Q):
+        self.size = size
+        self.left = left
+        self.right = right
+        self.P1 = P1
+        self.P2 = P2
+        self.Q = Q
+
+    @property
+    def focal(self):
+        """Focal length of the rectified cameras (px)."""
+        return float(self.P1[0, 0])
+
+    @property
+    def baseline(self):
+        """Distance between the rectified cameras (mm)."""
+        return float(abs(self.P2[0, 3] / self.P2[0, 0]))
+
+    @classmethod
+    def compute(cls, calibration, size, alpha=RECTIFY_ALPHA):
+        K_left, K_right = calibration.scaled(size)
+        R1, R2, P1, P2, Q, _, _ = cv2.stereoRectify(
+            K_left, calibration.D_left, K_right, calibration.D_right, size,
+            calibration.R, calibration.T.reshape(3, 1), flags=cv2.CALIB_ZERO_DISPARITY, alpha=alpha
+        )
+        left = cv2.initUndistortRectifyMap(K_left, calibration.D_left, R1, P1, size, cv2.CV_16SC2)
+        right = cv2.initUndistortRectifyMap(K_right, calibration.D_right, R2, P2, size, cv2.CV_16SC2)
+        return cls(size, left, right, P1, P2, Q)
+
+    def save(self, path):
+        """Writes the tables atomically, so a concurrent load never sees a partial file."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, size=self.size, left_1=self.left[0], left_2=self.left[1],
+                     right_1=self.right[0], right_2=self.right[1], P1=self.P1, P2=self.P2, Q=self.Q)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(tuple(int(v) for v in data["size"]), (data["left_1"], data["left_2"]),
+                       (data["right_1"], data["right_2"]), data["P1"], data["P2"], data["Q"])
+
+
+class Rectifier:
+    """
+    Undistorts and rectifies stereo pairs so that matching points lie on the
+    same row in both images.
+
+    The remap tables are built with cv2.initUndistortRectifyMap() the first
+    time a frame size is seen, in the compact fixed-point format (CV_16SC2),
+    and cached on disk under a hash of the calibration and the size, so a
+    restart only loads them. Rectifying a pair is then two cv2.remap() calls.
+    """
+
+    def __init__(self, calibration=None, cache_dir=RECTIFY_CACHE_DIR, alpha=RECTIFY_ALPHA):
+        """
+        Args:
+            calibration (StereoCalibration, optional): Defaults to StereoCalibration.load(),
+                which is only called once rectification is needed.
+            cache_dir (str, optional): Directory of the cached tables, None to not cache them.
+            alpha (float): 0 crops to valid pixels only, 1 keeps all source pixels.
+        """
+        self.calibration = calibration
+        self.cache_dir = cache_dir
+        self.alpha = alpha
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def cache_path(self, size):
+        key = f"{RECTIFY_CACHE_VERSION}:{self.calibration.digest()}:{size[0]}x{size[1]}:{self.alpha}"
+        name = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"rectify_{size[0]}x{size[1]}_{name}.npz")
+
+    def maps(self, size):
+        """
+        Returns the remap tables for a frame size, loading or building them
+        on first use.
+
+        Args:
+            size (tuple): Frame size (width, height).
+
+        Returns:
+            RectificationMaps: The tables.
+        """
+        size = (int(size[0]), int(size[1]))
+        maps = self.cache.get(size)
+        if maps is not None:
+            return maps
+        with self.lock:
+            if size in self.cache:
+                return self.cache[size]
+            if self.calibration is None:
+                self.calibration = StereoCalibration.load()
+            path = self.cache_path(size) if self.cache_dir else None
+            maps = None
+            if path and os.path.exists(path):
+                try:
+                    maps = RectificationMaps.load(path)
+                except Exception as e:
+                    self.logger.error(f"Ignoring unreadable rectification cache {path}: {e}")
+            if maps is None:
+                maps = RectificationMaps.compute(self.calibration, size, self.alpha)
+                if path:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    maps.save(path)
+                self.logger.info(f"Built rectification maps for {size[0]}x{size[1]}")
+            self.cache[size] = maps
+            return maps
+
+    def rectify(self, frame, out=None):
+        """
+        Rectifies a stereo pair.
+
+        Args:
+            frame (StereoFrame): Pair to rectify.
+            out (tuple, optional): (left, right) arrays of the frame's shape to write into.
+
+        Returns:
+            StereoFrame: The rectified pair, with the frame's sequence number and timestamps.
+        """
+        height, width = frame.left.shape[:2]
+        if out is not None and (out[0].shape != frame.left.shape or out[1].shape != frame.right.shape):
+            raise ValueError(f"Cannot rectify a {frame.left.shape} frame into {out[0].shape} buffers")
+        maps = self.maps((width, height))
+        out = out or (None, None)
+        left = cv2.remap(frame.left, maps.left[0], maps.left[1], cv2.INTER_LINEAR, dst=out[0])
+        right = cv2.remap(frame.right, maps.right[0], maps.right[1], cv2.INTER_LINEAR, dst=out[1])
+        return StereoFrame(left, right, frame.seq, frame.ts_left, frame.ts_right)
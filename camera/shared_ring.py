@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from camera.frame_ring import StereoFrameRing
+from utils.frame_protocol import DTYPE_CODES, CODE_DTYPES
+from config.settings import SHARED_RING_POLL_MS
+
+# Words of the index at the start of the segment, followed by the seq, ts_left
+# and ts_right words of every slot
+HEAD, CLOSED, GENERATION, SLOTS, CAPACITY, DTYPE, NDIM, SHAPE = range(8)
+INDEX_WORDS = SHAPE + 3
+# Frame data starts on a cache line
+DATA_ALIGN = 64
+# Segments created by this process, registered with its resource tracker
+_created = set()
+
+
+def data_offset(slots):
+    return math.ceil((INDEX_WORDS + 3 * slots) * 8 / DATA_ALIGN) * DATA_ALIGN
+
+
+class SharedFrameRing(StereoFrameRing):
+    """
+    A StereoFrameRing whose slots and index live in a multiprocessing.shared_memory
+    segment, so that frames written by a capture process can be read by any
+    process attached to it without copying.
+
+    The index is lock-free: the writer zeroes a slot's sequence number before
+    overwriting it and publishes the new one afterwards, and readers check it
+    again once they are done with the frame (see is_valid()), like a seqlock.
+    Readers learn about new frames from a watcher thread polling the head
+    every SHARED_RING_POLL_MS, which wakes them up through the ring's
+    condition, so RingReader works unchanged in every process.
+    """
+
+    def __init__(self, slots, capacity, name=None):
+        """
+        Creates the segment; it is removed again by release().
+
+        Args:
+            slots (int): Number of stereo frame slots.
+            capacity (int): Largest frame of one eye, in bytes.
+            name (str, optional): Name of the segment, random by default.
+        """
+        shm = shared_memory.SharedMemory(name=name, create=True, size=data_offset(slots) + 2 * slots * capacity)
+        header = np.ndarray((INDEX_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[SLOTS] = slots
+        header[CAPACITY] = capacity
+        del header
+        _created.add(shm.name)
+        self._map(shm, owner=True)
+        self.seqs[:] = 0
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches to a ring created by another process.
+
+        Args:
+            name (str): Name of the segment, see SharedFrameRing.name.
+
+        Returns:
+            SharedFrameRing: The ring, for reading or, in the capture process, writing.
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            if multiprocessing.parent_process() is None and shm.name not in _created:
+                # An unrelated process: its resource tracker would remove the segment when it exits
+                resource_tracker.unregister(shm._name, "shared_memory")
+        ring = cls.__new__(cls)
+        ring._map(shm, owner=False)
+        return ring
+
+    def _map(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.slots = int(np.ndarray((INDEX_WORDS,), dtype=np.int64, buffer=shm.buf)[SLOTS])
+        self.index = np.ndarray((INDEX_WORDS + 3 * self.slots,), dtype=np.int64, buffer=shm.buf)
+        self.header = self.index[:INDEX_WORDS]
+        self.seqs = self.index[INDEX_WORDS:INDEX_WORDS + self.slots]
+        self.ts_left = self.index[INDEX_WORDS + self.slots:INDEX_WORDS + 2 * self.slots]
+        self.ts_right = self.index[INDEX_WORDS + 2 * self.slots:]
+        self.capacity = int(self.header[CAPACITY])
+        self.cond = threading.Condition()
+        self.generation = None
+        self.views = (None, None)
+        self.watcher = None
+        self.watching = threading.Event()
+
+    @property
+    def name(self):
+        """Name other processes attach to the ring with."""
+        return self.shm.name
+
+    @property
+    def head(self):
+        return int(self.header[HEAD])
+
+    @head.setter
+    def head(self, seq):
+        self.header[HEAD] = seq
+
+    @property
+    def closed(self):
+        return bool(self.header[CLOSED])
+
+    @closed.setter
+    def closed(self, closed):
+        self.header[CLOSED] = int(closed)
+
+    def _slot_views(self):
+        # Rebuilt whenever the writer reallocated the slots for another frame format
+        generation = int(self.header[GENERATION])
+        if generation != self.generation:
+            if generation == 0:
+                self.views = (None, None)
+            else:
+                shape = tuple(int(n) for n in self.header[SHAPE:SHAPE + int(self.header[NDIM])])
+                dtype = CODE_DTYPES[int(self.header[DTYPE])]
+                strides = (2 * self.capacity,) + np.empty((0,) + shape, dtype=dtype).strides[1:]
+                offset = data_offset(self.slots)
+                self.views = tuple(
+                    np.ndarray((self.slots,) + shape, dtype=dtype, buffer=self.shm.buf,
+                               offset=offset + eye * self.capacity, strides=strides)
+                    for eye in (0, 1)
+                )
+            self.generation = generation
+        return self.views
+
+    @property
+    def left(self):
+        return self._slot_views()[0]
+
+    @property
+    def right(self):
+        return self._slot_views()[1]
+
+    def allocate(self, shape, dtype):
+        """
+        Sets the frame format of the slots, which must fit the capacity.
+        Any frames already in the ring are discarded.
+
+        Raises:
+            ValueError: If a frame of this shape and dtype is larger than the slots.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes > self.capacity or len(shape) > 3:
+            raise ValueError(f"{tuple(shape)} {dtype} frames don't fit the {self.capacity} byte slots")
+        with self.cond:
+            self.seqs[:] = 0
+            self.header[DTYPE] = DTYPE_CODES[dtype]
+            self.header[NDIM] = len(shape)
+            self.header[SHAPE:SHAPE + len(shape)] = shape
+            self.header[GENERATION] += 1
+
+    def reader(self, name=None):
+        self.watch()
+        return super().reader(name)
+
+    def watch(self):
+        """Starts the thread waking up this process' readers when the head moves."""
+        with self.cond:
+            if self.watcher is not None:
+                return
+            self.watching.set()
+            self.watcher = threading.Thread(target=self.watch_loop, name="shared-ring-watcher", daemon=True)
+            self.watcher.start()
+
+    def watch_loop(self):
+        last = (self.head, self.closed)
+        while self.watching.is_set():
+            time.sleep(SHARED_RING_POLL_MS / 1000)
+            current = (self.head, self.closed)
+            if current != last:
+                last = current
+                with self.cond:
+                    self.cond.notify_all()
+
+    def release(self):
+        """
+        Detaches from the segment, and removes it if this process created it.
+        Frames still referenced elsewhere keep the mapping alive until they are gone.
+        """
+        self.watching.clear()
+        if self.watcher and self.watcher is not threading.current_thread():
+            self.watcher.join(timeout=1)
+        self.watcher = None
+        self.generation = None
+        self.views = (None, None)
+        self.index = self.header = self.seqs = self.ts_left = self.ts_right = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
@@ -0,0 +1,135 @@
+import time
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from camera.depth import to_gray
+from config.settings import SPARSE_DETECTOR, SPARSE_MAX_FEATURES, SPARSE_BLOCK_SIZE, SPARSE_NUM_DISPARITIES
+
+# Columns of the keypoint arrays
+KEYPOINT_FIELDS = ("u", "v", "disparity", "depth")
+
+
+class SparseStereo:
+    """
+    Depth at feature points only, for consumers that need a few hundred
+    points rather than a dense map.
+
+    Features are detected on the rectified left image (ORB or FAST) and each
+    one is matched along the same row of the rectified right image by the
+    sum of absolute differences of a block around it, for all disparities
+    at once with NumPy. Ambiguous matches (a second minimum almost as good
+    as the best one) are rejected, the others refined to subpixel precision
+    with a parabola through the costs around the minimum.
+    """
+
+    DETECTORS = ('orb', 'fast')
+    # A match is kept if no other disparity costs less than best / UNIQUENESS
+    UNIQUENESS = 0.7
+
+    def __init__(self, detector=SPARSE_DETECTOR, max_features=SPARSE_MAX_FEATURES, block_size=SPARSE_BLOCK_SIZE,
+                 num_disparities=SPARSE_NUM_DISPARITIES, min_disparity=0):
+        """
+        Args:
+            detector (str): 'orb' or 'fast'.
+            max_features (int): Most features kept, the strongest ones.
+            block_size (int): Odd size of the matching block.
+            num_disparities (int): Width of the disparity search range (px).
+            min_disparity (int): Smallest disparity searched (px).
+        """
+        if detector not in self.DETECTORS:
+            raise ValueError(f"Unknown detector '{detector}', expected one of {', '.join(self.DETECTORS)}")
+        if block_size % 2 == 0:
+            raise ValueError("Block size must be odd")
+        self.detector_name = detector
+        self.max_features = max_features
+        self.block_size = block_size
+        self.num_disparities = num_disparities
+        self.min_disparity = min_disparity
+        if detector == 'orb':
+            self.detector = cv2.ORB_create(nfeatures=max_features, edgeThreshold=block_size, patchSize=block_size)
+        else:
+            self.detector = cv2.FastFeatureDetector_create(threshold=20)
+        self.compute_ms = None
+
+    def detect(self, gray):
+        """
+        Returns:
+            tuple: (u, v) integer pixel coordinates of the strongest features.
+        """
+        keypoints = self.detector.detect(gray, None)
+        if len(keypoints) > self.max_features:
+            keypoints = sorted(keypoints, key=lambda k: k.response, reverse=True)[:self.max_features]
+        points = np.array([k.pt for k in keypoints], dtype=np.float32).reshape(-1, 2)
+        u = np.rint(points[:, 0]).astype(np.intp)
+        v = np.rint(points[:, 1]).astype(np.intp)
+        return u, v
+
+    def match(self, left, right, u, v):
+        """
+        Matches left image points along the same rows of the right image.
+
+        Returns:
+            tuple: (disparity, valid) float32 disparities and the mask of the reliable ones.
+        """
+        size = self.block_size
+        radius = size // 2
+        disparities = np.arange(self.min_disparity, self.min_disparity + self.num_disparities)
+        count = len(disparities)
+        # Pad so that every block and every shifted block is inside the images
+        pad = radius + int(disparities[-1])
+        left = cv2.copyMakeBorder(left, radius, radius, pad, radius, cv2.BORDER_REPLICATE)
+        right = cv2.copyMakeBorder(right, radius, radius, pad, radius, cv2.BORDER_REPLICATE)
+
+        # Block around each point, and the strip of the right image covering all its candidates
+        columns = u + pad - radius
+        reference = sliding_window_view(left, (size, size))[v, columns].astype(np.int16)
+        first = columns - int(disparities[-1])
+        strips = sliding_window_view(right, (size, size + count - 1))[v, first].astype(np.int16)
+        # Sum of absolute differences one block column at a time, strip column k is disparity count-1-k
+        costs = np.zeros((len(u), count), dtype=np.int32)
+        for column in range(size):
+            difference = np.abs(strips[:, :, column:column + count] - reference[:, :, column, None])
+            costs += difference.sum(axis=1, dtype=np.int32)
+        costs = costs[:, ::-1]
+
+        rows = np.arange(len(u))
+        best = costs.argmin(axis=1)
+        best_cost = costs[rows, best]
+        # Second best outside the minimum's immediate neighbours
+        masked = costs.copy()
+        for offset in (-1, 0, 1):
+            masked[rows, np.clip(best + offset, 0, count - 1)] = np.iinfo(np.int32).max
+        second = masked.min(axis=1)
+        inner = (best > 0) & (best < count - 1)
+        valid = inner & (best_cost < self.UNIQUENESS * second)
+
+        # Subpixel refinement with a parabola through the three costs around the minimum
+        before = costs[rows, np.clip(best - 1, 0, None)].astype(np.float32)
+        after = costs[rows, np.clip(best + 1, None, count - 1)].astype(np.float32)
+        curvature = before - 2 * best_cost + after
+        shift = np.where(curvature > 0, (before - after) / (2 * np.maximum(curvature, 1e-6)), 0)
+        disparity = disparities[best].astype(np.float32) + shift.astype(np.float32)
+        return disparity, valid & (disparity > 0)
+
+    def compute(self, frame, maps):
+        """
+        Args:
+            frame (StereoFrame): Rectified stereo pair.
+            maps (RectificationMaps): Its rectification, for the focal length and baseline.
+
+        Returns:
+            numpy.ndarray: float32 Nx4 array of (u, v, disparity, depth in mm), see KEYPOINT_FIELDS.
+        """
+        start = time.perf_counter()
+        left, right = to_gray(frame.left), to_gray(frame.right)
+        u, v = self.detect(left)
+        keypoints = np.empty((0, 4), dtype=np.float32)
+        if len(u):
+            disparity, valid = self.match(left, right, u, v)
+            keypoints = np.empty((int(valid.sum()), 4), dtype=np.float32)
+            keypoints[:, 0] = u[valid]
+            keypoints[:, 1] = v[valid]
+            keypoints[:, 2] = disparity[valid]
+            keypoints[:, 3] = maps.focal * maps.baseline / disparity[valid]
+        self.compute_ms = (time.perf_counter() - start) * 1000
+        return keypoints
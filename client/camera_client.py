@@ -3,7 +3,10 @@ import cv2
 import time
 import logging
 from utils.socket_handler import SocketHandler
-from utils.command_handler import Request,Response,Command,FrameData,CameraConfig
+from utils.command_channel import CommandChannel, Call
+from utils.command_handler import Request,Response,Command,FrameData,CameraConfig,StreamOptions,DepthOptions,CameraMode
+from utils.stream_codec import decode_frame
+from utils.file_transfer import FileInfo, sha256_file
 import argparse
 import numpy as np
 from config.settings import HOST,PORT_C,PORT_S,HEADER_SIZE,RECORDING_DIR
@@ -85,45 +88,150 @@ class CameraClient:
         self.logger =  logging.getLogger()
         self.command_socket_handler = SocketHandler(host, port_c)
         self.command_socket_handler.init_reciever()
+        self.commands = CommandChannel(self.command_socket_handler)
         self.stream_socket_handler = SocketHandler(host, port_s)
         self.header_size = header_size
         self.count = 0
 
-    def start_recording(self):
-        """Send start recording request to the server."""
+    def start_recording(self, segment_seconds=None, segment_mb=None, format=None, pretrigger=True, rectified=False):
+        """
+        Send start recording request to the server.
+
+        Args:
+            segment_seconds (float, optional): Rotate to a new pair of files after this many seconds.
+            segment_mb (float, optional): Rotate to a new pair of files after this many MB.
+            format (str, optional): 'xvid' or 'raw' (uncompressed, open with
+                camera.raw_recording.RawStereoReader). Defaults to the server's setting.
+            pretrigger (bool): Begin with the history kept since arm_pretrigger(), if armed.
+            rectified (bool): Record rectified frames.
+        """
         try:
-            req = Request(Command.START_RECORDING)
-            self.command_socket_handler.send(req)
-            self.logger.info("Req. sent")
-            return self.get_response()
+            params = {"segment_seconds": segment_seconds, "segment_mb": segment_mb, "format": format,
+                      "pretrigger": pretrigger, "rectified": rectified}
+            return self.request(Command.START_RECORDING, params)
         except Exception as e:
             self.logger.error(f"Error starting recording: {e}")
             return {"error": str(e), "message": None}
 
+    def arm_pretrigger(self, seconds=None, max_mb=None):
+        """
+        Make the server keep the last seconds of capture in memory, so that
+        the next start_recording() (the trigger) also saves what happened
+        just before it.
+
+        Args:
+            seconds (float, optional): Capture time kept. Defaults to the server's setting.
+            max_mb (float, optional): Memory cap of the kept frames. Defaults to the server's setting.
+        """
+        try:
+            return self.request(Command.ARM_PRETRIGGER, {"seconds": seconds, "max_mb": max_mb})
+        except Exception as e:
+            self.logger.error(f"Error arming pre-trigger: {e}")
+            return {"error": str(e), "message": None}
+
+    def disarm_pretrigger(self):
+        """Stop keeping pre-trigger history on the server."""
+        try:
+            return self.request(Command.DISARM_PRETRIGGER)
+        except Exception as e:
+            self.logger.error(f"Error disarming pre-trigger: {e}")
+            return {"error": str(e), "message": None}
+
     def end_recording(self):
         """Send end recording request to the server."""
         try:
-            req = Request(Command.END_RECORDING)
-            self.command_socket_handler.send(req)
-            return self.get_response()
+            return self.request(Command.END_RECORDING)
         except Exception as e:
             self.logger.error(f"Error ending recording: {e}")
             return {"error": str(e), "message": None}
 
-    def get_recording(self):
-        """Retrieve recorded video from the server."""
+    def get_recording(self, clear=True):
+        """
+        Download the recorded video files from the server as they are, without
+        re-encoding them. An interrupted download resumes where it stopped
+        when called again. While a segmented recording is still running, the
+        segments finished so far are downloaded.
+
+        Args:
+            clear (bool): Delete the downloaded files on the server once they
+                have been verified.
+
+        Returns:
+            tuple: ((left_file, right_file), None) or (None, error).
+        """
         try:
-            req = Request(Command.GET_RECORDING)
-            self.command_socket_handler.send(req)
+            res = self.request(Command.RECORDING_INFO)
+            if res.error:
+                return None, res.error
+            if res.data.get("recording"):
+                self.logger.info(f"Recording in progress, fetching {len(res.data['files'])} finished file(s).")
+            paths = []
+            for info in res.data["files"]:
+                info = FileInfo.from_dict(info)
+                self.download_file(info, info.name)
+                paths.append(info.name)
+            if clear and paths:
+                self.request(Command.CLEAR_RECORDING, {"names": paths})
+            return tuple(paths), None
+        except Exception as e:
+            self.logger.error(f"Error getting recording: {e}")
+            return None, str(e)
+
+    def download_file(self, info: FileInfo, path, resume=True):
+        """
+        Download a recorded file byte for byte and check its SHA-256.
+
+        Args:
+            info (FileInfo): The file, from RECORDING_INFO.
+            path (str): Where to save it.
+            resume (bool): Continue a partial download already at path.
 
-            res = self.get_response(is_file=True)
+        Raises:
+            IOError: If the downloaded file doesn't match the server's checksum.
+        """
+        offset = os.path.getsize(path) if resume and os.path.exists(path) else 0
+        if offset > info.size:
+            offset = 0
+        with open(path, "r+b" if offset else "wb") as f:
+            f.truncate(offset)
+            if offset < info.size:
+                call = self.submit(Command.GET_FILE, {"name": info.name, "offset": offset}, sink=f)
+                res = call.result()
+                if res.error:
+                    raise IOError(res.error)
+                self.logger.info(res.message)
+                bar_length = 30
+                for chunk in call.messages():
+                    progress = (chunk.offset + chunk.length) / info.size
+                    filled = int(bar_length * progress)
+                    bar = '*' * filled + '-' * (bar_length - filled)
+                    print(f'\rDownloading {info.name}... |{bar}| {int(progress*100)}%', end='')
+                print()
+        if info.sha256 and sha256_file(path) != info.sha256:
+            if offset:
+                # The partial file may be stale, start over
+                return self.download_file(info, path, resume=False)
+            raise IOError(f"Checksum mismatch for {info.name}")
+        return path
+
+    def get_recording_legacy(self):
+        """Retrieve recorded video from the server, re-encoded frame by frame."""
+        try:
+            call = self.submit(Command.GET_RECORDING)
+            res = call.result()
             if res.error:
                 return None, res.error
             
             self.logger.info(res.message)
 
+            # Other commands can be sent while the recording is downloading
+            chunks = call.messages()
+
             def recieve_large_chunks():
-                return self.command_socket_handler.recieve(is_file=True)
+                chunk = next(chunks)
+                if isinstance(chunk, Response) and chunk.error:
+                    raise Exception(chunk.error)
+                return chunk
 
             return stero_video_writer(recieve_large_chunks,"sl.avi","sr.avi"),None
 
@@ -131,25 +239,63 @@ class CameraClient:
             self.logger.error(f"Error getting recording: {e}")
             return None, str(e)
 
+    def get_link_stats(self):
+        """
+        Byte counters and transfer rates of the command and stream links.
+
+        Returns:
+            dict: Statistics per link, see SocketHandler.get_link_stats().
+        """
+        return {
+            "command": self.command_socket_handler.get_link_stats(),
+            "stream": self.stream_socket_handler.get_link_stats(),
+        }
+
     def close(self):
         """Close socket connection."""
-        req = Request(Command.EXIT)
-        self.command_socket_handler.send(req)
+        self.submit(Command.EXIT, expect_reply=False)
         self.command_socket_handler.close()
 
-    def get_response(self,is_file=False)->Response:
-        res = self.command_socket_handler.recieve(is_file=is_file)
-        return res
+    def submit(self, command, params=None, expect_reply=True, sink=None) -> Call:
+        """
+        Send a command without waiting for it to finish.
 
-    def start_live(self):
-        """Start live video stream from the server."""
+        Any number of commands can be in flight at once, e.g. a capture while
+        a recording is downloading.
+
+        Args:
+            command (Command): Command to run.
+            params (dict, optional): Command parameters.
+            expect_reply (bool): False for commands the server doesn't answer.
+            sink (file, optional): File receiving the bytes of a GET_FILE.
+
+        Returns:
+            Call: A future resolving to the server's Response.
+        """
+        return self.commands.submit(command, params, expect_reply, sink)
+
+    def request(self, command, params=None, timeout=None) -> Response:
+        """Send a command and wait for its Response."""
+        return self.submit(command, params).result(timeout=timeout)
+
+    def start_live(self, options: StreamOptions = None, rectified=False, full_resolution=False):
+        """
+        Start live video stream from the server.
+
+        Args:
+            options (StreamOptions, optional): Codec, quality and scale of the stream.
+            rectified (bool): Ask for rectified frames (for every viewer of the stream).
+            full_resolution (bool): Stream full resolution frames instead of the lores
+                stream, if this starts the stream.
+        """
         try:
-            req = Request(Command.START_LIVE)
-            self.command_socket_handler.send(req)
-            res = self.get_response()
+            options = options or StreamOptions()
+            res = self.request(Command.START_LIVE, dict(options.to_dict(), rectified=rectified,
+                                                        full_resolution=full_resolution))
             if res.error:
                 raise Exception(res.error)
             self.logger.info(res.message)
+            self.stream_socket_handler.subscribe(options)
             self.stream_socket_handler.recive_live_stream(self.display_live_capture, separe_thread=True)
         except Exception as e:
             self.logger.error(f"Error starting live stream: {e}")
@@ -157,24 +303,134 @@ class CameraClient:
     def end_live(self):
         """Stop the live video stream."""
         try:
-            req = Request(Command.END_LIVE)
-            self.command_socket_handler.send(req)
-            return self.get_response()
+            return self.request(Command.END_LIVE)
         except Exception as e:
             self.logger.error(f"Error ending live stream: {e}")
             return {"error": str(e), "message": None}
 
-    def capture_image(self):
-        """Capture an image from the stereo camera."""
+    def get_stream_status(self):
+        """
+        Get the live stream's subscribers with their current operating point
+        (fps, scale, quality) and the latency and backlog measurements behind it.
+        """
+        try:
+            return self.request(Command.STREAM_STATUS)
+        except Exception as e:
+            self.logger.error(f"Error getting stream status: {e}")
+            return {"error": str(e), "message": None}
+
+    def start_depth(self, options: DepthOptions = None):
+        """
+        Start computing depth on the server.
+
+        Args:
+            options (DepthOptions, optional): Algorithm, downscale, disparity range and region of interest.
+        """
         try:
-            req = Request(Command.CAPTURE_IMAGE)
-            self.command_socket_handler.send(req)
-            res =self.get_response(True)
+            return self.request(Command.START_DEPTH, (options or DepthOptions()).to_dict())
+        except Exception as e:
+            self.logger.error(f"Error starting depth: {e}")
+            return {"error": str(e), "message": None}
+
+    def get_depth(self, after_seq=None, timeout=None, disparity=False):
+        """
+        Get the newest depth map.
+
+        Args:
+            after_seq (int, optional): Wait for a frame newer than this one.
+            timeout (float, optional): Maximum wait on the server.
+            disparity (bool): Also return the float32 disparity map.
+
+        Returns:
+            Response: Its data holds the uint16 depth map in mm, the frame's
+            seq and timestamp, the ROI, scale and intrinsics of the map and
+            the compute time.
+        """
+        try:
+            return self.request(Command.GET_DEPTH, {"after_seq": after_seq, "timeout": timeout, "disparity": disparity})
+        except Exception as e:
+            self.logger.error(f"Error getting depth: {e}")
+            return {"error": str(e), "message": None}
+
+    def get_point_cloud(self, voxel_size=None, colors=False, max_depth=None, frame="base", after_seq=None):
+        """
+        Get the newest depth map as a point cloud.
+
+        Args:
+            voxel_size (float, optional): Downsample to one point per voxel of this size (mm).
+            colors (bool): Add the BGR colour of every point, Nx6 instead of Nx3.
+            max_depth (float, optional): Drop points farther than this (mm).
+            frame (str): 'base' for the robot base frame, 'camera' for the left camera frame.
+            after_seq (int, optional): Wait for a frame newer than this one.
+
+        Returns:
+            Response: Its data holds the float32 points in mm, with the frame's seq and timestamp.
+        """
+        try:
+            params = {"voxel_size": voxel_size, "colors": colors, "max_depth": max_depth, "frame": frame,
+                      "after_seq": after_seq}
+            return self.request(Command.GET_POINT_CLOUD, params)
+        except Exception as e:
+            self.logger.error(f"Error getting point cloud: {e}")
+            return {"error": str(e), "message": None}
+
+    def get_keypoints(self):
+        """
+        Capture one stereo pair and get the depth at its features only (sparse stereo).
+
+        Returns:
+            Response: Its data holds the float32 Nx4 keypoints (u, v, disparity,
+            depth in mm), the frame's seq and timestamp and the compute time.
+        """
+        try:
+            return self.request(Command.GET_KEYPOINTS)
+        except Exception as e:
+            self.logger.error(f"Error getting keypoints: {e}")
+            return {"error": str(e), "message": None}
+
+    def set_config(self, fps=None, width=None, height=None, format=None):
+        """
+        Switch the cameras to another mode. Values left out keep their current setting.
+
+        Args:
+            fps (float, optional): Frame rate.
+            width (int, optional): Frame width, even.
+            height (int, optional): Frame height, even.
+            format (str, optional): Pixel format, see CameraMode.FORMATS.
+
+        Returns:
+            Response: Its data holds the mode, whether it was cached on the server
+            and the measured switch time.
+        """
+        params = {"fps": fps, "width": width, "height": height, "format": format}
+        try:
+            return self.request(Command.SET_CONFIG, {k: v for k, v in params.items() if v is not None})
+        except Exception as e:
+            self.logger.error(f"Error setting camera mode: {e}")
+            return {"error": str(e), "message": None}
+
+    def end_depth(self):
+        """Stop computing depth on the server."""
+        try:
+            return self.request(Command.END_DEPTH)
+        except Exception as e:
+            self.logger.error(f"Error ending depth: {e}")
+            return {"error": str(e), "message": None}
+
+    def capture_image(self, rectified=False):
+        """
+        Capture an image from the stereo camera.
+
+        Args:
+            rectified (bool): Ask for the rectified pair.
+        """
+        try:
+            res = self.request(Command.CAPTURE_IMAGE, {"rectified": rectified})
             if res.error:
                 return False, res.error
             self.logger.info(res.message)
             data = res.data
-            return True, (data['img_left'], data['img_right'])
+            return True, (data['left_img'], data['right_img'])
         except Exception as e:
             self.logger.error(f"Error capturing image: {e}")
             return False, str(e)
@@ -186,10 +442,15 @@ class CameraClient:
         
         Args:
             status (bool): Indicates if a new frame is available.
-            frame (np.ndarray): The image frame.
+            frames: A (left, right) tuple or an EncodedFrame for compressed streams.
         """
    
         if status:
+            frames = decode_frame(frames)
+            if frames[1] is None:
+                # Keypoint stream: (u, v, disparity, depth) rows, no image to show
+                self.logger.debug(f"{len(frames[0])} keypoints")
+                return
             cv2.imshow('Live Frame', frames[0])
             cv2.waitKey(1)
             # if (frames is None) or (frames[0] is None): 
@@ -216,8 +477,9 @@ def parse_args():
         type=str,
         help="Camera operation to perform",
         choices=[
-            "start-recording", "end-recording", "get-recording",
-            "start-live", "end-live", "capture-image", "exit"
+            "start-recording", "end-recording", "get-recording", "arm-pretrigger", "disarm-pretrigger",
+            "start-live", "end-live", "stream-status", "capture-image",
+            "start-depth", "get-depth", "end-depth", "get-keypoints", "set-config", "exit"
         ]
     )
     parser.add_argument(
@@ -232,6 +494,127 @@ def parse_args():
         help="Port (default: 8000)",
         default=8000
     )
+    parser.add_argument(
+        "--codec",
+        type=str,
+        help="Live stream codec (default: jpeg)",
+        choices=StreamOptions.CODECS,
+        default=StreamOptions().codec
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        help="Live stream JPEG quality, 1-100 (default: 80)",
+        default=StreamOptions().quality
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        help="Live stream downscale factor (default: 1)",
+        default=StreamOptions().scale
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        help="Split recordings into segments of this many seconds (default: one file)",
+        default=None
+    )
+    parser.add_argument(
+        "--segment-mb",
+        type=float,
+        help="Split recordings into segments of this many MB (default: one file)",
+        default=None
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        help="Recording format: 'xvid' or 'raw' frames with an index (default: server setting)",
+        choices=["xvid", "raw"],
+        default=None
+    )
+    parser.add_argument(
+        "--rectified",
+        type=int,
+        help="Live stream, record or capture rectified frames (default: 0 for off)",
+        choices=[0, 1],
+        default=0
+    )
+    parser.add_argument(
+        "--full-resolution",
+        type=int,
+        help="Live stream full resolution frames instead of the lores stream (default: 0 for off)",
+        choices=[0, 1],
+        default=0
+    )
+    parser.add_argument(
+        "--depth-algorithm",
+        type=str,
+        help="Depth matcher: 'bm' or 'sgbm' (default: sgbm)",
+        choices=DepthOptions.ALGORITHMS,
+        default=DepthOptions().algorithm
+    )
+    parser.add_argument(
+        "--depth-scale",
+        type=float,
+        help="Downscale factor before depth matching (default: 2)",
+        default=DepthOptions().scale
+    )
+    parser.add_argument(
+        "--num-disparities",
+        type=int,
+        help="Disparity search range, a multiple of 16 (default: 64)",
+        default=DepthOptions().num_disparities
+    )
+    parser.add_argument(
+        "--roi",
+        type=lambda value: [int(v) for v in value.split(",")],
+        help="Depth region of interest as x,y,width,height (default: whole frame)",
+        default=None
+    )
+    parser.add_argument(
+        "--incremental",
+        type=int,
+        help="Only recompute depth where the scene changed (default: 0 for off)",
+        choices=[0, 1],
+        default=0
+    )
+    parser.add_argument(
+        "--fps",
+        type=float,
+        help="Frame rate for set-config (default: unchanged)",
+        default=None
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        help="Frame width for set-config (default: unchanged)",
+        default=None
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        help="Frame height for set-config (default: unchanged)",
+        default=None
+    )
+    parser.add_argument(
+        "--pixel-format",
+        type=str,
+        help="Pixel format for set-config (default: unchanged)",
+        choices=CameraMode.FORMATS,
+        default=None
+    )
+    parser.add_argument(
+        "--pretrigger-seconds",
+        type=float,
+        help="Seconds of capture kept in memory before a recording (default: server setting)",
+        default=None
+    )
+    parser.add_argument(
+        "--pretrigger-mb",
+        type=float,
+        help="Memory cap of the pre-trigger history in MB (default: server setting)",
+        default=None
+    )
     parser.add_argument(
         "--debug",
         type=int,
@@ -250,7 +633,8 @@ def parse_args():
     return parser.parse_args()
 
 
-def main(command,host,port,debug=False,save_logs=False):
+def main(command,host,port,debug=False,save_logs=False,stream_options=None,recording_options=None,
+         pretrigger_options=None,rectified=False,depth_options=None,full_resolution=False,mode_options=None):
 
     print(host,port)
     
@@ -275,20 +659,50 @@ def main(command,host,port,debug=False,save_logs=False):
             error = None
             message = None
             if command == "start-recording":
-                res = client.start_recording()
+                res = client.start_recording(*(recording_options or ()), rectified=rectified)
             elif command == "end-recording":
                 res = client.end_recording()
+            elif command == "arm-pretrigger":
+                res = client.arm_pretrigger(*(pretrigger_options or ()))
+            elif command == "disarm-pretrigger":
+                res = client.disarm_pretrigger()
             elif command == "get-recording":
                 video_paths, error = client.get_recording()
                 if not error:
                     message = f"[📦 SAVED] Files saved: {video_paths}"
             elif command == "start-live":
                 logger.info("[🎥 LIVE] Press 'q' to stop streaming.")
-                client.start_live()
+                client.start_live(stream_options, rectified, full_resolution)
             elif command == "end-live":
                 res = client.end_live()
+            elif command == "stream-status":
+                res = client.get_stream_status()
+                if res and not res.error:
+                    logger.info(res.data)
+            elif command == "start-depth":
+                res = client.start_depth(depth_options)
+            elif command == "get-depth":
+                res = client.get_depth()
+                if res and not res.error:
+                    depth = res.data["depth"]
+                    logger.info(f"Depth of frame {res.data['seq']}: {depth.shape[1]}x{depth.shape[0]}, "
+                                f"median {np.median(depth[depth > 0]) if depth.any() else 0:.0f} mm, "
+                                f"computed in {res.data['compute_ms']:.1f} ms")
+            elif command == "end-depth":
+                res = client.end_depth()
+            elif command == "get-keypoints":
+                res = client.get_keypoints()
+                if res and not res.error:
+                    keypoints = res.data["keypoints"]
+                    logger.info(f"{len(keypoints)} keypoints of frame {res.data['seq']}, "
+                                f"median depth {np.median(keypoints[:, 3]) if len(keypoints) else 0:.0f} mm, "
+                                f"computed in {res.data['compute_ms']:.1f} ms")
+            elif command == "set-config":
+                res = client.set_config(*(mode_options or ()))
+                if res and not res.error:
+                    logger.info(f"{res.message} (first frame after {res.data['first_frame_ms']} ms)")
             elif command == "capture-image":
-                success, result = client.capture_image()
+                success, result = client.capture_image(rectified)
                 if success:
                     message="[📸 IMAGE] Image captured successfully."
                 else:
@@ -355,4 +769,10 @@ def test_recording():
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.command,args.host, args.port, args.debug, args.save_logs)
+    stream_options = StreamOptions(args.codec, args.quality, args.scale)
+    main(args.command,args.host, args.port, args.debug, args.save_logs, stream_options,
+         (args.segment_seconds, args.segment_mb, args.format), (args.pretrigger_seconds, args.pretrigger_mb),
+         bool(args.rectified),
+         DepthOptions(args.depth_algorithm, args.depth_scale, num_disparities=args.num_disparities, roi=args.roi,
+                      incremental=bool(args.incremental)),
+         bool(args.full_resolution), (args.fps, args.width, args.height, args.pixel_format))
@@ -6,4 +6,83 @@ DEBUG = True
 HOST = 'raspberrypi.local'
 PORT_C = 8000
 PORT_S = 8001
-HEADER_SIZE = struct.calcsize("L")
\ No newline at end of file
+HEADER_SIZE = struct.calcsize("L")
+
+# Maximum left/right capture skew of a stereo pair (ms). None uses half a frame period.
+SYNC_TOLERANCE_MS = None
+
+# Number of preallocated stereo frame slots shared by live, record and capture
+RING_SLOTS = 6
+# Keep the capture loop running for the whole server session
+CAPTURE_ALWAYS_ON = True
+# Framing of live stream frames: 'binary' (raw buffers) or 'pickle'
+STREAM_PROTOCOL = 'binary'
+# Largest message body accepted on the command socket (bytes)
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+# Default live stream options: codec ('jpeg', 'png' or 'raw'), JPEG quality and downscale factor
+STREAM_CODEC = 'jpeg'
+STREAM_QUALITY = 80
+STREAM_SCALE = 1
+# Adapt live stream frame rate, scale and quality to hold this capture-to-display latency
+STREAM_ADAPTIVE = True
+STREAM_TARGET_LATENCY_MS = 150
+# Clients acknowledge every displayed frame so the server can measure latency
+STREAM_FEEDBACK = True
+# Clients that can watch the live stream at the same time
+MAX_SUBSCRIBERS = 8
+# Server concurrency model: 'threaded' (one client at a time) or 'async' (asyncio, many clients)
+SERVER_MODE = 'threaded'
+# Worker threads running commands in the async server
+COMMAND_WORKERS = 4
+# Size of the byte ranges a recorded file is sent in; replies to other commands go out in between
+FILE_CHUNK_SIZE = 1024 * 1024
+# Rotate recordings into segments after this many seconds / MB; None records a single file
+RECORDING_SEGMENT_SECONDS = None
+RECORDING_SEGMENT_MB = None
+# Stereo frames that can wait for the recording encoders before frames are dropped
+RECORDING_QUEUE_SIZE = 8
+# Recording format: 'xvid' video files, or 'raw' uncompressed frames with a per-frame index
+RECORDING_FORMAT = 'xvid'
+# Pre-trigger recording: capture time kept in memory while armed, its memory cap (MB) and JPEG quality
+PRETRIGGER_SECONDS = 5
+PRETRIGGER_MAX_MB = 64
+PRETRIGGER_QUALITY = 90
+# Stereo calibration saved from cv2.stereoCalibrate(), see camera/rectification.py; camera/parameters.py is used without it
+CALIBRATION_FILE = 'calibration.npz'
+# Directory caching the rectification tables of each calibration and frame size
+RECTIFY_CACHE_DIR = 'rectify_cache'
+# Rectification scaling: 0 keeps valid pixels only, 1 keeps every source pixel
+RECTIFY_ALPHA = 0
+# Default depth engine options: 'bm' or 'sgbm', downscale factor before matching, disparity search range and window
+DEPTH_ALGORITHM = 'sgbm'
+DEPTH_SCALE = 2
+DEPTH_MIN_DISPARITY = 0
+DEPTH_NUM_DISPARITIES = 64
+DEPTH_BLOCK_SIZE = 5
+# Incremental depth: tile size (px at matching resolution), mean grey-level change marking a tile as moved,
+# full recompute interval (frames) and the changed fraction above which the whole frame is recomputed
+DEPTH_TILE_SIZE = 32
+DEPTH_CHANGE_THRESHOLD = 8
+DEPTH_REFRESH_FRAMES = 30
+DEPTH_MAX_CHANGED = 0.5
+# Sparse stereo: feature detector ('orb' or 'fast'), features kept per frame, matching block and disparity range (px)
+SPARSE_DETECTOR = 'orb'
+SPARSE_MAX_FEATURES = 500
+SPARSE_BLOCK_SIZE = 11
+SPARSE_NUM_DISPARITIES = 128
+# Run the capture loop in a process of its own, publishing frames through shared memory to the server process
+CAPTURE_PROCESS = False
+# How often readers of the shared frame ring check for new frames (ms), and how long to wait for the capture process (s)
+SHARED_RING_POLL_MS = 1
+CAPTURE_PROCESS_TIMEOUT = 10
+# Recycled capture buffers (one eye each); frames are allocated by the backend when all are in use
+FRAME_POOL_SIZE = 16
+# Sensor format: 'RGB888', or 'YUV420' to capture, stream and record the luma (Y) plane only
+CAPTURE_FORMAT = 'RGB888'
+# (width, height) of the secondary low resolution stream live streaming uses by default, None for none
+LORES_SIZE = (320, 240)
+# Live stream the lores frames unless a client asks for full resolution
+LIVE_STREAM_LORES = True
+# Largest (width, height) SET_CONFIG can switch to with the capture process, which sizes its shared slots for it;
+# None for the startup mode
+CAPTURE_PROCESS_MAX_SIZE = None
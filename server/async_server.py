@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import pickle
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from camera.camera import Camera
+from server.camera_server import CameraServer
+from server.stream_hub import StreamHub, Subscriber
+from utils import frame_protocol
+from utils.command_handler import Command, Request, StreamOptions
+from utils.rate_controller import get_send_backlog
+from utils.socket_handler import Streamer, pack_message
+from utils.file_transfer import file_chunk_of
+from config.settings import HOST, PORT_C, PORT_S, CAPTURE_ALWAYS_ON, HEADER_SIZE, MAX_MESSAGE_SIZE, \
+    MAX_SUBSCRIBERS, COMMAND_WORKERS
+
+
+async def read_message(reader, max_message_size=MAX_MESSAGE_SIZE):
+    """
+    Reads one length-prefixed pickled message from a stream.
+
+    Raises:
+        asyncio.IncompleteReadError: If the peer closes the connection.
+        ValueError: If the message is larger than max_message_size.
+    """
+    header = await reader.readexactly(HEADER_SIZE)
+    msg_len = struct.unpack("L", header)[0]
+    if msg_len > max_message_size:
+        raise ValueError(f"Message of {msg_len} bytes exceeds the {max_message_size} byte limit")
+    return pickle.loads(await reader.readexactly(msg_len))
+
+
+class AsyncSubscriber(Subscriber):
+    """
+    Subscriber of the AsyncStreamHub, sending on an asyncio stream instead
+    of a socket thread. All methods are called on the event loop.
+    """
+
+    def __init__(self, reader, writer, options, fps):
+        super().__init__(None, options, fps, addr=writer.get_extra_info("peername"))
+        self.reader = reader
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self.is_connected = True
+
+    @property
+    def connected(self):
+        return self.is_connected
+
+    def offer(self, encoded):
+        self.mailbox.put(encoded)
+        self.ready.set()
+
+    def close(self):
+        self.mailbox.close()
+        self.ready.set()
+
+    async def next_frame(self):
+        """
+        Waits for the next encoded frame.
+
+        Returns:
+            EncodedFrame: The newest frame, or None at the end of the stream.
+        """
+        while True:
+            frame = self.mailbox.get(timeout=0)
+            if frame is not None or self.mailbox.closed:
+                return frame
+            self.ready.clear()
+            await self.ready.wait()
+
+
+class AsyncStreamHub(StreamHub):
+    """
+    StreamHub serving its subscribers from an asyncio event loop.
+
+    Subscribers are coroutines instead of threads, so the number of viewers
+    is not bound by threads. Waiting for frames and encoding them run in
+    executors and never block the loop. start() and stop() may be called
+    from any thread.
+    """
+
+    def __init__(self, host, port, streamer: Streamer, max_subscribers=MAX_SUBSCRIBERS):
+        super().__init__(host, port, streamer, max_subscribers)
+        self.loop = None
+        self.server = None
+        self.capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream-capture")
+
+    async def listen(self):
+        """
+        Binds the stream port on the running event loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.register, self.host, self.port, reuse_address=True)
+        self.logger.info(f"Stream hub listening at {self.host}:{self.port}")
+
+    async def register(self, reader, writer):
+        """
+        Reads a new connection's hello and serves it as a subscriber.
+        """
+        addr = writer.get_extra_info("peername")
+        try:
+            hello = await asyncio.wait_for(read_message(reader), self.HELLO_TIMEOUT)
+            options = StreamOptions.from_dict(hello.get("options")).validate()
+            if hello.get("protocol", "binary") != "binary":
+                raise ValueError("the async server only streams with the binary frame protocol")
+        except Exception as e:
+            self.logger.error(f"Rejected stream subscriber {addr[0]}: {e}")
+            writer.close()
+            return
+
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                self.logger.error(f"Rejected stream subscriber {addr[0]}: too many subscribers")
+                writer.close()
+                return
+            subscriber = AsyncSubscriber(reader, writer, options, getattr(self.streamer, "fps", 30))
+            self.subscribers.append(subscriber)
+        if not self.is_live():
+            subscriber.close()
+
+        self.logger.info(f"Stream subscriber {addr[0]}:{addr[1]} joined ({options}).")
+        await self.serve(subscriber)
+
+    async def serve(self, subscriber):
+        """
+        Sends frames to a subscriber until its stream ends, then removes it.
+        """
+        controller = subscriber.controller
+        writer = subscriber.writer
+        # drain() then waits until everything has been handed to the kernel
+        writer.transport.set_write_buffer_limits(high=0)
+        sock = writer.get_extra_info("socket")
+        acks = asyncio.ensure_future(self.read_acks(subscriber))
+        try:
+            while True:
+                frame = await subscriber.next_frame()
+                if frame is None:
+                    writer.write(frame_protocol.end_marker())
+                    await writer.drain()
+                    break
+                stalled = await self.wait_for_send_buffer(sock, controller.frame_bytes)
+                if stalled:
+                    frame = subscriber.refresh(frame)
+                buffers = frame_protocol.frame_buffers(
+                    frame.codec, frame.seq, frame.timestamp, frame.shape, frame.dtype, frame.left, frame.right
+                )
+                writer.writelines(buffers)
+                await writer.drain()
+                controller.on_sent(frame.seq, sum(len(b) for b in buffers), get_send_backlog(sock), stalled)
+                subscriber.options = controller.options
+                subscriber.min_interval = controller.min_interval
+        except (ConnectionError, OSError) as e:
+            self.logger.info(f"Connection to {subscriber.addr} closed: {e}")
+        finally:
+            subscriber.is_connected = False
+            subscriber.close()
+            acks.cancel()
+            with self.lock:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+            writer.close()
+            self.logger.info(f"Stream subscriber {subscriber.addr[0]}:{subscriber.addr[1]} left.")
+
+    @staticmethod
+    async def wait_for_send_buffer(sock, limit, timeout=1.0):
+        """
+        Waits until no more than limit bytes are queued in the socket's send
+        buffer, see SocketHandler.wait_for_send_buffer().
+
+        Returns:
+            bool: True if the caller had to wait.
+        """
+        if limit is None:
+            return False
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            backlog = get_send_backlog(sock)
+            if backlog is None or backlog <= limit or time.monotonic() > deadline:
+                return waited
+            waited = True
+            await asyncio.sleep(0.002)
+
+    async def read_acks(self, subscriber):
+        try:
+            while True:
+                data = await subscriber.reader.readexactly(frame_protocol.ACK.size)
+                subscriber.controller.on_ack(*frame_protocol.unpack_ack(data))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.debug(f"Stream feedback ended: {e}")
+
+    def start(self):
+        """Starts distributing frames from the streamer to the subscribers."""
+        if self.is_live():
+            return
+        self.live.set()
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.stream_loop()))
+
+    def stop(self):
+        """
+        Ends the stream for all subscribers. The streamer has to be stopped as
+        well so that the hub wakes up.
+        """
+        self.live.clear()
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(super().stop)
+
+    async def distribute(self, frame):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            due = [s for s in self.subscribers if s.connected and s.wants(frame)]
+        if not due:
+            return
+
+        profiles, keys = self.profiles(due)
+        encode = self.streamer.encode_frame
+        encoded = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, encode, frame, options) for options in profiles.values())
+        )
+        encoded = dict(zip(profiles, encoded))
+        self.frames += 1
+        self.encodes += len(encoded)
+
+        for subscriber, key in zip(due, keys):
+            subscriber.offer(encoded[key])
+
+    async def stream_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.is_live():
+            frame = await loop.run_in_executor(self.capture_executor, self.streamer.get_frame)
+            if frame is None:
+                break
+            try:
+                await self.distribute(frame)
+            except Exception as e:
+                self.logger.error(f"Error streaming frame: {e}")
+        self.live.clear()
+        StreamHub.stop(self)
+
+    async def aclose(self):
+        self.live.clear()
+        StreamHub.stop(self)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+        self.capture_executor.shutdown(wait=False)
+
+
+class AsyncCameraServer(CameraServer):
+    """
+    CameraServer running on an asyncio event loop.
+
+    Serves the command port and the stream port from one loop without a
+    thread per client, so any number of clients can send commands and watch
+    the live stream at once. Commands run on a small pool of worker threads,
+    so capture and encoding never block the loop, and a command sent while
+    streaming is answered right away.
+    """
+
+    def __init__(self, host=HOST, port_c=PORT_C, port_s=PORT_S, workers=COMMAND_WORKERS):
+        self.host = host
+        self.port_c = port_c
+        self.command_socket_handler = None
+        self.camera = Camera()
+        self.stream_hub = AsyncStreamHub(host, port_s, self.camera)
+        self.command_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="command")
+        self.server = None
+        self.clients = 0
+        if CAPTURE_ALWAYS_ON:
+            self.camera.start_capture()
+        self.recording_status = False
+        self.logger = logging.getLogger()
+
+    def start(self):
+        """
+        Serve clients until interrupted.
+        """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.command_executor.shutdown(wait=False)
+            self.camera.close()
+
+    async def serve(self):
+        await self.stream_hub.listen()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port_c, reuse_address=True)
+        self.logger.info(f"Server listening at {self.host}:{self.port_c}")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.stream_hub.aclose()
+
+    async def handle_client(self, reader, writer):
+        """
+        Runs the commands of one client connection. Unnumbered requests run
+        one after the other, numbered ones concurrently.
+        """
+        addr = writer.get_extra_info("peername")
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        self.clients += 1
+        self.logger.info(f'Connection established from {addr[0]}')
+
+        async def write(message):
+            chunk = file_chunk_of(message)
+            async with write_lock:
+                writer.writelines(pack_message(message))
+                await writer.drain()
+                if chunk and chunk.source:
+                    with open(chunk.source, "rb") as f:
+                        sent = await loop.sendfile(writer.transport, f, chunk.offset, chunk.length)
+                    if sent != chunk.length:
+                        # The client can't find the next message any more
+                        writer.close()
+                        raise ConnectionError(f"{chunk.name} is shorter than expected")
+
+        def send(message):
+            # Called from command threads
+            try:
+                asyncio.run_coroutine_threadsafe(write(message), loop).result()
+            except (ConnectionError, OSError, RuntimeError) as e:
+                self.logger.debug(f"Could not send to {addr[0]}: {e}")
+
+        try:
+            while True:
+                request: Request = await read_message(reader)
+                self.logger.debug("New Req: " + str(request))
+                if not request:
+                    continue
+                if request.command == Command.EXIT:
+                    # Other clients may still be using the camera
+                    break
+                dispatched = loop.run_in_executor(self.command_executor, self.dispatch, request, send)
+                if getattr(request, "request_id", None) is None:
+                    await dispatched
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.logger.error(f"Error serving {addr[0]}: {e}")
+        finally:
+            self.clients -= 1
+            writer.close()
+            self.logger.info(f"Client {addr[0]}:{addr[1]} disconnected.")
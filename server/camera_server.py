@@ -1,10 +1,18 @@
+import os
+import math
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from utils.socket_handler import SocketHandler
+from server.stream_hub import StreamHub
+from camera.recording import RecordingSession
+from utils.file_transfer import file_info, file_chunks
 from camera.camera import Camera
-from utils.command_handler import Command, Response,Request,FrameData,CameraConfig,Header
+from camera.pointcloud import point_cloud
+from utils.command_handler import Command, Response,Request,Reply,FrameData,CameraConfig,Header,StreamOptions,DepthOptions,CameraMode
 import argparse
 import cv2
-from config.settings import HOST,PORT_C,PORT_S
+from config.settings import HOST,PORT_C,PORT_S,CAPTURE_ALWAYS_ON,SERVER_MODE,COMMAND_WORKERS,FILE_CHUNK_SIZE,RECORDING_FORMAT, \
+    PRETRIGGER_SECONDS,PRETRIGGER_MAX_MB,LIVE_STREAM_LORES
 
 def stero_video_reader(callback,left_file_name,right_file_name):
     cap_left = cv2.VideoCapture(left_file_name)
@@ -36,6 +44,46 @@ def stero_video_reader(callback,left_file_name,right_file_name):
     cap_left.release()
     cap_right.release()
 
+def positive_number(params, key, default=None):
+    """
+    Reads a request parameter that has to be a finite number greater than zero.
+
+    Returns:
+        float: The value, or default if the parameter is missing.
+
+    Raises:
+        ValueError: If the value is not a positive finite number.
+    """
+    value = params.get(key)
+    if value is None:
+        return default
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number, got {value!r}")
+    if not 0 < value < math.inf:
+        raise ValueError(f"{key} must be a finite number greater than 0")
+    return value
+
+
+def sequence_number(params, key):
+    """
+    Reads an optional request parameter that has to be a frame sequence number.
+
+    Returns:
+        int: The value, or None if the parameter is missing.
+
+    Raises:
+        ValueError: If the value is not an integer of at least 0.
+    """
+    value = params.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{key} must be an integer of at least 0, got {value!r}")
+    return value
+
+
 class CameraServer:
     """
     Server class to handle camera commands over a socket.
@@ -49,8 +97,12 @@ class CameraServer:
         """
         self.command_socket_handler = SocketHandler(host,port_c,type=SocketHandler.TYPE_SERVER)
         self.command_socket_handler.init_reciever()
-        self.stream_socket_handler = SocketHandler(host,port_s,type=SocketHandler.TYPE_SERVER)
         self.camera = Camera()
+        self.stream_hub = StreamHub(host, port_s, self.camera)
+        self.stream_hub.listen()
+        self.command_executor = ThreadPoolExecutor(max_workers=COMMAND_WORKERS, thread_name_prefix="command")
+        if CAPTURE_ALWAYS_ON:
+            self.camera.start_capture()
         self.recording_status = False
         self.logger = logging.getLogger()
 
@@ -61,41 +113,99 @@ class CameraServer:
         res = self.command_socket_handler.recieve()
         return res
 
-    def handle_command(self, command):
+    def dispatch(self, request, send=None):
+        """
+        Handles a request, tagging everything sent back with its request ID.
+
+        Requests without an ID get bare responses as before. For numbered
+        requests every message is wrapped in a Reply and a final Reply is sent
+        once the command is done.
+
+        Args:
+            request (Request): The request.
+            send (callable, optional): Sends a message to the requesting client.
+                Defaults to the command socket.
+        """
+        send = send or self.command_socket_handler.send
+        params = getattr(request, "params", None)
+        request_id = getattr(request, "request_id", None)
+        if request_id is None:
+            self.handle_command(request.command, params, send)
+            return
+
+        def reply(message):
+            if isinstance(message, Response):
+                message.request_id = request_id
+            send(Reply(request_id, message))
+
+        try:
+            self.handle_command(request.command, params, reply)
+        finally:
+            send(Reply(request_id, final=True))
+
+    def handle_command(self, command, params=None, send=None):
         """
         Handle incoming requests from the client.
         Routes the request to appropriate camera operation.
+
+        Args:
+            command (Command): The requested operation.
+            params (dict, optional): Parameters of the request.
+            send (callable, optional): Sends a response to the requesting client.
+                Defaults to the command socket.
         """
+        send = send or self.command_socket_handler.send
         try:
             self.logger.info("Got command :"+str(command))
             if command == Command.START_RECORDING:
                 if self.camera.is_recording():
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Already recording!"))
+                    send(Response(Response.TYPE_ERROR, error="Already recording!"))
+                    return
+                params = params or {}
+                try:
+                    # Missing or 0 leaves the segments unlimited
+                    segment_seconds, segment_mb = (
+                        positive_number(params, key) if params.get(key) else None
+                        for key in ("segment_seconds", "segment_mb")
+                    )
+                except ValueError as e:
+                    send(Response(Response.TYPE_ERROR, error=f"Segment limits must be positive numbers: {e}"))
+                    return
+                format = params.get("format") or RECORDING_FORMAT
+                if format not in RecordingSession.FORMATS:
+                    send(Response(Response.TYPE_ERROR, error=f"Unknown recording format '{format}'"))
                     return
+                pretrigger = self.camera.pretrigger if params.get("pretrigger", True) else None
                 self.logger.info("Starting recording...")
-                self.camera.start_recording()
+                self.camera.start_recording(segment_seconds=segment_seconds, segment_mb=segment_mb, format=format,
+                                            pretrigger=pretrigger is not None, rectified=bool(params.get("rectified")))
                 self.logger.info("Recording started.")
-                self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Recording started."))
+                if pretrigger:
+                    stats = pretrigger.get_stats()
+                    send(Response(Response.TYPE_MESSAGE,
+                                  message=f"Recording started with {stats['seconds']:.1f}s of pre-trigger history."))
+                else:
+                    send(Response(Response.TYPE_MESSAGE, message="Recording started."))
 
             elif command == Command.END_RECORDING:
                 if not self.camera.is_recording():
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Camera is not recording!"))
+                    send(Response(Response.TYPE_ERROR, error="Camera is not recording!"))
                     return
 
                 self.camera.end_recording()
                 if not self.camera.is_recording():
-                    self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Recording ended."))
+                    send(Response(Response.TYPE_MESSAGE, message="Recording ended."))
                     self.recording_status = False
                 else:
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Couldn't stop recording."))
+                    send(Response(Response.TYPE_ERROR, error="Couldn't stop recording."))
 
             elif command == Command.CAPTURE_IMAGE:
-                img_left, img_right = self.camera.capture_image()
-                self.command_socket_handler.send(Response(Response.TYPE_DATA, data={"left_img": img_left, "right_img": img_right}))
+                img_left, img_right = self.camera.capture_image(rectified=bool((params or {}).get("rectified")))
+                send(Response(Response.TYPE_DATA, data={"left_img": img_left, "right_img": img_right}))
 
             elif command == Command.GET_RECORDING:
                 if self.camera.is_recording():
-                    self.command_socket_handler.send(Response(
+                    send(Response(
                         Response.TYPE_ERROR,
                         error="Can't send recording while camera is recording! Stop the recording first!"
                     ))
@@ -104,16 +214,178 @@ class CameraServer:
 
                 rec_file_name = self.camera.get_recorded_file()
                 if not rec_file_name[0]:
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="No recording exists!")) 
+                    send(Response(Response.TYPE_ERROR, error="No recording exists!")) 
+                    return
+                if not rec_file_name[0].endswith(".avi"):
+                    send(Response(Response.TYPE_ERROR, error="Raw recordings can only be downloaded as files!"))
                     return
 
-                self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Sending recording...")) 
-                stero_video_reader(self.command_socket_handler.send,*rec_file_name)
-                self.camera.clear_recordings()
+                send(Response(Response.TYPE_MESSAGE, message="Sending recording...")) 
+                stero_video_reader(send,*rec_file_name)
+                self.camera.clear_recordings([os.path.basename(f) for f in rec_file_name])
+
+            elif command == Command.RECORDING_INFO:
+                # Closed segments are listed while the recording goes on
+                recording = self.camera.is_recording()
+                files = self.camera.get_recording_files()
+                if not files and not recording:
+                    send(Response(Response.TYPE_ERROR, error="No recording exists!"))
+                    return
+                infos = [file_info(path, name).to_dict() for name, path in sorted(files.items())]
+                send(Response(Response.TYPE_DATA, data={
+                    "files": infos,
+                    "recording": recording,
+                    "manifest": self.camera.get_recording_manifest(),
+                    "pretrigger": self.camera.pretrigger.get_stats() if self.camera.pretrigger else None,
+                }, message="Recording files."))
+
+            elif command == Command.GET_FILE:
+                # Sends the recorded bytes as they are, see utils/file_transfer.py
+                params = params or {}
+                name = params.get("name")
+                path = self.camera.get_recording_files().get(name)
+                if not path:
+                    send(Response(Response.TYPE_ERROR, error=f"No finished recording file '{name}'!"))
+                    return
+                info = file_info(path, name)
+                try:
+                    offset = int(params.get("offset") or 0)
+                    length = params.get("length")
+                    length = None if length is None else int(length)
+                except (TypeError, ValueError):
+                    send(Response(Response.TYPE_ERROR, error="Offset and length must be integers"))
+                    return
+                if length is not None and length < 0:
+                    send(Response(Response.TYPE_ERROR, error=f"Length {length} is negative"))
+                    return
+                end = info.size if length is None else min(info.size, offset + length)
+                if not 0 <= offset <= info.size:
+                    send(Response(Response.TYPE_ERROR, error=f"Offset {offset} is outside of '{name}'"))
+                    return
+                send(Response(Response.TYPE_DATA, data=info.to_dict(), message=f"Sending {name} [{offset}, {end})..."))
+                for chunk in file_chunks(name, path, offset, end, FILE_CHUNK_SIZE):
+                    send(chunk)
+
+            elif command == Command.CLEAR_RECORDING:
+                # Only finished files are ever deleted, so this is safe while recording
+                names = self.camera.clear_recordings((params or {}).get("names"))
+                if not names:
+                    send(Response(Response.TYPE_ERROR, error="No finished recording to clear!"))
+                    return
+                send(Response(Response.TYPE_DATA, data={"deleted": names}, message=f"Deleted {len(names)} file(s)."))
+
+            elif command == Command.ARM_PRETRIGGER:
+                params = params or {}
+                try:
+                    seconds = positive_number(params, "seconds", PRETRIGGER_SECONDS)
+                    max_mb = positive_number(params, "max_mb", PRETRIGGER_MAX_MB)
+                except ValueError as e:
+                    send(Response(Response.TYPE_ERROR, error=f"Pre-trigger {e}"))
+                    return
+                buffer = self.camera.arm_pretrigger(seconds, max_mb)
+                send(Response(Response.TYPE_DATA, data=buffer.get_stats(),
+                              message=f"Pre-trigger armed: last {seconds:g}s, at most {max_mb:g} MB."))
+
+            elif command == Command.DISARM_PRETRIGGER:
+                buffer = self.camera.pretrigger
+                if buffer is None:
+                    send(Response(Response.TYPE_ERROR, error="Pre-trigger is not armed!"))
+                    return
+                stats = buffer.get_stats()
+                self.camera.disarm_pretrigger()
+                send(Response(Response.TYPE_DATA, data=stats, message="Pre-trigger disarmed."))
+
+            elif command == Command.START_DEPTH:
+                try:
+                    options = DepthOptions.from_dict(params).validate()
+                except (TypeError, ValueError) as e:
+                    send(Response(Response.TYPE_ERROR, error=str(e)))
+                    return
+                self.camera.start_depth(options)
+                send(Response(Response.TYPE_MESSAGE, message=f"Depth started ({options})."))
+
+            elif command == Command.END_DEPTH:
+                if self.camera.depth_stage is None:
+                    send(Response(Response.TYPE_ERROR, error="Depth is not running!"))
+                    return
+                stats = self.camera.depth_stage.get_stats()
+                self.camera.stop_depth()
+                send(Response(Response.TYPE_DATA, data=stats, message="Depth stopped."))
+
+            elif command == Command.GET_DEPTH:
+                params = params or {}
+                stage = self.camera.depth_stage
+                if stage is None:
+                    send(Response(Response.TYPE_ERROR, error="Depth is not running! Send START_DEPTH first."))
+                    return
+                try:
+                    timeout = positive_number(params, "timeout", 1.0)
+                    after_seq = sequence_number(params, "after_seq")
+                except ValueError as e:
+                    send(Response(Response.TYPE_ERROR, error=str(e)))
+                    return
+                depth = stage.get(after_seq, timeout)
+                if depth is None:
+                    send(Response(Response.TYPE_ERROR, error="No depth frame available yet."))
+                    return
+                data = depth.to_dict(disparity=bool(params.get("disparity")))
+                data["stats"] = stage.get_stats()
+                send(Response(Response.TYPE_DATA, data=data, message=f"Depth of frame {depth.seq}."))
+
+            elif command == Command.GET_POINT_CLOUD:
+                params = params or {}
+                stage = self.camera.depth_stage
+                if stage is None:
+                    send(Response(Response.TYPE_ERROR, error="Depth is not running! Send START_DEPTH first."))
+                    return
+                try:
+                    timeout = positive_number(params, "timeout", 1.0)
+                    voxel_size = positive_number(params, "voxel_size")
+                    max_depth = positive_number(params, "max_depth")
+                    after_seq = sequence_number(params, "after_seq")
+                except ValueError as e:
+                    send(Response(Response.TYPE_ERROR, error=str(e)))
+                    return
+                depth = stage.get(after_seq, timeout)
+                if depth is None:
+                    send(Response(Response.TYPE_ERROR, error="No depth frame available yet."))
+                    return
+                frame = params.get("frame") or "base"
+                if frame not in ("base", "camera"):
+                    send(Response(Response.TYPE_ERROR, error=f"Unknown frame '{frame}', expected base or camera"))
+                    return
+                points = point_cloud(
+                    depth, colors=bool(params.get("colors")), voxel_size=voxel_size,
+                    max_depth=max_depth, frame=frame
+                )
+                send(Response(Response.TYPE_DATA, data={
+                    "seq": depth.seq, "timestamp": depth.timestamp, "frame": frame, "points": points,
+                }, message=f"{len(points)} points of frame {depth.seq}."))
+
+            elif command == Command.GET_KEYPOINTS:
+                frame, keypoints = self.camera.capture_keypoints()
+                if keypoints is None:
+                    send(Response(Response.TYPE_ERROR, error="No frame available for keypoints."))
+                    return
+                send(Response(Response.TYPE_DATA, data={
+                    "seq": frame.seq, "timestamp": frame.timestamp, "keypoints": keypoints,
+                    "compute_ms": self.camera.sparse_stereo.compute_ms,
+                }, message=f"{len(keypoints)} keypoints of frame {frame.seq}."))
+
+            elif command == Command.SET_CONFIG:
+                try:
+                    mode = CameraMode.from_dict(params, self.camera.get_mode())
+                    result = self.camera.set_mode(mode)
+                except (TypeError, ValueError, RuntimeError, EOFError, OSError) as e:
+                    # The camera is still in its previous mode
+                    send(Response(Response.TYPE_ERROR, error=str(e)))
+                    return
+                send(Response(Response.TYPE_DATA, data=result,
+                              message=f"Camera mode set to {mode} in {result['switch_ms']:.1f} ms."))
 
             elif command == Command.EXIT:
                 if self.camera.is_recording():
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Stop recording before exiting."))
+                    send(Response(Response.TYPE_ERROR, error="Stop recording before exiting."))
                     return
 
                 self.camera.close()
@@ -121,32 +393,42 @@ class CameraServer:
                 # self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Camera closed!"))
 
             elif command == Command.START_LIVE:
-                if self.camera.is_recording():
-                    self.command_socket_handler.send(Response(
-                        Response.TYPE_ERROR,
-                        error="Can't start live streaming while recording!"
-                    ))
-                elif not self.camera.is_live_streaming():
-                    self.camera.start_live_streaming()
-                    self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Live streaming started."))
-                    self.stream_socket_handler.send_live_stream(self.camera, separe_thread=True)
+                # Options are checked here, each subscriber sends its own on the stream port
+                try:
+                    options = StreamOptions.from_dict(params).validate()
+                except (TypeError, ValueError) as e:
+                    send(Response(Response.TYPE_ERROR, error=str(e)))
+                    return
+                rectified = bool((params or {}).get("rectified"))
+                # The lores stream unless a client asks for full resolution frames
+                lores = not (params or {}).get("full_resolution")
+                if not self.camera.is_live_streaming():
+                    self.camera.start_live_streaming(rectified, lores=lores and LIVE_STREAM_LORES)
+                    self.stream_hub.start()
+                    send(Response(Response.TYPE_MESSAGE, message=f"Live streaming started ({options})."))
                 else:
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Already live streaming."))
+                    self.camera.start_live_streaming(rectified)
+                    send(Response(Response.TYPE_MESSAGE, message=f"Joining live stream ({options})."))
 
             elif command == Command.END_LIVE:
                 if not self.camera.is_live_streaming():
-                    self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Not in live streaming!"))
+                    send(Response(Response.TYPE_ERROR, error="Not in live streaming!"))
                 else:
+                    self.stream_hub.stop()
                     self.camera.stop_live_streaming()
-                    self.command_socket_handler.send(Response(Response.TYPE_MESSAGE, message="Live streaming ended."))
+                    send(Response(Response.TYPE_MESSAGE, message="Live streaming ended."))
+
+            elif command == Command.STREAM_STATUS:
+                status = self.stream_hub.get_status()
+                send(Response(Response.TYPE_DATA, data=status, message="Stream status."))
 
             else:
-                self.command_socket_handler.send(Response(Response.TYPE_ERROR, error="Invalid command!"))
+                send(Response(Response.TYPE_ERROR, error="Invalid command!"))
 
         except Exception as e:
             self.camera.close()
             self.logger.exception("Exception while handling request")
-            self.command_socket_handler.send(Response(Response.TYPE_ERROR, error=f"Internal server error: {str(e)}"))
+            send(Response(Response.TYPE_ERROR, error=f"Internal server error: {str(e)}"))
 
     def start(self):
         """
@@ -156,12 +438,19 @@ class CameraServer:
             while True:
                 request = self.get_request()
                 self.logger.debug("New Req: "+str(request))
-                if request:
-                    self.handle_command(request.command)
+                if not request:
+                    continue
+                if getattr(request, "request_id", None) is None or request.command == Command.EXIT:
+                    self.dispatch(request)
+                else:
+                    # Numbered requests run concurrently, e.g. a capture during a download
+                    self.command_executor.submit(self.dispatch, request)
         except Exception as e:
             # self.logger.exception("Error in server loop")
             self.command_socket_handler.send(Response(Response.TYPE_ERROR, error=f"An error occurred: {str(e)}"))
         finally:
+            self.command_executor.shutdown(wait=False)
+            self.stream_hub.close()
             self.camera.close()
             self.command_socket_handler.close()
 
@@ -195,10 +484,17 @@ def parse_args():
         choices=[0, 1],
         default=0
     )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help=f"Server mode: 'threaded' or 'async' for many clients (default: '{SERVER_MODE}')",
+        choices=["threaded", "async"],
+        default=SERVER_MODE
+    )
 
     return parser.parse_args()
 
-def main(host='raspberrypi.local',port=8000,debug=False,save_logs=False):
+def main(host='raspberrypi.local',port=8000,debug=False,save_logs=False,mode=SERVER_MODE):
     """
     Entry point for the Camera Server.
     Initializes logging, camera, socket handler, and starts server.
@@ -218,11 +514,15 @@ def main(host='raspberrypi.local',port=8000,debug=False,save_logs=False):
         handler.setFormatter(formatter)
         logger.addHandler(handler)
 
-    cs = CameraServer(host, port_c=port, port_s=port+1)
+    if mode == "async":
+        from server.async_server import AsyncCameraServer
+        cs = AsyncCameraServer(host, port_c=port, port_s=port+1)
+    else:
+        cs = CameraServer(host, port_c=port, port_s=port+1)
     cs.start()
 
 
 
 if __name__ == '__main__':
     args = parse_args()
-    main(args.host, args.port, args.debug, args.save_logs)
+    main(args.host, args.port, args.debug, args.save_logs, args.mode)
@@ -0,0 +1,281 @@
+import socket
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from utils.socket_handler import SocketHandler, Streamer
+from utils.command_handler import StreamOptions
+from utils.mailbox import LatestFrameMailbox
+from utils.rate_controller import StreamRateController
+from utils.stream_codec import StreamEncoder
+from config.settings import STREAM_TARGET_LATENCY_MS, STREAM_ADAPTIVE, MAX_SUBSCRIBERS
+
+
+class Subscriber:
+    """
+    One client connected to the stream port.
+
+    Holds the client's own rate controller and a latest-frame mailbox, so a
+    slow subscriber only ever drops its own frames. Exposes the same get(),
+    refresh(), options and min_interval interface as a StreamEncoder, which
+    lets SocketHandler.stream_frames() send from it.
+    """
+
+    def __init__(self, handler, options, fps, addr=None):
+        """
+        Args:
+            handler (SocketHandler): Handler wrapping the accepted connection.
+            options (StreamOptions): Options the client asked for.
+            fps (float): Capture frame rate.
+            addr (tuple, optional): Client address. Defaults to the handler's.
+        """
+        self.handler = handler
+        self.addr = addr or handler.reciever_addr
+        self.controller = StreamRateController(options, fps, STREAM_TARGET_LATENCY_MS, adaptive=STREAM_ADAPTIVE)
+        self.mailbox = LatestFrameMailbox()
+        self.options = options
+        self.min_interval = 0
+        self.last_timestamp = None
+        self.frames_skipped = 0
+        self.thread = None
+
+    @property
+    def connected(self):
+        return self.handler.connected
+
+    @property
+    def profile(self):
+        """Key of the encoding this subscriber currently needs."""
+        return self.profile_of(self.options)
+
+    @staticmethod
+    def profile_of(options):
+        return options.codec, int(options.quality), float(options.scale)
+
+    def wants(self, frame):
+        """
+        Whether the frame is due for this subscriber under its current frame rate.
+        """
+        if (self.last_timestamp is not None
+                and frame.timestamp - self.last_timestamp < self.min_interval * StreamEncoder.INTERVAL_SLACK):
+            self.frames_skipped += 1
+            return False
+        self.last_timestamp = frame.timestamp
+        return True
+
+    def offer(self, encoded):
+        self.mailbox.put(encoded)
+
+    def get(self, timeout=None):
+        return self.mailbox.get(timeout=timeout)
+
+    def refresh(self, frame):
+        return self.mailbox.refresh(frame)
+
+    def close(self):
+        """Ends this subscriber's stream; its sender sends the end marker and exits."""
+        self.mailbox.close()
+
+    def get_status(self):
+        status = self.controller.get_status()
+        stats = self.mailbox.get_stats()
+        status["address"] = f"{self.addr[0]}:{self.addr[1]}" if self.addr else None
+        status["frames"] = {
+            "encoded": stats["put"],
+            "delivered": stats["delivered"],
+            "dropped": stats["dropped"],
+            "skipped": self.frames_skipped,
+        }
+        return status
+
+
+class StreamHub:
+    """
+    Serves the live stream to any number of subscribers on the stream port.
+
+    Clients connect to the stream port and send a hello with their
+    StreamOptions (see SocketHandler.subscribe()). They can join and leave at
+    any time without restarting the stream. While the hub is live, a single
+    thread takes each new frame from the streamer, encodes it once per
+    distinct profile among the subscribers due for it, and hands the same
+    bytes to every subscriber of that profile. Each subscriber has its own
+    sender thread, so a slow one never holds up the others.
+    """
+
+    HELLO_TIMEOUT = 5.0
+
+    def __init__(self, host, port, streamer: Streamer, max_subscribers=MAX_SUBSCRIBERS):
+        """
+        Args:
+            host (str): Address to listen on.
+            port (int): Stream port.
+            streamer (Streamer): Frame source, normally the Camera.
+            max_subscribers (int): Connections accepted at the same time.
+        """
+        self.host = host
+        self.port = port
+        self.streamer = streamer
+        self.max_subscribers = max_subscribers
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.socket = None
+        self.accept_thread = None
+        self.stream_thread = None
+        self.live = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stream-encode")
+        self.frames = 0
+        self.encodes = 0
+
+    def listen(self):
+        """
+        Binds the stream port and starts accepting subscribers in the background.
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.max_subscribers)
+        self.logger.info(f"Stream hub listening at {self.host}:{self.port}")
+        self.accept_thread = threading.Thread(target=self.accept_loop, name="stream-accept", daemon=True)
+        self.accept_thread.start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, addr = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.register, args=(conn, addr), daemon=True).start()
+
+    def register(self, conn, addr):
+        """
+        Reads a new connection's hello and adds it as a subscriber.
+        """
+        handler = SocketHandler(self.host, self.port, type=SocketHandler.TYPE_SERVER, reconnect=False)
+        handler.reciever = conn
+        handler.reciever_addr = addr
+        handler.is_inilialized = True
+        try:
+            conn.settimeout(self.HELLO_TIMEOUT)
+            hello = handler.recv_message()
+            conn.settimeout(None)
+            options = StreamOptions.from_dict(hello.get("options")).validate()
+            handler.frame_protocol = hello.get("protocol", handler.frame_protocol)
+        except Exception as e:
+            self.logger.error(f"Rejected stream subscriber {addr[0]}: {e}")
+            conn.close()
+            return
+
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                self.logger.error(f"Rejected stream subscriber {addr[0]}: too many subscribers")
+                conn.close()
+                return
+            subscriber = Subscriber(handler, options, getattr(self.streamer, "fps", 30))
+            self.subscribers.append(subscriber)
+            if not self.is_live():
+                subscriber.close()
+
+        self.logger.info(f"Stream subscriber {addr[0]}:{addr[1]} joined ({options}).")
+        subscriber.thread = threading.Thread(target=self.serve, args=(subscriber,), daemon=True)
+        subscriber.thread.start()
+
+    def serve(self, subscriber):
+        """
+        Sender thread of a subscriber; removes it once its stream has ended.
+        """
+        try:
+            subscriber.handler.stream_frames(subscriber, subscriber.controller)
+        finally:
+            subscriber.close()
+            with self.lock:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+            subscriber.handler.reciever.close()
+            self.logger.info(f"Stream subscriber {subscriber.addr[0]}:{subscriber.addr[1]} left.")
+
+    def is_live(self):
+        return self.live.is_set()
+
+    def start(self):
+        """Starts distributing frames from the streamer to the subscribers."""
+        if self.is_live():
+            return
+        self.live.set()
+        self.stream_thread = threading.Thread(target=self.stream_loop, name="stream-hub", daemon=True)
+        self.stream_thread.start()
+
+    def stop(self):
+        """
+        Ends the stream for all subscribers. The streamer has to be stopped as
+        well so that the hub thread wakes up.
+        """
+        self.live.clear()
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+    def stream_loop(self):
+        while self.is_live():
+            frame = self.streamer.get_frame()
+            if frame is None:
+                break
+            try:
+                self.distribute(frame)
+            except Exception as e:
+                self.logger.error(f"Error streaming frame: {e}")
+        self.stop()
+
+    def distribute(self, frame):
+        """Encodes a frame once per profile and offers it to the subscribers due for it."""
+        with self.lock:
+            due = [s for s in self.subscribers if s.connected and s.wants(frame)]
+        if not due:
+            return
+
+        profiles, keys = self.profiles(due)
+        encode = self.streamer.encode_frame
+        encoded = dict(zip(profiles, self.executor.map(lambda o: encode(frame, o), profiles.values())))
+        self.frames += 1
+        self.encodes += len(encoded)
+
+        for subscriber, key in zip(due, keys):
+            subscriber.offer(encoded[key])
+
+    @staticmethod
+    def profiles(subscribers):
+        """
+        Takes the options of the subscribers once, as their sender threads may
+        replace them while the frame is being encoded.
+
+        Returns:
+            tuple: (profiles, keys). Options of every distinct profile among
+            the subscribers by profile, and the profile of each subscriber.
+        """
+        profiles = {}
+        keys = []
+        for subscriber in subscribers:
+            options = subscriber.options
+            key = Subscriber.profile_of(options)
+            profiles.setdefault(key, options)
+            keys.append(key)
+        return profiles, keys
+
+    def get_status(self):
+        """
+        Returns:
+            dict: Hub counters and the status of every subscriber.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        return {
+            "live": self.is_live(),
+            "frames": self.frames,
+            "encodes": self.encodes,
+            "subscribers": [s.get_status() for s in subscribers],
+        }
+
+    def close(self):
+        self.stop()
+        if self.socket:
+            self.socket.close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,74 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from server.async_server import read_message, AsyncSubscriber, AsyncStreamHub
+from utils.command_handler import Command, Request, StreamOptions
+from utils.socket_handler import pack_message
+
+
+class TestAsyncServer(unittest.TestCase):
+
+    def test_read_message(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            for buffer in pack_message(Request(Command.STREAM_STATUS)):
+                reader.feed_data(buffer)
+            return await read_message(reader)
+
+        request = asyncio.run(run())
+        self.assertEqual(request.command, Command.STREAM_STATUS)
+
+    def test_read_message_limit(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            for buffer in pack_message(b"x" * 100):
+                reader.feed_data(buffer)
+            return await read_message(reader, max_message_size=10)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+
+    def test_subscriber_gets_newest_frame(self):
+        async def run():
+            writer = MagicMock()
+            writer.get_extra_info.return_value = ("127.0.0.1", 1234)
+            subscriber = AsyncSubscriber(MagicMock(), writer, StreamOptions(), 30)
+            waiter = asyncio.ensure_future(subscriber.next_frame())
+            await asyncio.sleep(0)
+            subscriber.offer("first")
+            first = await waiter
+            subscriber.offer("second")
+            subscriber.offer("third")
+            newest = await subscriber.next_frame()
+            subscriber.close()
+            return first, newest, await subscriber.next_frame()
+
+        self.assertEqual(asyncio.run(run()), ("first", "third", None))
+
+    def test_hub_survives_options_changed_while_encoding(self):
+        async def run():
+            writer = MagicMock()
+            writer.get_extra_info.return_value = ("127.0.0.1", 1234)
+            subscriber = AsyncSubscriber(MagicMock(), writer, StreamOptions("jpeg", 80, 1), 30)
+            streamer = MagicMock()
+
+            def encode(frame, options):
+                # The rate controller changes level while the frame is encoded
+                subscriber.options = StreamOptions("jpeg", 60, 1.5)
+                return (options.quality, frame.timestamp)
+
+            streamer.encode_frame = encode
+            hub = AsyncStreamHub("127.0.0.1", 0, streamer)
+            hub.subscribers.append(subscriber)
+            await hub.distribute(SimpleNamespace(timestamp=1))
+            await hub.distribute(SimpleNamespace(timestamp=2))
+            hub.executor.shutdown()
+            hub.capture_executor.shutdown()
+            return await subscriber.next_frame(), hub.encodes
+
+        self.assertEqual(asyncio.run(run()), ((60, 2), 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import time
+import unittest
+from unittest.mock import patch
+import numpy as np
+from camera.camera import Camera
+from utils.command_handler import CameraMode
+
+
+class FakePicamera2:
+    """Delivers frames of the configured size and format, like Picamera2."""
+
+    def __init__(self, id):
+        self.fps = 100
+        self.frame_width, self.frame_height = self.frame_size = (64, 48)
+        self.config = None
+        self.configs_built = 0
+
+    def create_video_configuration(self, main, controls, lores=None):
+        self.configs_built += 1
+        return {"main": main, "lores": lores, "controls": controls}
+
+    def configure(self, config):
+        self.config = config
+
+    def capture_array(self, name="main", out=None):
+        stream = self.config[name]
+        width, height = stream["size"]
+        if name == "main":
+            time.sleep(0.01)
+        if stream["format"] == "YUV420":
+            return np.zeros((height * 3 // 2, width), np.uint8)
+        return np.zeros((height, width, 3), np.uint8)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestCameraMode(unittest.TestCase):
+
+    def test_rejects_bad_modes(self):
+        for mode in (
+            CameraMode(0, 640, 480, "RGB888"),
+            CameraMode(30, 641, 480, "RGB888"),
+            CameraMode(30, 640, -2, "RGB888"),
+            CameraMode(30, 640, 480, "NV12"),
+        ):
+            with self.assertRaises(ValueError):
+                mode.validate()
+
+    def test_missing_values_from_defaults(self):
+        mode = CameraMode.from_dict({"fps": 5}, CameraMode(30, 640, 480, "RGB888"))
+        self.assertEqual(mode.key, (5.0, 640, 480, "RGB888"))
+        with self.assertRaises(ValueError):
+            CameraMode.from_dict({"fps": 5})
+
+
+class TestSetMode(unittest.TestCase):
+
+    def setUp(self):
+        with patch("camera.camera.Picamera2", FakePicamera2):
+            self.camera = Camera(capture_process=False)
+        self.camera.start_capture()
+
+    def tearDown(self):
+        self.camera.close()
+
+    def test_switch_between_cached_modes(self):
+        tracking, inspection = CameraMode(60, 32, 24, "RGB888"), CameraMode(10, 64, 48, "YUV420")
+        results = [self.camera.set_mode(mode) for mode in (tracking, inspection, tracking)]
+        self.assertEqual([r["cached"] for r in results], [False, False, True])
+        self.assertEqual(self.camera.cam_left.configs_built, 3)
+        self.assertIsNotNone(results[-1]["first_frame_ms"])
+        self.assertEqual(self.camera.ring.frame_shape, (24, 32, 3))
+        self.assertEqual(self.camera.lores_ring.frame_shape, (24, 32, 3))
+        self.assertEqual(self.camera.get_mode().key, tracking.key)
+
+    def test_refused_while_recording(self):
+        self.camera.recording_event.set()
+        try:
+            with self.assertRaises(RuntimeError):
+                self.camera.set_mode(CameraMode(10, 64, 48, "RGB888"))
+        finally:
+            self.camera.recording_event.clear()
+
+    def test_failed_switch_keeps_the_previous_mode(self):
+        before = self.camera.get_mode().key
+        reader = self.camera.ring.reader("test")
+        shape = reader.read(timeout=1).left.shape
+        configure = self.camera.cam_right.configure
+
+        def reject(config):
+            if config["main"]["size"] == (32, 24):
+                raise RuntimeError("unsupported mode")
+            configure(config)
+
+        self.camera.cam_right.configure = reject
+        with self.assertRaises(RuntimeError):
+            self.camera.set_mode(CameraMode(60, 32, 24, "RGB888"))
+        self.assertEqual(self.camera.get_mode().key, before)
+        reader.seek(self.camera.ring.head)
+        frame = reader.read(timeout=1)
+        self.assertIsNotNone(frame)
+        self.assertEqual(frame.left.shape, shape)
+        self.assertEqual(self.camera.cam_left.config["main"]["size"], self.camera.main["size"])
+
+    def test_beyond_the_sensor(self):
+        with self.assertRaises(ValueError):
+            self.camera.set_mode(CameraMode(10, 4000, 3000, "RGB888"))
+
+
+if __name__ == "__main__":
+    unittest.main()
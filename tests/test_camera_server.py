@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import MagicMock
 from server.camera_server import CameraServer
-from utils.command_handler import Command
+from utils.command_handler import Command, Response
 
 
 class TestCameraServer(unittest.TestCase):
@@ -29,5 +29,49 @@ class TestCameraServer(unittest.TestCase):
         self.mock_socket.send.assert_called()
 
 
+class TestRequestValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CameraServer.__new__(CameraServer)
+        self.server.camera = MagicMock()
+        self.server.logger = MagicMock()
+        self.sent = []
+
+    def assertRejected(self, command, params):
+        self.sent.clear()
+        self.server.handle_command(command, params, self.sent.append)
+        self.assertEqual([r.type for r in self.sent], [Response.TYPE_ERROR], params)
+        self.server.camera.close.assert_not_called()
+
+    def test_point_cloud_rejects_bad_numbers(self):
+        for params in ({"voxel_size": "x"}, {"voxel_size": -1}, {"max_depth": 0}, {"timeout": "soon"},
+                       {"after_seq": "x"}):
+            self.assertRejected(Command.GET_POINT_CLOUD, params)
+
+    def test_depth_rejects_bad_sequence_numbers(self):
+        for params in ({"after_seq": "x"}, {"after_seq": -1}, {"after_seq": 1.5}, {"after_seq": True}):
+            self.assertRejected(Command.GET_DEPTH, params)
+
+    def test_live_rejects_bad_options(self):
+        for params in ({"quality": None}, {"scale": None}, {"scale": "nan"}, {"scale": float("inf")}):
+            self.assertRejected(Command.START_LIVE, params)
+
+    def test_recording_rejects_bad_segment_limits(self):
+        self.server.camera.is_recording.return_value = False
+        for params in ({"segment_seconds": float("nan")}, {"segment_mb": "nan"}, {"segment_seconds": -5},
+                       {"segment_mb": "x"}):
+            self.assertRejected(Command.START_RECORDING, params)
+
+    def test_pretrigger_rejects_non_finite_limits(self):
+        for params in ({"seconds": float("nan")}, {"seconds": float("inf")}, {"max_mb": "inf"}, {"max_mb": 0}):
+            self.assertRejected(Command.ARM_PRETRIGGER, params)
+        self.server.camera.arm_pretrigger.assert_not_called()
+
+    def test_get_file_rejects_bad_ranges(self):
+        self.server.camera.get_recording_files.return_value = {"left.avi": __file__}
+        for params in ({"offset": "x"}, {"length": [1]}, {"offset": 10, "length": -5}):
+            self.assertRejected(Command.GET_FILE, dict(params, name="left.avi"))
+
+
 if __name__ == '__main__':
     unittest.main()
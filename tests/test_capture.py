@@ -0,0 +1,74 @@
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from camera.capture import StereoCapture, FrameGrabber
+
+
+class TestStereoCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = []
+        self.capture = StereoCapture(MagicMock(), MagicMock(), fps=30, tolerance_ms=5, on_pair=self.pairs.append)
+
+    def test_pairs_frames_within_tolerance(self):
+        self.capture._on_frame("left", "l1", 1_000_000)
+        self.capture._on_frame("right", "r1", 3_000_000)
+        self.assertEqual(len(self.pairs), 1)
+        pair = self.pairs[0]
+        self.assertEqual((pair.left, pair.right), ("l1", "r1"))
+        self.assertEqual(pair.skew, 2_000_000)
+        self.assertEqual(pair.seq, 1)
+
+    def test_drops_frame_that_cannot_be_matched(self):
+        self.capture._on_frame("left", "l1", 0)
+        self.capture._on_frame("right", "r1", 20_000_000)
+        self.capture._on_frame("left", "l2", 21_000_000)
+        self.assertEqual([(p.left, p.right) for p in self.pairs], [("l2", "r1")])
+        self.assertEqual(self.capture.get_stats()["dropped"], {"left": 1, "right": 0})
+
+    def test_counts_frames_pushed_out_of_a_full_queue(self):
+        for i in range(StereoCapture.QUEUE_SIZE + 2):
+            self.capture._on_frame("left", f"l{i}", i * 1_000_000)
+        self.assertEqual(self.capture.get_stats()["dropped"], {"left": 2, "right": 0})
+
+    def test_read_returns_newer_pair_only(self):
+        self.capture.started_at = 0
+        self.capture._on_frame("left", "l1", 0)
+        self.capture._on_frame("right", "r1", 0)
+        self.assertEqual(self.capture.read(0).seq, 1)
+        self.assertIsNone(self.capture.read(1, timeout=0.01))
+
+    def test_lores_frames_travel_with_the_pair(self):
+        self.capture._on_frame("left", "l1", 0, "ll1")
+        self.capture._on_frame("right", "r1", 0, "lr1")
+        self.capture._on_frame("left", "l2", 40_000_000)
+        self.capture._on_frame("right", "r2", 40_000_000)
+        self.assertEqual(self.pairs[0].lores, ("ll1", "lr1"))
+        self.assertIsNone(self.pairs[1].lores)
+
+
+class TestFrameGrabber(unittest.TestCase):
+
+    def test_lores_from_the_same_request(self):
+        request = MagicMock()
+        request.make_array.side_effect = lambda name: np.zeros((6, 4) if name == "lores" else (24, 16, 3), np.uint8)
+        request.get_metadata.return_value = {}
+        cam = MagicMock()
+        cam.capture_request.return_value = request
+        frame, _, lores = FrameGrabber(cam, "left", None, luma=False, lores=True).grab()
+        self.assertEqual(cam.capture_request.call_count, 1)
+        self.assertEqual(frame.shape, (24, 16, 3))
+        # YUV420 converted to BGR
+        self.assertEqual(lores.shape, (4, 4, 3))
+
+    def test_luma_lores_is_the_y_plane(self):
+        class Backend:
+            def capture_array(self, name="main"):
+                return np.zeros((6, 4) if name == "lores" else (12, 8), np.uint8)
+
+        frame, _, lores = FrameGrabber(Backend(), "left", None, luma=True, lores=True).grab()
+        self.assertEqual((frame.shape, lores.shape), ((8, 8), (4, 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import socket
+import unittest
+from utils.socket_handler import SocketHandler
+from utils.command_channel import CommandChannel
+from utils.command_handler import Command, Response, Reply
+
+
+class TestCommandChannel(unittest.TestCase):
+
+    def setUp(self):
+        a, b = socket.socketpair()
+        self.server = SocketHandler("localhost", 0, type=SocketHandler.TYPE_SERVER)
+        self.server.reciever = a
+        client = SocketHandler("localhost", 0)
+        client.reciever = b
+        self.channel = CommandChannel(client)
+
+    def tearDown(self):
+        self.server.reciever.close()
+        self.channel.socket_handler.reciever.close()
+
+    def test_replies_out_of_order(self):
+        download = self.channel.submit(Command.GET_RECORDING)
+        capture = self.channel.submit(Command.CAPTURE_IMAGE)
+        first = self.server.recv_message()
+        second = self.server.recv_message()
+        self.assertNotEqual(first.request_id, second.request_id)
+
+        self.server.send(Reply(first.request_id, Response(Response.TYPE_MESSAGE, message="Sending recording...")))
+        self.server.send(Reply(first.request_id, "chunk 1"))
+        self.server.send(Reply(second.request_id, Response(Response.TYPE_DATA, data="image")))
+        self.server.send(Reply(second.request_id, final=True))
+
+        self.assertEqual(capture.result(timeout=2).data, "image")
+        self.assertEqual(download.result(timeout=2).message, "Sending recording...")
+        self.server.send(Reply(first.request_id, "chunk 2"))
+        self.server.send(Reply(first.request_id, final=True))
+        self.assertEqual(list(download.messages(timeout=2)), ["chunk 1", "chunk 2"])
+        self.assertEqual(self.channel.pending(), 0)
+
+    def test_pending_calls_fail_on_disconnect(self):
+        call = self.channel.submit(Command.STREAM_STATUS)
+        self.server.reciever.close()
+        with self.assertRaises(ConnectionError):
+            call.result(timeout=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import cv2
+import numpy as np
+from camera.capture import StereoFrame
+from camera.depth import DisparityEngine, IncrementalDisparityEngine, create_engine
+from camera.rectification import Rectifier, StereoCalibration
+from utils.command_handler import DepthOptions
+
+DISPARITY = 16
+
+
+def make_pair(width=320, height=240, disparity=DISPARITY):
+    rng = np.random.default_rng(1)
+    texture = rng.integers(0, 255, (height // 4, (width + disparity) // 4), dtype=np.uint8)
+    texture = cv2.resize(texture, (width + disparity, height), interpolation=cv2.INTER_NEAREST)
+    # A point at column c of the left image is at c - disparity in the right one
+    left = np.ascontiguousarray(texture[:, :width])
+    right = np.ascontiguousarray(texture[:, disparity:disparity + width])
+    return StereoFrame(left, right, 5, 1000, 1000)
+
+
+class TestDepthOptions(unittest.TestCase):
+
+    def test_defaults_are_valid(self):
+        DepthOptions().validate()
+
+    def test_rejects_bad_options(self):
+        for options in (
+            DepthOptions(algorithm="foo"),
+            DepthOptions(num_disparities=40),
+            DepthOptions(block_size=4),
+            DepthOptions(algorithm="bm", block_size=3),
+            DepthOptions(scale=0.5),
+            DepthOptions(roi=[0, 0, 0, 10]),
+            DepthOptions(min_disparity=-1),
+            DepthOptions(min_disparity=2.5),
+        ):
+            with self.assertRaises(ValueError):
+                options.validate()
+
+    def test_round_trip(self):
+        options = DepthOptions("bm", 1, 0, 32, 9, [1, 2, 3, 4])
+        self.assertEqual(DepthOptions.from_dict(options.to_dict()).to_dict(), options.to_dict())
+
+
+class TestDisparityEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.maps = Rectifier(StereoCalibration.from_parameters(), cache_dir=None).maps((320, 240))
+
+    def check_depth(self, result, disparity):
+        valid = result.valid
+        self.assertGreater(valid.mean(), 0.5)
+        self.assertAlmostEqual(float(np.median(result.disparity[valid])), disparity, delta=0.25)
+        expected = result.focal * result.baseline / disparity
+        self.assertAlmostEqual(float(np.median(result.depth[valid])), expected, delta=expected * 0.02)
+
+    def test_depth_from_disparity(self):
+        for algorithm in DepthOptions.ALGORITHMS:
+            engine = DisparityEngine(DepthOptions(algorithm, scale=1, num_disparities=32))
+            result = engine.compute(make_pair(), self.maps)
+            self.assertEqual(result.depth.shape, (240, 320))
+            self.check_depth(result, DISPARITY)
+            self.assertGreater(result.compute_ms, 0)
+
+    def test_downscale(self):
+        engine = DisparityEngine(DepthOptions("bm", scale=2, num_disparities=16))
+        result = engine.compute(make_pair(), self.maps)
+        self.assertEqual(result.depth.shape, (120, 160))
+        self.check_depth(result, DISPARITY / 2)
+
+    def test_roi(self):
+        engine = DisparityEngine(DepthOptions("bm", scale=1, num_disparities=32, roi=[100, 60, 120, 80]))
+        result = engine.compute(make_pair(), self.maps)
+        self.assertEqual(result.depth.shape, (80, 120))
+        self.assertEqual(result.roi, (100, 60, 120, 80))
+        self.assertAlmostEqual(result.cx, self.maps.P1[0, 2] - 100)
+        self.check_depth(result, DISPARITY)
+
+    def test_unmatched_pixels_are_invalid(self):
+        # Unmatched pixels come out as min_disparity - 1, which is above 0 here
+        engine = DisparityEngine(DepthOptions("bm", scale=1, min_disparity=8, num_disparities=32))
+        result = engine.compute(make_pair(), self.maps)
+        self.assertTrue((result.disparity < 8).any())
+        self.assertTrue((result.disparity[result.valid] >= 8).all())
+        self.check_depth(result, DISPARITY)
+
+    def test_wire_format(self):
+        engine = DisparityEngine(DepthOptions("bm", scale=1, num_disparities=32))
+        data = engine.compute(make_pair(), self.maps).to_dict()
+        self.assertEqual(data["depth"].dtype, np.uint16)
+        self.assertEqual(data["seq"], 5)
+        self.assertNotIn("disparity", data)
+
+
+class TestIncrementalDisparityEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.maps = Rectifier(StereoCalibration.from_parameters(), cache_dir=None).maps((320, 240))
+        self.options = DepthOptions("bm", scale=1, num_disparities=32, incremental=True)
+
+    def moved(self, frame, x):
+        """Pastes a textured patch at disparity 24 into a copy of the pair."""
+        patch = np.random.default_rng(2).integers(0, 255, (10, 10), dtype=np.uint8)
+        patch = cv2.resize(patch, (40, 40), interpolation=cv2.INTER_NEAREST)
+        left, right = frame.left.copy(), frame.right.copy()
+        left[100:140, x + 24:x + 64] = patch
+        right[100:140, x:x + 40] = patch
+        return StereoFrame(left, right, frame.seq + 1, 0, 0)
+
+    def test_factory(self):
+        self.assertIsInstance(create_engine(self.options), IncrementalDisparityEngine)
+        self.assertNotIsInstance(create_engine(DepthOptions()), IncrementalDisparityEngine)
+
+    def test_static_scene_is_reused(self):
+        engine = IncrementalDisparityEngine(self.options)
+        first = engine.compute(make_pair(), self.maps)
+        second = engine.compute(make_pair(), self.maps)
+        self.assertEqual(first.recomputed, 1.0)
+        self.assertEqual(second.recomputed, 0.0)
+        np.testing.assert_array_equal(first.disparity, second.disparity)
+
+    def test_changed_tiles_match_full_recompute(self):
+        engine = IncrementalDisparityEngine(self.options)
+        engine.compute(make_pair(), self.maps)
+        frame = self.moved(make_pair(), 150)
+        result = engine.compute(frame, self.maps)
+        expected = DisparityEngine(self.options).compute(frame, self.maps)
+
+        self.assertGreater(result.recomputed, 0)
+        self.assertLess(result.recomputed, 0.5)
+        np.testing.assert_array_equal(result.disparity[100:140, 180:210], expected.disparity[100:140, 180:210])
+        self.assertAlmostEqual(float(np.median(result.disparity[105:135, 180:210])), 24, delta=0.25)
+
+    def test_refresh_interval(self):
+        engine = IncrementalDisparityEngine(self.options, refresh_frames=3)
+        results = [engine.compute(make_pair(), self.maps).recomputed for _ in range(6)]
+        self.assertEqual(results, [1.0, 0.0, 0.0, 1.0, 0.0, 0.0])
+        self.assertEqual(engine.full_recomputes, 2)
+
+    def test_large_motion_recomputes_everything(self):
+        engine = IncrementalDisparityEngine(self.options)
+        engine.compute(make_pair(), self.maps)
+        frame = make_pair(disparity=8)
+        result = engine.compute(StereoFrame(255 - frame.left, 255 - frame.right, 6, 0, 0), self.maps)
+        self.assertEqual(result.recomputed, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
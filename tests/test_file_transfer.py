@@ -0,0 +1,61 @@
+import io
+import os
+import pickle
+import socket
+import tempfile
+import unittest
+from utils.socket_handler import SocketHandler
+from utils.command_channel import CommandChannel
+from utils.command_handler import Command, Response, Reply
+from utils.file_transfer import FileChunk, file_chunks, file_info, sha256_file
+
+
+class TestFileTransfer(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        self.content = os.urandom(10000)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_chunk_header_hides_source(self):
+        chunk = pickle.loads(pickle.dumps(FileChunk("left.avi", 0, 10, source=self.path)))
+        self.assertIsNone(chunk.source)
+        self.assertEqual((chunk.name, chunk.offset, chunk.length), ("left.avi", 0, 10))
+
+    def test_file_info_and_range_hash(self):
+        info = file_info(self.path, "left.avi")
+        self.assertEqual(info.size, len(self.content))
+        self.assertEqual(info.sha256, sha256_file(self.path))
+        self.assertNotEqual(sha256_file(self.path, 100, 50), info.sha256)
+
+    def test_range_round_trip(self):
+        a, b = socket.socketpair()
+        server = SocketHandler("localhost", 0, type=SocketHandler.TYPE_SERVER)
+        server.reciever = a
+        client = SocketHandler("localhost", 0)
+        client.reciever = b
+        channel = CommandChannel(client)
+        try:
+            sink = io.BytesIO(self.content[:4000])
+            call = channel.submit(Command.GET_FILE, {"name": "left.avi", "offset": 4000}, sink=sink)
+            request = server.recv_message()
+            server.send(Reply(request.request_id, Response(Response.TYPE_DATA)))
+            for chunk in file_chunks("left.avi", self.path, 4000, len(self.content), 4096):
+                server.send(Reply(request.request_id, chunk))
+            server.send(Reply(request.request_id, final=True))
+
+            call.result(timeout=2)
+            offsets = [chunk.offset for chunk in call.messages(timeout=2)]
+            self.assertEqual(offsets, [4000, 8096])
+            self.assertEqual(sink.getvalue(), self.content)
+        finally:
+            a.close()
+            b.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
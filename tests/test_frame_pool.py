@@ -0,0 +1,129 @@
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from camera.capture import FrameGrabber, StereoCapture
+from camera.frame_pool import FramePool
+
+
+class TestFramePool(unittest.TestCase):
+
+    def test_recycles_released_buffers(self):
+        pool = FramePool(2)
+        first = pool.acquire((4, 4), np.uint8)
+        pool.release(first)
+        self.assertIs(pool.acquire((4, 4), np.uint8), first)
+        stats = pool.get_stats()
+        self.assertEqual((stats["allocated"], stats["reused"], stats["in_use"]), (1, 1, 1))
+
+    def test_freed_after_last_consumer(self):
+        pool = FramePool(1)
+        buffer = pool.acquire((4, 4), np.uint8)
+        pool.retain(buffer)
+        pool.release(buffer)
+        self.assertIsNone(pool.acquire((4, 4), np.uint8))
+        pool.release(buffer)
+        self.assertIs(pool.acquire((4, 4), np.uint8), buffer)
+
+    def test_exhaustion(self):
+        pool = FramePool(2)
+        pool.acquire((4, 4), np.uint8)
+        pool.acquire((4, 4), np.uint8)
+        self.assertIsNone(pool.acquire((4, 4), np.uint8))
+        self.assertEqual(pool.get_stats()["exhausted"], 1)
+
+    def test_format_change_drops_old_buffers(self):
+        pool = FramePool(2)
+        old = pool.acquire((4, 4), np.uint8)
+        new = pool.acquire((2, 2), np.uint8)
+        pool.release(old)
+        self.assertEqual(new.shape, (2, 2))
+        self.assertEqual(pool.get_stats()["free"], 0)
+        self.assertEqual(pool.acquire((2, 2), np.uint8).shape, (2, 2))
+
+    def test_ignores_foreign_arrays(self):
+        pool = FramePool(1)
+        pool.retain(np.zeros(3))
+        pool.release(np.zeros(3))
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+    def test_views_stand_for_their_buffer(self):
+        pool = FramePool(1)
+        buffer = pool.acquire((6, 4), np.uint8)
+        pool.retain(buffer[:4])
+        pool.release(buffer)
+        self.assertIsNone(pool.acquire((6, 4), np.uint8))
+        pool.release(buffer[:4][1:])
+        self.assertIs(pool.acquire((6, 4), np.uint8), buffer)
+
+
+class TestPooledCapture(unittest.TestCase):
+
+    def frame(self, pool, value):
+        buffer = pool.acquire((2, 2), np.uint8)
+        buffer[:] = value
+        return buffer
+
+    def test_buffers_return_once_consumers_are_done(self):
+        pool = FramePool(8)
+        seen = []
+        capture = StereoCapture(
+            MagicMock(), MagicMock(), fps=30, tolerance_ms=5, pool=pool,
+            on_pair=lambda pair: seen.append(pool.get_stats()["in_use"])
+        )
+        capture._on_frame("left", self.frame(pool, 1), 0)
+        capture._on_frame("right", self.frame(pool, 1), 0)
+        # Held while on_pair runs, and afterwards only as the latest pair
+        self.assertEqual(seen, [2])
+        self.assertEqual(pool.get_stats()["in_use"], 2)
+
+        capture._on_frame("left", self.frame(pool, 2), 40_000_000)
+        capture._on_frame("right", self.frame(pool, 2), 40_000_000)
+        self.assertEqual(pool.get_stats()["in_use"], 2)
+        self.assertEqual(int(capture.latest.left[0, 0]), 2)
+
+    def test_dropped_frames_are_returned(self):
+        pool = FramePool(8)
+        capture = StereoCapture(MagicMock(), MagicMock(), fps=30, tolerance_ms=5, pool=pool)
+        capture._on_frame("left", self.frame(pool, 1), 0)
+        capture._on_frame("right", self.frame(pool, 1), 20_000_000)
+        self.assertEqual(pool.get_stats()["in_use"], 1)
+        for n in range(StereoCapture.QUEUE_SIZE + 2):
+            capture._on_frame("right", self.frame(pool, 1), 30_000_000 + n)
+        self.assertEqual(pool.get_stats()["in_use"], StereoCapture.QUEUE_SIZE)
+
+    def test_grabber_reads_into_pool(self):
+        class Backend:
+            def capture_array(self, out=None):
+                frame = np.ones((2, 2), np.uint8) if out is None else out
+                frame[:] = 7
+                return frame
+
+        pool = FramePool(4)
+        grabber = FrameGrabber(Backend(), "left", None, pool)
+        first, _, _ = grabber.grab()
+        second, _, _ = grabber.grab()
+        self.assertIn(id(second), pool.buffers)
+        self.assertNotIn(id(first), pool.buffers)
+        self.assertEqual(pool.get_stats()["unpooled"], 1)
+
+    def test_luma_grabber_passes_y_plane(self):
+        class Backend:
+            def capture_array(self, out=None):
+                # Planar YUV420 of a 4x4 image: 4 rows of Y, then U and V
+                frame = np.empty((6, 4), np.uint8) if out is None else out
+                frame[:4], frame[4:] = 200, 128
+                return frame
+
+        pool = FramePool(4)
+        grabber = FrameGrabber(Backend(), "left", None, pool, luma=True)
+        grabber.grab()
+        frame, _, _ = grabber.grab()
+        self.assertEqual(frame.shape, (4, 4))
+        self.assertTrue((frame == 200).all())
+        self.assertEqual(pool.get_stats()["in_use"], 1)
+        pool.release(frame)
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
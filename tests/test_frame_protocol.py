@@ -0,0 +1,59 @@
+import socket
+import threading
+import unittest
+import numpy as np
+from utils import frame_protocol
+
+
+class TestFrameProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def test_frame_round_trip(self):
+        left = np.random.randint(0, 255, (48, 64, 3), dtype=np.uint8)
+        right = np.random.randint(0, 255, (48, 64, 3), dtype=np.uint8)
+        sender = threading.Thread(target=frame_protocol.send_frame, args=(self.server, left, right, 7, 123))
+        sender.start()
+        header, l, r = frame_protocol.FrameReceiver().recv(self.client)
+        sender.join()
+        self.assertEqual((header.seq, header.timestamp, header.shape), (7, 123, (48, 64, 3)))
+        np.testing.assert_array_equal(l, left)
+        np.testing.assert_array_equal(r, right)
+
+    def test_receiver_reuses_buffers(self):
+        receiver = frame_protocol.FrameReceiver()
+        frame = np.zeros((4, 4), dtype=np.uint16)
+        frame_protocol.send_frame(self.server, frame, frame, 1, 0)
+        frame_protocol.send_frame(self.server, frame + 1, frame, 2, 0)
+        _, first, _ = receiver.recv(self.client)
+        _, second, _ = receiver.recv(self.client)
+        self.assertIs(first, second)
+        self.assertEqual(int(second[0, 0]), 1)
+
+    def test_end_marker(self):
+        frame_protocol.send_end(self.server)
+        header, left, right = frame_protocol.FrameReceiver().recv(self.client)
+        self.assertTrue(header.end)
+        self.assertIsNone(left)
+
+    def test_rejects_oversized_payload(self):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame_protocol.send_frame(self.server, frame, frame, 1, 0)
+        with self.assertRaises(ValueError):
+            frame_protocol.FrameReceiver(max_payload_size=1024).recv(self.client)
+
+    def test_rejects_oversized_encoded_payload(self):
+        payload = bytes(2048)
+        frame_protocol.send_payloads(self.server, frame_protocol.CODEC_JPEG, 1, 0, (48, 64, 3), np.uint8,
+                                     payload, payload)
+        with self.assertRaises(ValueError):
+            frame_protocol.FrameReceiver(max_payload_size=1024).recv(self.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
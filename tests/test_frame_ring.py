@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from camera.frame_ring import StereoFrameRing
+
+
+class TestStereoFrameRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = StereoFrameRing(4)
+
+    def write(self, value):
+        frame = np.full((2, 3), value, dtype=np.uint8)
+        return self.ring.write(frame, frame + 1, value, value)
+
+    def test_readers_track_their_own_position(self):
+        live = self.ring.reader("live")
+        record = self.ring.reader("record")
+        self.write(1)
+        self.write(2)
+        self.assertEqual(live.read(latest=True).seq, 2)
+        self.assertEqual(record.read().seq, 1)
+        self.assertEqual(record.read().seq, 2)
+        self.assertIsNone(live.read(timeout=0.01))
+
+    def test_slots_are_reused(self):
+        self.write(1)
+        left = self.ring.left
+        for value in range(2, 10):
+            self.write(value)
+        self.assertIs(self.ring.left, left)
+
+    def test_slow_reader_skips_overwritten_frames(self):
+        reader = self.ring.reader()
+        for value in range(1, 9):
+            self.write(value)
+        frame = reader.read()
+        self.assertEqual(frame.seq, 6)
+        self.assertEqual(reader.dropped, 5)
+        self.assertEqual(int(frame.left[0, 0]), 6)
+
+    def test_read_into_preallocated_arrays(self):
+        reader = self.ring.reader()
+        self.write(7)
+        out = (np.empty((2, 3), np.uint8), np.empty((2, 3), np.uint8))
+        frame = reader.read(out=out)
+        self.assertIs(frame.left, out[0])
+        self.assertEqual(int(out[1][0, 0]), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import threading
+import unittest
+from utils.mailbox import LatestFrameMailbox
+
+
+class TestLatestFrameMailbox(unittest.TestCase):
+
+    def test_newer_item_replaces_pending_one(self):
+        mailbox = LatestFrameMailbox()
+        self.assertFalse(mailbox.put(1))
+        self.assertTrue(mailbox.put(2))
+        self.assertEqual(mailbox.get(), 2)
+        self.assertEqual(mailbox.get_stats(), {"put": 2, "delivered": 1, "dropped": 1})
+
+    def test_refresh_swaps_held_item_for_newer_one(self):
+        mailbox = LatestFrameMailbox()
+        self.assertEqual(mailbox.refresh(1), 1)
+        mailbox.put(2)
+        self.assertEqual(mailbox.refresh(1), 2)
+        self.assertEqual(mailbox.get_stats(), {"put": 1, "delivered": 1, "dropped": 1})
+
+    def test_get_times_out_when_empty(self):
+        self.assertIsNone(LatestFrameMailbox().get(timeout=0.01))
+
+    def test_close_wakes_up_consumer_after_last_item(self):
+        mailbox = LatestFrameMailbox()
+        mailbox.put(1)
+        mailbox.close()
+        self.assertEqual(mailbox.get(), 1)
+        self.assertIsNone(mailbox.get())
+
+    def test_close_from_another_thread(self):
+        mailbox = LatestFrameMailbox()
+        threading.Timer(0.05, mailbox.close).start()
+        self.assertIsNone(mailbox.get(timeout=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
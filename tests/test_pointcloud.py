@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+from camera.depth import DepthFrame
+from camera.pointcloud import base_transform, depth_to_points, pixel_grid, point_cloud, valid_depth, voxel_downsample
+
+
+class TestDepthToPoints(unittest.TestCase):
+
+    def test_back_projection(self):
+        depth = np.full((4, 6), 1000, dtype=np.float32)
+        points = depth_to_points(depth, focal=500, cx=2, cy=1)
+        self.assertEqual(points.shape, (24, 3))
+        # The last point is pixel (u=5, v=3)
+        np.testing.assert_allclose(points[-1], [(5 - 2) * 2, (3 - 1) * 2, 1000])
+
+    def test_invalid_depth_masked(self):
+        depth = np.array([[0, 1000], [np.nan, 2000]], dtype=np.float32)
+        self.assertEqual(valid_depth(depth).sum(), 2)
+        self.assertEqual(len(depth_to_points(depth, 500, 0, 0)), 2)
+        self.assertEqual(valid_depth(depth, max_depth=1500).sum(), 1)
+
+    def test_robot_base_frame(self):
+        # Straight below the camera at its 1 m height (parameters.T_0_cam) is the base origin
+        depth = np.full((3, 3), 1000, dtype=np.float32)
+        points = depth_to_points(depth, 500, 1, 1, transform=base_transform())
+        np.testing.assert_allclose(points[4], [0, 0, 0], atol=1e-3)
+        np.testing.assert_allclose(points[0], [-2, 2, 0], atol=1e-3)
+
+    def test_colors(self):
+        depth = np.full((2, 2), 1000, dtype=np.float32)
+        colors = np.arange(12, dtype=np.uint8).reshape(2, 2, 3)
+        points = depth_to_points(depth, 500, 0, 0, colors=colors)
+        self.assertEqual(points.shape, (4, 6))
+        np.testing.assert_array_equal(points[:, 3:], colors.reshape(-1, 3))
+
+    def test_pixel_grid_cached(self):
+        self.assertIs(pixel_grid(48, 64)[0], pixel_grid(48, 64)[0])
+
+
+class TestVoxelDownsample(unittest.TestCase):
+
+    def test_centroid_per_voxel(self):
+        points = np.array([[1, 1, 1], [3, 3, 3], [11, 1, 1], [13, 1, 1]], dtype=np.float32)
+        out = voxel_downsample(points, 10)
+        self.assertEqual(len(out), 2)
+        np.testing.assert_allclose(sorted(out.tolist()), [[2, 2, 2], [12, 1, 1]])
+
+    def test_sparse_grid(self):
+        points = np.array([[0, 0, 0], [1e6, 1e6, 1e6], [1, 1, 1]], dtype=np.float32)
+        self.assertEqual(len(voxel_downsample(points, 10)), 2)
+
+
+class TestPointCloud(unittest.TestCase):
+
+    def test_depth_frame(self):
+        depth = np.full((60, 80), 1500, dtype=np.float32)
+        depth[0] = 0
+        left = np.zeros((120, 160, 3), dtype=np.uint8)
+        frame = DepthFrame(1, 0, depth, depth, (0, 0, 160, 120), 2.0, 250, 40, 30, 60, 1.0, left)
+        points = point_cloud(frame, colors=True, frame="camera")
+        self.assertEqual(points.shape, (59 * 80, 6))
+        self.assertTrue(np.all(points[:, 2] == 1500))
+        self.assertLess(len(point_cloud(frame, voxel_size=100)), len(points))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from camera.capture import StereoFrame
+from camera.pretrigger import PreTriggerBuffer
+from camera.recording import RecordingSession
+
+
+def make_frame(seq, fps=10, noise=False):
+    shape = (48, 64, 3)
+    if noise:
+        image = np.random.default_rng(seq).integers(0, 255, shape, dtype=np.uint8)
+    else:
+        image = np.full(shape, seq % 255, dtype=np.uint8)
+    timestamp = int(seq * 1e9 / fps)
+    return StereoFrame(image, image, seq, timestamp, timestamp)
+
+
+class TestPreTriggerBuffer(unittest.TestCase):
+
+    def test_keeps_last_seconds(self):
+        buffer = PreTriggerBuffer(seconds=1, max_mb=64)
+        for seq in range(1, 31):
+            buffer.add(make_frame(seq))
+
+        kept = buffer.frames_after()
+        self.assertEqual([f.seq for f in kept], list(range(20, 31)))
+        stats = buffer.get_stats()
+        self.assertEqual(stats["frames"], 11)
+        self.assertEqual(stats["evicted"], 19)
+        self.assertAlmostEqual(stats["seconds"], 1.0)
+        self.assertEqual(stats["bytes"], sum(f.nbytes for f in kept))
+
+    def test_memory_cap(self):
+        buffer = PreTriggerBuffer(seconds=60, max_mb=0.02)
+        for seq in range(1, 31):
+            buffer.add(make_frame(seq, noise=True))
+
+        stats = buffer.get_stats()
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        self.assertGreater(stats["evicted"], 0)
+        self.assertEqual(buffer.frames_after()[-1].seq, 30)
+
+    def test_frames_after(self):
+        buffer = PreTriggerBuffer(seconds=10)
+        for seq in range(1, 6):
+            buffer.add(make_frame(seq))
+        self.assertEqual([f.seq for f in buffer.frames_after(3)], [4, 5])
+        self.assertEqual(buffer.frames_after(5), [])
+
+    def test_decode_keeps_timestamps(self):
+        buffer = PreTriggerBuffer(seconds=10, quality=100)
+        frame = make_frame(7)
+        buffer.add(frame)
+
+        decoded = buffer.frames_after()[0].decode()
+        self.assertEqual((decoded.seq, decoded.ts_left, decoded.ts_right), (7, frame.ts_left, frame.ts_right))
+        self.assertEqual(decoded.left.shape, frame.left.shape)
+        self.assertLessEqual(np.abs(decoded.left.astype(int) - frame.left).max(), 2)
+
+
+class TestHistoryWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_waits_for_encoders(self):
+        session = RecordingSession(self.directory, 10, (64, 48), queue_size=2, format=RecordingSession.FORMAT_RAW)
+        for seq in range(20):
+            self.assertTrue(session.write(make_frame(seq), wait=True))
+        session.close()
+
+        self.assertEqual(session.dropped, 0)
+        self.assertEqual(session.get_stats()["encoded"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
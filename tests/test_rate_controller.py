@@ -0,0 +1,44 @@
+import unittest
+from utils.command_handler import StreamOptions
+from utils.rate_controller import StreamRateController
+
+
+class TestStreamRateController(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = StreamRateController(StreamOptions("jpeg", 80, 1), 30, 150)
+
+    def tick(self):
+        # Skip the update interval and the hold time after the last change
+        self.controller.next_update = 0
+        self.controller.changed_at = -10
+
+    def test_steps_down_when_backlog_grows(self):
+        self.tick()
+        self.controller.on_sent(1, 10000, backlog=100000)
+        self.assertEqual(self.controller.level, 1)
+        self.assertEqual(self.controller.options.quality, 60)
+
+    def test_steps_down_when_latency_above_target(self):
+        self.controller.latency = 400e6
+        self.tick()
+        self.controller.on_sent(1, 10000, backlog=0)
+        self.assertEqual(self.controller.level, 1)
+
+    def test_steps_up_after_fast_intervals(self):
+        self.controller.level = 4
+        for seq in range(StreamRateController.STEP_UP_INTERVALS):
+            self.controller.latency = 20e6
+            self.tick()
+            self.controller.on_sent(seq, 10000, backlog=0)
+        self.assertEqual(self.controller.level, 3)
+        self.assertEqual(self.controller.get_status()["operating_point"]["fps"], 30)
+
+    def test_ack_measures_rtt(self):
+        self.controller.on_sent(5, 10000)
+        self.controller.on_ack(5, 0)
+        self.assertIsNotNone(self.controller.get_status()["rtt_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import time
+import numpy as np
+from unittest.mock import patch
+from camera.capture import StereoFrame
+from camera.recording import RecordingSession
+from camera.raw_recording import RawStereoReader
+
+
+def make_frame(seq, fps=10):
+    image = np.full((48, 64, 3), seq % 255, dtype=np.uint8)
+    timestamp = int(seq * 1e9 / fps)
+    return StereoFrame(image, image, seq, timestamp, timestamp)
+
+
+class TestRecordingSession(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rotates_by_time(self):
+        closed = []
+        session = RecordingSession(
+            self.directory, 10, (64, 48), segment_seconds=1, on_segment=closed.append, queue_size=32
+        )
+        for seq in range(25):
+            session.write(make_frame(seq))
+        session.close()
+
+        self.assertEqual([s.frames for s in closed], [11, 11, 3])
+        self.assertTrue(all(os.path.exists(s.left) and os.path.exists(s.right) for s in closed))
+        with open(session.manifest_path) as f:
+            manifest = json.load(f)
+        self.assertTrue(manifest["finished"])
+        self.assertEqual([s["first_seq"] for s in manifest["segments"]], [0, 11, 22])
+
+    def test_single_file_without_limits(self):
+        session = RecordingSession(self.directory, 10, (64, 48))
+        for seq in range(5):
+            session.write(make_frame(seq))
+        self.assertEqual(session.get_segments(), [])
+        session.close()
+        segments = session.get_segments()
+        self.assertEqual(len(segments), 1)
+        self.assertFalse(segments[0].left.endswith("_0000.avi"))
+
+    @patch('camera.recording.cv2.VideoWriter')
+    def test_drops_frames_when_encoders_fall_behind(self, MockVideoWriter):
+        MockVideoWriter.return_value.write.side_effect = lambda image: time.sleep(0.02)
+        session = RecordingSession(self.directory, 10, (64, 48), queue_size=2)
+        accepted = sum(session.write(make_frame(seq)) for seq in range(20))
+        session.close()
+
+        stats = session.get_stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["dropped"] + stats["frames"], 20)
+        self.assertEqual(stats["encoded"], accepted)
+        self.assertEqual(stats["high_water"], 2)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_raw_format_memmap_reader(self):
+        session = RecordingSession(self.directory, 10, (64, 48), segment_seconds=1, format='raw', queue_size=32)
+        for seq in range(15):
+            session.write(make_frame(seq))
+        session.close()
+        first, second = session.get_segments()
+        self.assertEqual(len(first.files), 4)
+
+        reader = RawStereoReader(second.left)
+        self.assertEqual(len(reader), 4)
+        self.assertIsInstance(reader.left, np.memmap)
+        frame = reader[reader.find(13)]
+        self.assertEqual(frame.ts_left, make_frame(13).ts_left)
+        np.testing.assert_array_equal(frame.right, make_frame(13).right)
+        self.assertEqual(int(reader.index["offset"][2]), 2 * 64 * 48 * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
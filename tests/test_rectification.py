@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import numpy as np
+from camera.capture import StereoFrame
+from camera.rectification import StereoCalibration, RectificationMaps, Rectifier
+
+
+def make_frame(width=64, height=48):
+    rng = np.random.default_rng(0)
+    left = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    right = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return StereoFrame(left, right, 3, 100, 101)
+
+
+class TestStereoCalibration(unittest.TestCase):
+
+    def test_scaled_camera_matrix(self):
+        calibration = StereoCalibration.from_parameters()
+        width, height = calibration.size
+        K_left, _ = calibration.scaled((width // 2, height // 4))
+        self.assertAlmostEqual(K_left[0, 0], calibration.K_left[0, 0] / 2)
+        self.assertAlmostEqual(K_left[1, 2], calibration.K_left[1, 2] / 4)
+        self.assertEqual(K_left[2, 2], 1)
+
+    def test_digest_follows_calibration(self):
+        a = StereoCalibration.from_parameters()
+        b = StereoCalibration.from_parameters()
+        self.assertEqual(a.digest(), b.digest())
+        b.T[0] -= 1
+        self.assertNotEqual(a.digest(), b.digest())
+
+
+class TestRectifier(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_maps_are_fixed_point(self):
+        maps = Rectifier(StereoCalibration.from_parameters(), cache_dir=None).maps((64, 48))
+        self.assertEqual(maps.left[0].dtype, np.int16)
+        self.assertEqual(maps.left[0].shape, (48, 64, 2))
+        self.assertEqual(maps.left[1].dtype, np.uint16)
+        self.assertAlmostEqual(maps.baseline, 60, places=3)
+
+    def test_maps_cached_on_disk(self):
+        calibration = StereoCalibration.from_parameters()
+        maps = Rectifier(calibration, cache_dir=self.directory).maps((64, 48))
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+
+        with unittest.mock.patch.object(RectificationMaps, "compute") as compute:
+            loaded = Rectifier(calibration, cache_dir=self.directory).maps((64, 48))
+        compute.assert_not_called()
+        np.testing.assert_array_equal(loaded.left[0], maps.left[0])
+        np.testing.assert_array_equal(loaded.Q, maps.Q)
+
+    def test_rectify_into_buffers(self):
+        rectifier = Rectifier(StereoCalibration.from_parameters(), cache_dir=None)
+        frame = make_frame()
+        out = (np.empty_like(frame.left), np.empty_like(frame.right))
+
+        rectified = rectifier.rectify(frame, out)
+        self.assertIs(rectified.left, out[0])
+        self.assertEqual((rectified.seq, rectified.ts_left, rectified.ts_right), (3, 100, 101))
+        with self.assertRaises(ValueError):
+            rectifier.rectify(make_frame(32, 24), out)
+
+
+if __name__ == "__main__":
+    unittest.main()
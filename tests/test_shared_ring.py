@@ -0,0 +1,92 @@
+import threading
+import unittest
+import numpy as np
+from camera.shared_ring import SharedFrameRing
+from camera.capture_process import CaptureProcess
+
+
+class TestSharedFrameRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = SharedFrameRing(4, 2 * 3 * 3)
+        # A second mapping of the same segment, as another process would see it
+        self.attached = SharedFrameRing.attach(self.ring.name)
+
+    def tearDown(self):
+        self.attached.release()
+        self.ring.release()
+
+    def write(self, value, shape=(2, 3, 3)):
+        frame = np.full(shape, value, dtype=np.uint8)
+        return self.ring.write(frame, frame + 1, value, value + 1)
+
+    def test_attached_reader_sees_frames(self):
+        reader = self.attached.reader("worker")
+        self.write(1)
+        self.write(2)
+
+        frame = reader.read(timeout=1)
+        self.assertEqual((frame.seq, frame.ts_left, frame.ts_right), (1, 1, 2))
+        self.assertEqual(frame.left.shape, (2, 3, 3))
+        self.assertTrue((frame.left == 1).all() and (frame.right == 2).all())
+        self.assertEqual(reader.read(timeout=1).seq, 2)
+
+    def test_frames_are_not_copied(self):
+        self.write(1)
+        frame = self.attached.get(1)
+        self.ring.left[1][:] = 42
+        self.assertTrue((frame.left == 42).all())
+
+    def test_reader_is_woken_up(self):
+        reader = self.attached.reader("worker")
+        frames = []
+        thread = threading.Thread(target=lambda: frames.append(reader.read(timeout=2)))
+        thread.start()
+        self.write(7)
+        thread.join()
+        self.assertEqual(frames[0].seq, 1)
+
+    def test_overwritten_slot_is_invalid(self):
+        self.write(1)
+        frame = self.attached.get(1)
+        for value in range(2, 6):
+            self.write(value)
+        self.assertFalse(self.attached.is_valid(frame))
+        self.assertIsNone(self.attached.get(1))
+
+    def test_format_change(self):
+        self.write(1)
+        self.write(2, shape=(3, 6))
+        frame = self.attached.get(2)
+        self.assertEqual(frame.left.shape, (3, 6))
+        self.assertIsNone(self.attached.get(1))
+
+    def test_frame_too_large(self):
+        with self.assertRaises(ValueError):
+            self.write(1, shape=(4, 4, 3))
+
+    def test_close_wakes_readers(self):
+        reader = self.attached.reader("worker")
+        self.ring.close()
+        self.assertTrue(self.attached.closed)
+        self.assertIsNone(reader.read(timeout=1))
+
+
+class TestCaptureProcessFits(unittest.TestCase):
+
+    def test_checks_both_rings(self):
+        process = CaptureProcess.__new__(CaptureProcess)
+        process.ring = SharedFrameRing(2, 64 * 48 * 3)
+        process.lores_ring = SharedFrameRing(2, 32 * 24 * 3)
+        try:
+            main = {"size": (64, 48), "format": "RGB888"}
+            self.assertTrue(process.fits(main, {"size": (32, 24), "format": "YUV420"}))
+            self.assertFalse(process.fits(main, {"size": (64, 48), "format": "YUV420"}))
+            self.assertFalse(process.fits({"size": (64, 48), "format": "XRGB8888"}))
+        finally:
+            process.ring.release()
+            process.lores_ring.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
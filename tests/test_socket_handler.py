@@ -0,0 +1,48 @@
+import socket
+import threading
+import unittest
+import numpy as np
+from utils.socket_handler import SocketHandler
+
+
+class TestSocketHandler(unittest.TestCase):
+
+    def setUp(self):
+        a, b = socket.socketpair()
+        self.sender = SocketHandler("localhost", 0)
+        self.sender.reciever = a
+        self.receiver = SocketHandler("localhost", 0, max_message_size=4 * 1024 * 1024)
+        self.receiver.reciever = b
+
+    def tearDown(self):
+        self.sender.reciever.close()
+        self.receiver.reciever.close()
+
+    def test_large_message_round_trip(self):
+        image = np.random.randint(0, 255, (720, 720, 3), dtype=np.uint8)
+        th = threading.Thread(target=self.sender.send, args=({"img_left": image},))
+        th.start()
+        res = self.receiver.recv_message()
+        th.join()
+        np.testing.assert_array_equal(res["img_left"], image)
+        stats = self.receiver.get_link_stats()
+        self.assertEqual(stats["messages_received"], 1)
+        self.assertEqual(stats["bytes_received"], self.sender.get_link_stats()["bytes_sent"])
+
+    def test_receive_buffer_is_reused(self):
+        self.sender.send(b"x" * 100000)
+        self.receiver.recv_message()
+        buffer = self.receiver.recv_buffer
+        self.sender.send(b"y" * 1000)
+        self.assertEqual(self.receiver.recv_message(), b"y" * 1000)
+        self.assertIs(self.receiver.recv_buffer, buffer)
+
+    def test_message_size_limit(self):
+        self.receiver.max_message_size = 10
+        self.sender.send(b"x" * 100)
+        with self.assertRaises(ValueError):
+            self.receiver.recv_message()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import cv2
+import numpy as np
+from camera.capture import StereoFrame
+from camera.rectification import RectificationMaps
+from camera.sparse_stereo import SparseStereo
+from utils import frame_protocol
+from utils.command_handler import StreamOptions
+from utils.stream_codec import EncodedFrame, encode_frame, encode_keypoints, decode_frame
+
+
+def make_maps(focal=400.0, baseline=60.0):
+    P1 = np.array([[focal, 0, 32, 0], [0, focal, 24, 0], [0, 0, 1, 0]])
+    P2 = P1.copy()
+    P2[0, 3] = -focal * baseline
+    return RectificationMaps((64, 48), None, None, P1, P2, None)
+
+
+def make_pair(disparity, width=320, height=240):
+    # Smooth random texture, the right image is the left one shifted by the disparity
+    rng = np.random.default_rng(3)
+    texture = rng.integers(0, 255, (height // 4, (width + 64) // 4), dtype=np.uint8)
+    texture = cv2.resize(texture, (width + 64, height), interpolation=cv2.INTER_LINEAR)
+    left = np.ascontiguousarray(texture[:, :width])
+    right = np.ascontiguousarray(texture[:, disparity:disparity + width])
+    return StereoFrame(left, right, 5, 100, 100)
+
+
+class TestSparseStereo(unittest.TestCase):
+
+    def test_recovers_disparity(self):
+        maps = make_maps()
+        for detector in SparseStereo.DETECTORS:
+            keypoints = SparseStereo(detector, num_disparities=48).compute(make_pair(20), maps)
+
+            self.assertEqual(keypoints.dtype, np.float32)
+            self.assertEqual(keypoints.shape[1], 4)
+            self.assertGreater(len(keypoints), 50)
+            np.testing.assert_allclose(keypoints[:, 2], 20, atol=0.5)
+            np.testing.assert_allclose(keypoints[:, 3], 400.0 * 60.0 / keypoints[:, 2], rtol=1e-5)
+
+    def test_rejects_out_of_range(self):
+        # The true disparity is beyond the search range, no match is reliable
+        keypoints = SparseStereo(num_disparities=16).compute(make_pair(40), make_maps())
+        self.assertLess(len(keypoints), 25)
+
+    def test_no_features(self):
+        flat = np.full((48, 64), 128, dtype=np.uint8)
+        keypoints = SparseStereo().compute(StereoFrame(flat, flat, 1, 0, 0), make_maps())
+        self.assertEqual(keypoints.shape, (0, 4))
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            SparseStereo(detector="sift")
+        with self.assertRaises(ValueError):
+            SparseStereo(block_size=10)
+
+
+class TestKeypointStream(unittest.TestCase):
+
+    def test_round_trip(self):
+        frame = make_pair(20)
+        keypoints = np.arange(12, dtype=np.float32).reshape(3, 4)
+        encoded = encode_keypoints(frame, keypoints)
+        self.assertEqual(encoded.codec, frame_protocol.CODEC_KEYPOINTS)
+        self.assertEqual(encoded.nbytes, keypoints.nbytes)
+
+        header = frame_protocol.FrameHeader.unpack(frame_protocol.frame_buffers(
+            encoded.codec, encoded.seq, encoded.timestamp, encoded.shape, encoded.dtype, encoded.left, encoded.right
+        )[0])
+        received = EncodedFrame.from_header(header, memoryview(encoded.left), memoryview(encoded.right))
+        points, right = decode_frame(received)
+        self.assertIsNone(right)
+        np.testing.assert_array_equal(points, keypoints)
+
+    def test_empty(self):
+        encoded = encode_keypoints(make_pair(20), np.empty((0, 4), dtype=np.float32))
+        buffers = frame_protocol.frame_buffers(
+            encoded.codec, encoded.seq, encoded.timestamp, encoded.shape, encoded.dtype, encoded.left, encoded.right
+        )
+        self.assertEqual(frame_protocol.FrameHeader.unpack(buffers[0]).shape, (0, 4))
+        self.assertEqual(decode_frame(encoded)[0].shape, (0, 4))
+
+    def test_image_encoder_refuses_keypoints(self):
+        with self.assertRaises(ValueError):
+            encode_frame(make_pair(20), StreamOptions(StreamOptions.CODEC_KEYPOINTS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import socket
+import unittest
+import numpy as np
+from camera.capture import StereoFrame
+from utils import frame_protocol
+from utils.command_handler import StreamOptions
+from utils.stream_codec import EncodedFrame, encode_frame, decode_frame
+
+
+class TestStreamCodec(unittest.TestCase):
+
+    def setUp(self):
+        image = np.zeros((64, 80, 3), dtype=np.uint8)
+        image[:, 40:] = 200
+        self.frame = StereoFrame(image, image.copy(), 3, 100, 100)
+
+    def test_jpeg_downscaled_round_trip_over_socket(self):
+        encoded = encode_frame(self.frame, StreamOptions("jpeg", 90, 2))
+        a, b = socket.socketpair()
+        try:
+            frame_protocol.send_payloads(a, encoded.codec, encoded.seq, encoded.timestamp,
+                                         encoded.shape, encoded.dtype, encoded.left, encoded.right)
+            header, left, right = frame_protocol.FrameReceiver().recv(b)
+        finally:
+            a.close()
+            b.close()
+        left, right = decode_frame(EncodedFrame.from_header(header, left, right))
+        self.assertEqual(left.shape, (32, 40, 3))
+        self.assertLess(np.abs(left.astype(int) - 100).max(), 110)
+        self.assertEqual(header.seq, 3)
+
+    def test_png_is_lossless(self):
+        encoded = encode_frame(self.frame, StreamOptions("png"))
+        left, _ = decode_frame(encoded)
+        np.testing.assert_array_equal(left, self.frame.left)
+
+    def test_raw_does_not_share_the_frame(self):
+        encoded = encode_frame(self.frame, StreamOptions("raw", 90, 1))
+        self.frame.left[:] = 7
+        self.assertFalse(np.shares_memory(encoded.left, self.frame.left))
+        self.assertEqual(int(encoded.left[0, 0, 0]), 0)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            StreamOptions("h264").validate()
+        with self.assertRaises(ValueError):
+            StreamOptions(scale=0.5).validate()
+
+
+if __name__ == '__main__':
+    unittest.main()
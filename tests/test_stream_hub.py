@@ -0,0 +1,42 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from server.stream_hub import StreamHub, Subscriber
+from utils.command_handler import StreamOptions
+
+
+class TestStreamHub(unittest.TestCase):
+
+    def setUp(self):
+        self.streamer = MagicMock()
+        self.hub = StreamHub("127.0.0.1", 0, self.streamer)
+        handler = MagicMock()
+        handler.connected = True
+        self.subscriber = Subscriber(handler, StreamOptions("jpeg", 80, 1), 30, addr=("127.0.0.1", 1234))
+        self.hub.subscribers.append(self.subscriber)
+
+    def tearDown(self):
+        self.hub.executor.shutdown()
+
+    def test_options_changed_while_encoding(self):
+        def encode(frame, options):
+            # The sender thread changes the level while the frame is encoded
+            self.subscriber.options = StreamOptions("jpeg", 60, 1.5)
+            return options.quality, frame.timestamp
+
+        self.streamer.encode_frame = encode
+        self.hub.distribute(SimpleNamespace(timestamp=1))
+        self.assertEqual(self.subscriber.get(timeout=1), (80, 1))
+
+    def test_failed_frame_does_not_end_the_stream(self):
+        frames = [SimpleNamespace(timestamp=1), SimpleNamespace(timestamp=2), None]
+        self.streamer.get_frame.side_effect = frames
+        self.streamer.encode_frame.side_effect = [RuntimeError("encoder failed"), b"frame"]
+        self.hub.live.set()
+        self.hub.stream_loop()
+        self.assertEqual(self.subscriber.get(timeout=1), b"frame")
+        self.assertEqual(self.hub.frames, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
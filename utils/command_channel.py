@@ -0,0 +1,163 @@
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from utils import frame_protocol
+from utils.command_handler import Request, Reply
+from utils.file_transfer import file_chunk_of
+
+
+class Call(Future):
+    """
+    A request in flight on a CommandChannel.
+
+    The future resolves to the first message the server sends back, normally
+    the Response. Commands that send more than that (GET_RECORDING) deliver
+    the rest through messages().
+
+    File bytes following a FileChunk are written to the call's sink at the
+    chunk's offset when it has one, otherwise they are kept in chunk.data.
+    """
+
+    def __init__(self, request, sink=None):
+        super().__init__()
+        self.request = request
+        self.sink = sink
+        self.error = None
+        self.replies = queue.Queue()
+
+    def deliver(self, reply: Reply):
+        if reply.final:
+            if not self.done():
+                self.set_result(None)
+            self.replies.put(None)
+        elif not self.done():
+            self.set_result(reply.message)
+        else:
+            self.replies.put(reply.message)
+
+    def fail(self, error):
+        self.error = error
+        if not self.done():
+            self.set_exception(error)
+        self.replies.put(None)
+
+    def messages(self, timeout=None):
+        """
+        Yields the messages following the first one until the request is done.
+
+        Args:
+            timeout (float, optional): Maximum wait for each message.
+
+        Raises:
+            queue.Empty: If a message doesn't arrive in time.
+            ConnectionError: If the connection was lost before the request was done.
+        """
+        while True:
+            message = self.replies.get(timeout=timeout)
+            if message is None:
+                if self.error:
+                    raise self.error
+                return
+            yield message
+
+
+class CommandChannel:
+    """
+    Client end of a pipelined command connection.
+
+    Every request gets an ID and any number of them can be in flight at
+    once; a reader thread hands each Reply to the Call it belongs to. A
+    CAPTURE_IMAGE sent during a recording download is answered in between
+    the recording's frames instead of after them.
+    """
+
+    def __init__(self, socket_handler):
+        """
+        Args:
+            socket_handler (SocketHandler): Connected command socket handler.
+        """
+        self.socket_handler = socket_handler
+        self.logger = logging.getLogger()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self.read_loop, name="command-replies", daemon=True)
+        self.thread.start()
+
+    def submit(self, command, params=None, expect_reply=True, sink=None) -> Call:
+        """
+        Sends a request without waiting for its reply.
+
+        Args:
+            command (Command): Command to run.
+            params (dict, optional): Command parameters.
+            expect_reply (bool): False for requests the server doesn't answer (EXIT).
+            sink (file, optional): Seekable binary file receiving the bytes of FileChunks.
+
+        Returns:
+            Call: Future of the request.
+        """
+        request = Request(command, params, request_id=next(self.ids))
+        call = Call(request, sink)
+        with self.lock:
+            if self.closed:
+                call.fail(ConnectionError("Command channel is closed"))
+                return call
+            if expect_reply:
+                self.calls[request.request_id] = call
+        self.socket_handler.send(request)
+        if not expect_reply:
+            call.set_result(None)
+        return call
+
+    def read_loop(self):
+        try:
+            while True:
+                reply = self.socket_handler.recv_message()
+                if not isinstance(reply, Reply):
+                    self.logger.error(f"Unexpected message on the command channel: {reply}")
+                    continue
+                with self.lock:
+                    call = self.calls.pop(reply.request_id, None) if reply.final else self.calls.get(reply.request_id)
+                chunk = file_chunk_of(reply)
+                if chunk:
+                    self.read_chunk(chunk, call.sink if call else None)
+                if call:
+                    call.deliver(reply)
+        except Exception as e:
+            self.logger.debug(f"Command channel closed: {e}")
+        with self.lock:
+            self.closed = True
+            calls, self.calls = self.calls, {}
+        for call in calls.values():
+            call.fail(ConnectionError("Connection to the server lost"))
+
+    def read_chunk(self, chunk, sink):
+        """
+        Reads the bytes following a FileChunk into the sink, or into chunk.data.
+        """
+        sock = self.socket_handler.reciever
+        if sink is None:
+            chunk.data = bytearray(chunk.length)
+            frame_protocol.recv_exact_into(sock, chunk.data)
+        else:
+            buffer = self.socket_handler.recv_buffer
+            sink.seek(chunk.offset)
+            remaining = chunk.length
+            while remaining:
+                view = memoryview(buffer)[:min(remaining, len(buffer))]
+                frame_protocol.recv_exact_into(sock, view)
+                sink.write(view)
+                remaining -= len(view)
+        self.socket_handler.stats.add_received(chunk.length, messages=0)
+
+    def pending(self):
+        """
+        Returns:
+            int: Number of requests still in flight.
+        """
+        with self.lock:
+            return len(self.calls)
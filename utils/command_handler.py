@@ -1,4 +1,7 @@
+import math
 from enum import Enum
+from config.settings import STREAM_CODEC, STREAM_QUALITY, STREAM_SCALE, DEPTH_ALGORITHM, DEPTH_SCALE, \
+    DEPTH_MIN_DISPARITY, DEPTH_NUM_DISPARITIES, DEPTH_BLOCK_SIZE
 
 class Serializer:
     def to_dict(self): 
@@ -18,6 +21,18 @@ class Command(Enum):
     START_LIVE = 5
     END_LIVE = 6
     EXIT = 7
+    STREAM_STATUS = 8
+    RECORDING_INFO = 9
+    GET_FILE = 10
+    CLEAR_RECORDING = 11
+    ARM_PRETRIGGER = 12
+    DISARM_PRETRIGGER = 13
+    START_DEPTH = 14
+    END_DEPTH = 15
+    GET_DEPTH = 16
+    GET_POINT_CLOUD = 17
+    GET_KEYPOINTS = 18
+    SET_CONFIG = 19
 
 class Response(Serializer,DeSerializer):
     """
@@ -28,6 +43,7 @@ class Response(Serializer,DeSerializer):
         data (any): The payload or content of the message.
         error (str): Error message, if any.
         message (str): Human-readable message content.
+        request_id (int): ID of the request this answers, None for unnumbered requests.
     """
 
     TYPE_ERROR = "Error"
@@ -40,7 +56,7 @@ class Response(Serializer,DeSerializer):
         "right_img": None
     }
 
-    def __init__(self, type, data=None, error=None, message=None):
+    def __init__(self, type, data=None, error=None, message=None, request_id=None):
         """
         Initializes a Message object.
 
@@ -49,11 +65,13 @@ class Response(Serializer,DeSerializer):
             data (any, optional): The payload.
             error (str, optional): Error string, if the message is an error.
             message (str, optional): A general message.
+            request_id (int, optional): ID of the request this answers.
         """
         self.type = type    
         self.data = data
         self.message = message
         self.error = error
+        self.request_id = request_id
 
     def __str__(self):
         """
@@ -72,7 +90,8 @@ class Response(Serializer,DeSerializer):
             "type": self.type,
             "data": self.data,
             "error": self.error,
-            "message": self.message
+            "message": self.message,
+            "request_id": self.request_id
         }
 
     @classmethod
@@ -86,13 +105,18 @@ class Response(Serializer,DeSerializer):
         Returns:
             Message: An instance of Message.
         """
-        return cls(type=data['type'], data=data.get('data'), error=data.get('error'), message=data.get('message'))
+        return cls(type=data['type'], data=data.get('data'), error=data.get('error'), message=data.get('message'),
+                   request_id=data.get('request_id'))
 
 class Request(Serializer,DeSerializer):
     """
     A class representing a set of request flags used for communication between components.
 
     Attributes:
+        command (Command): The command to execute.
+        params (dict): Optional command parameters, e.g. StreamOptions.to_dict() for START_LIVE.
+        request_id (int): Client-chosen ID. Numbered requests may run concurrently and
+            everything sent back for them comes wrapped in a Reply with the same ID.
         got_size (int): Size of the received data (useful for files).
         start_recording (bool): True if the system should start recording.
         capture_img (bool): True if an image should be captured.
@@ -103,20 +127,25 @@ class Request(Serializer,DeSerializer):
         end_live (bool): True if live streaming should end.
     """
 
-    def __init__(self, command):
+    def __init__(self, command, params=None, request_id=None):
         """
         Initializes a Request object with the given flags.
 
         Args:
             command (int)
+            params (dict, optional): Command parameters.
+            request_id (int, optional): ID to correlate the replies with, None for
+                the original one-command-at-a-time exchange.
         """
         self.command = command 
+        self.params = params
+        self.request_id = request_id
 
     def __str__(self):
         """
         Returns a string representation of the request state.
         """
-        return f"command :{self.command}"
+        return f"command :{self.command}, params :{self.params}, id :{self.request_id}"
 
     def to_dict(self):
         """
@@ -126,7 +155,9 @@ class Request(Serializer,DeSerializer):
             dict: Dictionary containing all request fields.
         """
         return {
-            "command": self.command
+            "command": self.command,
+            "params": self.params,
+            "request_id": self.request_id
         }
 
     @classmethod
@@ -141,9 +172,46 @@ class Request(Serializer,DeSerializer):
             Request: An instance of the Request class.
         """
         return cls(
-            command=data.get("command", 0)
+            command=data.get("command", 0),
+            params=data.get("params"),
+            request_id=data.get("request_id")
         )
 
+
+class Reply(Serializer,DeSerializer):
+    """
+    Envelope of a message sent back for a numbered request.
+
+    A command may send several messages (GET_RECORDING sends a Response, the
+    CameraConfig and every FrameData). Each goes out as a Reply carrying the
+    request's ID, and a final Reply without a message marks the end, so
+    replies to concurrent requests can be told apart on one connection.
+
+    Attributes:
+        request_id (int): ID of the request.
+        message: The Response, CameraConfig or FrameData, None for the final reply.
+        final (bool): True once the request has been handled completely.
+    """
+
+    def __init__(self, request_id, message=None, final=False):
+        self.request_id = request_id
+        self.message = message
+        self.final = final
+
+    def __str__(self):
+        return f"id :{self.request_id}, final :{self.final}, message :{self.message}"
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "message": self.message,
+            "final": self.final
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["request_id"], message=data.get("message"), final=data.get("final", False))
+
 class Header(Serializer,DeSerializer):
     def __init__(self,start=True,end=False,configs=None):
         self.start=start
@@ -232,3 +300,214 @@ class CameraConfig(Serializer,DeSerializer):
         """
         return cls(frame_count=data.get('frame_count'),fps=data['fps'], width=data.get('width'), height=data.get('height'))
 
+
+class StreamOptions(Serializer,DeSerializer):
+    """
+    Per-session options of a live stream, sent as the params of START_LIVE.
+
+    Attributes:
+        codec (str): 'jpeg', 'png' or 'raw'.
+        quality (int): JPEG quality, 1-100.
+        scale (float): Downscale factor, 1 sends full size, 2 half the width and height.
+    """
+    CODEC_RAW = 'raw'
+    CODEC_JPEG = 'jpeg'
+    CODEC_PNG = 'png'
+    # Sparse stereo keypoints instead of images
+    CODEC_KEYPOINTS = 'keypoints'
+    CODECS = (CODEC_RAW, CODEC_JPEG, CODEC_PNG, CODEC_KEYPOINTS)
+
+    def __init__(self, codec=STREAM_CODEC, quality=STREAM_QUALITY, scale=STREAM_SCALE):
+        self.codec = codec
+        self.quality = quality
+        self.scale = scale
+
+    def __str__(self):
+        return f"codec : {self.codec}, quality : {self.quality}, scale : {self.scale}"
+
+    def validate(self):
+        """
+        Checks that the options are usable.
+
+        Raises:
+            ValueError: If an option is out of range.
+            TypeError: If quality or scale is not a number.
+        """
+        if self.codec not in self.CODECS:
+            raise ValueError(f"Unknown codec '{self.codec}', expected one of {', '.join(self.CODECS)}")
+        if not 1 <= int(self.quality) <= 100:
+            raise ValueError("Quality must be between 1 and 100")
+        if not math.isfinite(float(self.scale)) or float(self.scale) < 1:
+            raise ValueError("Scale must be a finite number of at least 1")
+        return self
+
+    def to_dict(self):
+        return {
+            "codec": self.codec,
+            "quality": self.quality,
+            "scale": self.scale,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates StreamOptions from a dictionary, using the defaults for missing keys.
+        """
+        data = data or {}
+        return cls(
+            codec=data.get('codec', STREAM_CODEC),
+            quality=data.get('quality', STREAM_QUALITY),
+            scale=data.get('scale', STREAM_SCALE)
+        )
+
+
+class DepthOptions(Serializer,DeSerializer):
+    """
+    Options of the depth engine, sent as the params of START_DEPTH.
+
+    Attributes:
+        algorithm (str): 'bm' (block matching, fastest) or 'sgbm' (semi-global, denser).
+        scale (float): Downscale factor applied before matching.
+        min_disparity (int): Smallest disparity searched, in pixels of the downscaled image.
+        num_disparities (int): Width of the disparity search range, a multiple of 16.
+        block_size (int): Odd matching window size.
+        roi (list): [x, y, width, height] of the full-size frame to compute depth for, None for all of it.
+        incremental (bool): Reuse the previous disparity where the scene did not change,
+            see camera.depth.IncrementalDisparityEngine.
+    """
+    ALGORITHM_BM = 'bm'
+    ALGORITHM_SGBM = 'sgbm'
+    ALGORITHMS = (ALGORITHM_BM, ALGORITHM_SGBM)
+
+    def __init__(self, algorithm=DEPTH_ALGORITHM, scale=DEPTH_SCALE, min_disparity=DEPTH_MIN_DISPARITY,
+                 num_disparities=DEPTH_NUM_DISPARITIES, block_size=DEPTH_BLOCK_SIZE, roi=None, incremental=False):
+        self.algorithm = algorithm
+        self.scale = scale
+        self.min_disparity = min_disparity
+        self.num_disparities = num_disparities
+        self.block_size = block_size
+        self.roi = roi
+        self.incremental = incremental
+
+    def __str__(self):
+        return (f"algorithm : {self.algorithm}, scale : {self.scale}, disparities : "
+                f"{self.min_disparity}+{self.num_disparities}, block : {self.block_size}, roi : {self.roi}, "
+                f"incremental : {self.incremental}")
+
+    def validate(self):
+        """
+        Checks that the options are usable.
+
+        Raises:
+            ValueError: If an option is out of range.
+        """
+        if self.algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown algorithm '{self.algorithm}', expected one of {', '.join(self.ALGORITHMS)}")
+        if float(self.scale) < 1:
+            raise ValueError("Scale must be at least 1")
+        if isinstance(self.min_disparity, bool) or int(self.min_disparity) != self.min_disparity or self.min_disparity < 0:
+            raise ValueError("Minimum disparity must be an integer of at least 0")
+        if int(self.num_disparities) <= 0 or int(self.num_disparities) % 16:
+            raise ValueError("Number of disparities must be a positive multiple of 16")
+        block_size = int(self.block_size)
+        if block_size % 2 == 0 or not (5 if self.algorithm == self.ALGORITHM_BM else 1) <= block_size <= 255:
+            raise ValueError("Block size must be odd, 5-255 for bm and 1-255 for sgbm")
+        if self.roi is not None and (len(self.roi) != 4 or min(self.roi[2:]) <= 0 or min(self.roi[:2]) < 0):
+            raise ValueError("ROI must be [x, y, width, height] with a positive size")
+        return self
+
+    def to_dict(self):
+        return {
+            "algorithm": self.algorithm,
+            "scale": self.scale,
+            "min_disparity": self.min_disparity,
+            "num_disparities": self.num_disparities,
+            "block_size": self.block_size,
+            "roi": self.roi,
+            "incremental": self.incremental,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates DepthOptions from a dictionary, using the defaults for missing keys.
+        """
+        data = data or {}
+        return cls(
+            algorithm=data.get('algorithm', DEPTH_ALGORITHM),
+            scale=data.get('scale', DEPTH_SCALE),
+            min_disparity=data.get('min_disparity', DEPTH_MIN_DISPARITY),
+            num_disparities=data.get('num_disparities', DEPTH_NUM_DISPARITIES),
+            block_size=data.get('block_size', DEPTH_BLOCK_SIZE),
+            roi=data.get('roi'),
+            incremental=bool(data.get('incremental', False))
+        )
+
+
+class CameraMode(Serializer,DeSerializer):
+    """
+    A sensor mode, sent as the params of SET_CONFIG.
+
+    Attributes:
+        fps (float): Frame rate.
+        width (int): Width of the full resolution frames, even.
+        height (int): Height of the full resolution frames, even.
+        format (str): Picamera2 pixel format of the main stream, 'YUV420' for luma only.
+    """
+    FORMATS = ("RGB888", "BGR888", "XRGB8888", "XBGR8888", "YUV420")
+    MAX_FPS = 120
+
+    def __init__(self, fps, width, height, format):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.format = format
+
+    def __str__(self):
+        return f"{self.width}x{self.height} {self.format} at {self.fps} fps"
+
+    @property
+    def key(self):
+        """Identifies the mode in the camera's cache of built configurations."""
+        return float(self.fps), int(self.width), int(self.height), self.format
+
+    def validate(self):
+        """
+        Checks that the mode is usable.
+
+        Raises:
+            ValueError: If a value is out of range.
+        """
+        if not 0 < float(self.fps) <= self.MAX_FPS:
+            raise ValueError(f"FPS must be between 0 and {self.MAX_FPS}")
+        if int(self.width) <= 0 or int(self.height) <= 0 or int(self.width) % 2 or int(self.height) % 2:
+            raise ValueError("Width and height must be positive and even")
+        if self.format not in self.FORMATS:
+            raise ValueError(f"Unknown format '{self.format}', expected one of {', '.join(self.FORMATS)}")
+        return self
+
+    def to_dict(self):
+        return {
+            "fps": self.fps,
+            "width": self.width,
+            "height": self.height,
+            "format": self.format,
+        }
+
+    @classmethod
+    def from_dict(cls, data, defaults=None):
+        """
+        Creates a CameraMode from a dictionary, taking missing keys from defaults.
+
+        Args:
+            data (dict): Dictionary with keys matching CameraMode attributes.
+            defaults (CameraMode, optional): Usually the current mode, so that a
+                request can change the frame rate only, say.
+        """
+        data = data or {}
+        defaults = defaults.to_dict() if defaults is not None else {}
+        values = {name: data.get(name, defaults.get(name)) for name in ("fps", "width", "height", "format")}
+        missing = [name for name, value in values.items() if value is None]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}")
+        return cls(**values)
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+from utils.command_handler import Serializer, DeSerializer, Reply
+
+# Recorded files are sent as they are on disk, without decoding them.
+#
+# GET_FILE answers with a Response carrying the FileInfo of the file and then
+# one FileChunk message per FILE_CHUNK_SIZE bytes of the requested range. Each
+# FileChunk message is followed on the socket by exactly `length` raw bytes,
+# which the server writes with sendfile() straight from the page cache.
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class FileInfo(Serializer, DeSerializer):
+    """
+    A recorded file the server can send.
+
+    Attributes:
+        name (str): Name used to request the file.
+        size (int): Size in bytes.
+        sha256 (str): Hex SHA-256 of the whole file.
+    """
+
+    def __init__(self, name, size, sha256=None):
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+
+    def __str__(self):
+        return f"name : {self.name}, size : {self.size}, sha256 : {self.sha256}"
+
+    def to_dict(self):
+        return {"name": self.name, "size": self.size, "sha256": self.sha256}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["size"], data.get("sha256"))
+
+
+class FileChunk(Serializer, DeSerializer):
+    """
+    Header of a byte range of a file, followed on the wire by the bytes themselves.
+
+    Attributes:
+        name (str): Name of the file.
+        offset (int): Position of the first byte in the file.
+        length (int): Number of bytes following the header.
+        source (str): Server-side path the bytes are sent from, never sent.
+        data (bytearray): Received bytes, client side, unless they went into a sink.
+    """
+
+    def __init__(self, name, offset, length, source=None):
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.source = source
+        self.data = None
+
+    def __getstate__(self):
+        return {"name": self.name, "offset": self.offset, "length": self.length, "source": None, "data": None}
+
+    def __str__(self):
+        return f"name : {self.name}, offset : {self.offset}, length : {self.length}"
+
+    def to_dict(self):
+        return {"name": self.name, "offset": self.offset, "length": self.length}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["offset"], data["length"])
+
+
+def file_chunk_of(message):
+    """
+    Returns:
+        FileChunk: The chunk a message carries, directly or inside a Reply, or None.
+    """
+    if isinstance(message, Reply):
+        message = message.message
+    return message if isinstance(message, FileChunk) else None
+
+
+def sha256_file(path, offset=0, length=None):
+    """
+    Hashes a file, or a byte range of it.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = f.readinto(view if remaining is None else view[:min(remaining, len(buffer))])
+            if not n:
+                break
+            digest.update(view[:n])
+            if remaining is not None:
+                remaining -= n
+    return digest.hexdigest()
+
+
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+
+def file_info(path, name=None):
+    """
+    Describes a file, hashing it only when it changed since the last call.
+
+    Args:
+        path (str): Path of the file.
+        name (str, optional): Name to publish, defaults to the file name.
+
+    Returns:
+        FileInfo: Size and checksum of the file.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        sha256 = _hash_cache.get(key)
+    if sha256 is None:
+        sha256 = sha256_file(path)
+        with _hash_lock:
+            _hash_cache[key] = sha256
+    return FileInfo(name or os.path.basename(path), stat.st_size, sha256)
+
+
+def file_chunks(name, path, offset, end, chunk_size):
+    """
+    Splits a byte range of a file into FileChunk messages.
+
+    Yields:
+        FileChunk: Chunks covering [offset, end).
+    """
+    for start in range(offset, end, chunk_size):
+        yield FileChunk(name, start, min(chunk_size, end - start), source=path)
+
+
+def send_file_chunk(sock, chunk):
+    """
+    Writes the bytes of a chunk to a socket with sendfile().
+
+    Returns:
+        int: Number of bytes sent.
+    """
+    with open(chunk.source, "rb") as f:
+        sent = sock.sendfile(f, chunk.offset, chunk.length)
+    if sent != chunk.length:
+        raise IOError(f"{chunk.name} is shorter than expected")
+    return sent
@@ -0,0 +1,300 @@
+import struct
+import numpy as np
+from config.settings import MAX_MESSAGE_SIZE
+
+# Binary framing used for stereo frames on the stream socket.
+#
+# Every frame message is a fixed-size header followed by the left and the
+# right payload, back to back:
+#
+#   magic (4s) | version (B) | flags (B) | dtype (B) | codec (B) |
+#   seq (Q) | timestamp ns (q) | height (I) | width (I) | channels (I) |
+#   left length (I) | right length (I)
+#
+# With CODEC_RAW the payloads are the raw C-ordered ndarray buffers, with
+# CODEC_JPEG and CODEC_PNG they are the encoded images and the header shape
+# is the shape they decode to. With CODEC_KEYPOINTS the left payload is a
+# float32 Nx4 array of (u, v, disparity, depth) with shape (N, 4) in the
+# header, and the right payload is empty.
+
+FRAME_MAGIC = b"SCF1"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("!4sBBBBQqIIIII")
+
+# Acknowledgement sent back by the client for every frame it has displayed:
+#   magic (4s) | seq (Q) | capture timestamp ns (q)
+ACK_MAGIC = b"SCA1"
+ACK = struct.Struct("!4sQq")
+
+FLAG_END = 0x01
+
+CODEC_RAW = 0
+CODEC_JPEG = 1
+CODEC_PNG = 2
+CODEC_KEYPOINTS = 3
+
+DTYPE_CODES = {
+    np.dtype(np.uint8): 0,
+    np.dtype(np.uint16): 1,
+    np.dtype(np.int16): 2,
+    np.dtype(np.float32): 3,
+}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+
+class FrameHeader:
+    """
+    Decoded header of a binary frame message.
+
+    Attributes:
+        flags (int): FLAG_* bits.
+        dtype (numpy.dtype): Element type of the frames.
+        codec (int): CODEC_* value describing the payloads.
+        seq (int): Frame sequence number.
+        timestamp (int): Capture timestamp (ns).
+        shape (tuple): Frame shape, (height, width) or (height, width, channels).
+        left_len (int): Size of the left payload in bytes.
+        right_len (int): Size of the right payload in bytes.
+    """
+
+    def __init__(self, flags, dtype, codec, seq, timestamp, shape, left_len, right_len):
+        self.flags = flags
+        self.dtype = dtype
+        self.codec = codec
+        self.seq = seq
+        self.timestamp = timestamp
+        self.shape = shape
+        self.left_len = left_len
+        self.right_len = right_len
+
+    @property
+    def end(self):
+        return bool(self.flags & FLAG_END)
+
+    def pack(self):
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) > 2 else 0
+        return FRAME_HEADER.pack(
+            FRAME_MAGIC, FRAME_VERSION, self.flags, DTYPE_CODES[np.dtype(self.dtype)], self.codec,
+            self.seq, self.timestamp, height, width, channels, self.left_len, self.right_len
+        )
+
+    @classmethod
+    def unpack(cls, data):
+        (magic, version, flags, dtype, codec, seq, timestamp,
+         height, width, channels, left_len, right_len) = FRAME_HEADER.unpack(data)
+        if magic != FRAME_MAGIC or version != FRAME_VERSION:
+            raise ValueError(f"Not a frame message (magic {magic!r}, version {version})")
+        shape = (height, width, channels) if channels else (height, width)
+        return cls(flags, CODE_DTYPES[dtype], codec, seq, timestamp, shape, left_len, right_len)
+
+    def __str__(self):
+        return f"seq : {self.seq}, shape : {self.shape}, codec : {self.codec}, end : {self.end}"
+
+
+def sendmsg_all(sock, buffers):
+    """
+    Sends a list of buffers with scatter/gather writes, resuming after partial sends.
+
+    Args:
+        sock (socket.socket): Connected socket.
+        buffers (list): Bytes-like objects, sent in order without being joined.
+
+    Returns:
+        int: Number of bytes sent.
+    """
+    views = [memoryview(b).cast("B") for b in buffers]
+    total = sum(len(view) for view in views)
+    if not hasattr(sock, "sendmsg"):
+        for view in views:
+            sock.sendall(view)
+        return total
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+    return total
+
+
+def recv_exact_into(sock, view):
+    """
+    Fills a writable buffer completely from the socket.
+
+    Raises:
+        ConnectionError: If the peer closes the connection first.
+    """
+    view = memoryview(view).cast("B")
+    received = 0
+    total = len(view)
+    while received < total:
+        n = sock.recv_into(view[received:], total - received)
+        if n == 0:
+            raise ConnectionError("Connection closed while receiving frame")
+        received += n
+
+
+def frame_buffers(codec, seq, timestamp, shape, dtype, left, right):
+    """
+    Builds a frame message as a list of buffers without copying the payloads.
+
+    Returns:
+        list: [header, left, right] as bytes-like objects.
+    """
+    left = memoryview(left).cast("B")
+    right = memoryview(right).cast("B")
+    header = FrameHeader(0, dtype, codec, seq, timestamp, shape, len(left), len(right))
+    return [header.pack(), left, right]
+
+
+def send_payloads(sock, codec, seq, timestamp, shape, dtype, left, right):
+    """
+    Sends a frame message whose payloads are already in their wire format.
+
+    Args:
+        sock (socket.socket): Connected socket.
+        codec (int): CODEC_* value of the payloads.
+        seq (int): Frame sequence number.
+        timestamp (int): Capture timestamp (ns).
+        shape (tuple): Shape of the decoded frames.
+        dtype (numpy.dtype): Element type of the decoded frames.
+        left: Bytes-like left payload.
+        right: Bytes-like right payload.
+
+    Returns:
+        int: Number of bytes sent.
+    """
+    return sendmsg_all(sock, frame_buffers(codec, seq, timestamp, shape, dtype, left, right))
+
+
+def send_frame(sock, left, right, seq=0, timestamp=0):
+    """
+    Sends a raw stereo frame straight from the arrays' memory.
+
+    Args:
+        sock (socket.socket): Connected socket.
+        left (ndarray): Left image.
+        right (ndarray): Right image, same shape and dtype as left.
+        seq (int): Frame sequence number.
+        timestamp (int): Capture timestamp (ns).
+
+    Returns:
+        int: Number of bytes sent.
+    """
+    left = np.ascontiguousarray(left)
+    right = np.ascontiguousarray(right)
+    return send_payloads(sock, CODEC_RAW, seq, timestamp, left.shape, left.dtype, left, right)
+
+
+def end_marker():
+    """Returns the end-of-stream marker message."""
+    return FrameHeader(FLAG_END, np.uint8, CODEC_RAW, 0, 0, (0, 0), 0, 0).pack()
+
+
+def send_end(sock):
+    """Sends the end-of-stream marker."""
+    sock.sendall(end_marker())
+    return FRAME_HEADER.size
+
+
+def send_ack(sock, seq, timestamp):
+    """Acknowledges a received frame to the sender."""
+    sock.sendall(ACK.pack(ACK_MAGIC, seq, timestamp))
+
+
+def recv_ack(sock, buffer):
+    """
+    Receives one acknowledgement.
+
+    Args:
+        sock (socket.socket): Connected socket.
+        buffer (bytearray): Reusable buffer of ACK.size bytes.
+
+    Returns:
+        tuple: (seq, timestamp)
+    """
+    recv_exact_into(sock, buffer)
+    return unpack_ack(buffer)
+
+
+def unpack_ack(data):
+    """
+    Returns:
+        tuple: (seq, timestamp) of an acknowledgement message.
+    """
+    magic, seq, timestamp = ACK.unpack(data)
+    if magic != ACK_MAGIC:
+        raise ValueError(f"Not an acknowledgement (magic {magic!r})")
+    return seq, timestamp
+
+
+class FrameReceiver:
+    """
+    Receives binary frame messages into preallocated arrays.
+
+    The arrays are reused for as long as the frame shape and dtype stay the
+    same, so a frame returned by recv() is only valid until the next call.
+    Encoded payloads are received into reusable byte buffers the same way.
+    """
+
+    def __init__(self, max_payload_size=MAX_MESSAGE_SIZE):
+        """
+        Args:
+            max_payload_size (int): Largest payload of one eye accepted by recv(), in bytes.
+        """
+        self.max_payload_size = max_payload_size
+        self.header_buffer = bytearray(FRAME_HEADER.size)
+        self.left = None
+        self.right = None
+        self.payloads = [bytearray(), bytearray()]
+
+    def _payload(self, index, size):
+        if len(self.payloads[index]) < size:
+            self.payloads[index] = bytearray(size)
+        return memoryview(self.payloads[index])[:size]
+
+    def _buffers(self, header):
+        if self.left is None or self.left.shape != header.shape or self.left.dtype != header.dtype:
+            self.left = np.empty(header.shape, dtype=header.dtype)
+            self.right = np.empty(header.shape, dtype=header.dtype)
+        return self.left, self.right
+
+    def recv_header(self, sock):
+        recv_exact_into(sock, self.header_buffer)
+        return FrameHeader.unpack(self.header_buffer)
+
+    def recv(self, sock):
+        """
+        Receives one frame message.
+
+        Returns:
+            tuple: (header, left, right). For raw frames left and right are arrays,
+            for encoded frames they are memoryviews of the payloads. Both are
+            None for the end marker.
+
+        Raises:
+            ValueError: If a payload is larger than max_payload_size.
+        """
+        header = self.recv_header(sock)
+        if header.end:
+            return header, None, None
+        size = max(header.left_len, header.right_len)
+        if header.codec == CODEC_RAW:
+            # Raw buffers are allocated from the shape, not the declared lengths
+            size = max(size, int(np.prod(header.shape, dtype=np.int64)) * np.dtype(header.dtype).itemsize)
+        if size > self.max_payload_size:
+            raise ValueError(f"Frame payload of {size} bytes exceeds the {self.max_payload_size} byte limit")
+        if header.codec != CODEC_RAW:
+            left = self._payload(0, header.left_len)
+            right = self._payload(1, header.right_len)
+            recv_exact_into(sock, left)
+            recv_exact_into(sock, right)
+            return header, left, right
+        left, right = self._buffers(header)
+        if header.left_len != left.nbytes or header.right_len != right.nbytes:
+            raise ValueError("Frame payload size does not match its shape")
+        recv_exact_into(sock, left)
+        recv_exact_into(sock, right)
+        return header, left, right
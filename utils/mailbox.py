@@ -0,0 +1,85 @@
+import threading
+
+
+class LatestFrameMailbox:
+    """
+    Single-slot mailbox holding only the newest item.
+
+    Putting an item while the previous one has not been taken yet replaces
+    it, and the replaced item is counted as dropped. A consumer therefore
+    always gets the freshest frame instead of working through a backlog.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.put_count = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def put(self, item):
+        """
+        Stores an item, replacing the one not taken yet. Never blocks.
+
+        Returns:
+            bool: True if an older item was dropped.
+        """
+        with self.cond:
+            dropped = self.full
+            if dropped:
+                self.dropped += 1
+            self.item = item
+            self.full = True
+            self.put_count += 1
+            self.cond.notify_all()
+            return dropped
+
+    def get(self, timeout=None):
+        """
+        Waits for an item and takes it out of the mailbox.
+
+        Returns:
+            The newest item, or None on timeout or once the mailbox is closed and empty.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.full or self.closed, timeout=timeout)
+            if not self.full:
+                return None
+            item = self.item
+            self.item = None
+            self.full = False
+            self.delivered += 1
+            return item
+
+    def refresh(self, item):
+        """
+        Swaps an item the consumer is still holding for a newer one, if there is one.
+
+        Returns:
+            The newer item, with the given one counted as dropped, or the given item.
+        """
+        with self.cond:
+            if not self.full:
+                return item
+            newer = self.item
+            self.item = None
+            self.full = False
+            self.delivered += 1
+            self.dropped += 1
+            return newer
+
+    def close(self):
+        """Wakes up the consumer; get() returns None once the last item is taken."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "put": self.put_count,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,230 @@
+import struct
+import threading
+import time
+import logging
+from collections import OrderedDict
+from utils.command_handler import StreamOptions
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Not available on Windows clients, which never send the stream
+    fcntl = None
+
+
+def get_send_backlog(sock):
+    """
+    Returns the number of bytes queued in the socket's send buffer that the
+    peer has not acknowledged yet, or None where the platform can't tell.
+    """
+    if fcntl is None:
+        return None
+    try:
+        data = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, struct.pack("I", 0))
+        return struct.unpack("I", data)[0]
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+class OperatingPoint:
+    """
+    One rung of the stream quality ladder.
+
+    Attributes:
+        fps (float): Maximum frames per second sent.
+        scale (float): Downscale factor.
+        quality (int): JPEG quality.
+    """
+
+    def __init__(self, fps, scale, quality):
+        self.fps = fps
+        self.scale = scale
+        self.quality = quality
+
+    def to_dict(self):
+        return {"fps": self.fps, "scale": self.scale, "quality": self.quality}
+
+    def __str__(self):
+        return f"fps : {self.fps:.1f}, scale : {self.scale}, quality : {self.quality}"
+
+
+class StreamRateController:
+    """
+    Adapts frame rate, resolution and encode quality of a live stream to hold
+    a target latency.
+
+    The sender reports every frame it sent together with the socket's send
+    backlog and whether it had to wait for the send buffer to drain first,
+    and the client acknowledges every frame it displayed. Latency is
+    the time from capture to acknowledgement. Every INTERVAL seconds the
+    controller steps down the quality ladder when latency is above target or
+    data piles up in the send buffer, and steps back up after the link has
+    stayed comfortably fast for a while.
+    """
+
+    INTERVAL = 0.5
+    HOLD = 1.0
+    STEP_UP_INTERVALS = 4
+    # (fps factor, scale factor, quality delta) relative to the session options
+    LADDER = [
+        (1.0, 1.0, 0),
+        (1.0, 1.0, -20),
+        (1.0, 1.5, -20),
+        (1.0, 2.0, -30),
+        (0.5, 2.0, -30),
+        (0.5, 3.0, -40),
+        (0.25, 4.0, -40),
+    ]
+    MIN_QUALITY = 10
+    MAX_PENDING = 64
+
+    def __init__(self, options, fps, target_latency_ms, adaptive=True):
+        """
+        Args:
+            options (StreamOptions): Options requested for the session, the top of the ladder.
+            fps (float): Capture frame rate.
+            target_latency_ms (float): Capture-to-display latency to hold.
+            adaptive (bool): If False the controller only measures and never changes the stream.
+        """
+        self.base = options
+        self.target_latency = target_latency_ms * 1e6
+        self.adaptive = adaptive
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.ladder = [
+            OperatingPoint(fps * f, options.scale * s, max(self.MIN_QUALITY, int(options.quality) + dq))
+            for f, s, dq in self.LADDER
+        ]
+        self.level = 0
+        self.pending = OrderedDict()
+        self.latency = None
+        self.rtt = None
+        self.backlog = 0
+        self.frame_bytes = None
+        self.frames_sent = 0
+        self.frames_acked = 0
+        self.good_intervals = 0
+        self.interval_sent = 0
+        self.interval_stalls = 0
+        self.stalls = 0
+        now = time.monotonic()
+        self.next_update = now + self.INTERVAL
+        self.changed_at = now
+
+    @property
+    def point(self):
+        return self.ladder[self.level]
+
+    @property
+    def options(self):
+        """StreamOptions of the current operating point."""
+        point = self.point
+        return StreamOptions(self.base.codec, point.quality, point.scale)
+
+    @property
+    def min_interval(self):
+        """Minimum capture time between two sent frames (ns)."""
+        return int(1e9 / self.point.fps) if self.point.fps else 0
+
+    @staticmethod
+    def _ewma(value, sample, alpha=0.2):
+        return sample if value is None else value + alpha * (sample - value)
+
+    def on_sent(self, seq, nbytes, backlog=None, stalled=False):
+        """
+        Records a frame that was handed to the socket.
+
+        Args:
+            seq (int): Frame sequence number.
+            nbytes (int): Size of the frame message.
+            backlog (int, optional): Bytes waiting in the send buffer afterwards.
+            stalled (bool): Whether the sender had to wait for the send buffer to drain.
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            self.frames_sent += 1
+            self.interval_sent += 1
+            if stalled:
+                self.interval_stalls += 1
+                self.stalls += 1
+            self.pending[seq] = now
+            while len(self.pending) > self.MAX_PENDING:
+                self.pending.popitem(last=False)
+            self.frame_bytes = self._ewma(self.frame_bytes, nbytes)
+            if backlog is not None:
+                self.backlog = backlog
+            self._update()
+
+    def on_ack(self, seq, timestamp):
+        """
+        Records a client acknowledgement.
+
+        Args:
+            seq (int): Sequence number of the displayed frame.
+            timestamp (int): Capture timestamp of that frame (ns).
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            self.frames_acked += 1
+            sent_at = self.pending.pop(seq, None)
+            if sent_at is not None:
+                self.rtt = self._ewma(self.rtt, now - sent_at)
+            if timestamp:
+                self.latency = self._ewma(self.latency, now - timestamp)
+
+    def _update(self):
+        now = time.monotonic()
+        if not self.adaptive or now < self.next_update:
+            return
+        self.next_update = now + self.INTERVAL
+        if now - self.changed_at < self.HOLD:
+            return
+
+        frame_bytes = self.frame_bytes or 0
+        congested = self.backlog > 2 * frame_bytes or self.interval_stalls * 2 > self.interval_sent
+        self.interval_sent = 0
+        self.interval_stalls = 0
+        slow = self.latency is not None and self.latency > 1.25 * self.target_latency
+        fast = self.latency is None or self.latency < 0.6 * self.target_latency
+
+        if (congested or slow) and self.level < len(self.ladder) - 1:
+            self._set_level(self.level + 1, now)
+        elif not congested and fast:
+            self.good_intervals += 1
+            if self.good_intervals >= self.STEP_UP_INTERVALS and self.level > 0:
+                self._set_level(self.level - 1, now)
+        else:
+            self.good_intervals = 0
+
+    def _set_level(self, level, now):
+        self.level = level
+        self.good_intervals = 0
+        self.changed_at = now
+        # Old measurements describe the previous operating point
+        self.latency = None
+        self.logger.info(f"Stream operating point {level}: {self.point}")
+
+    def get_status(self):
+        """
+        Returns the current operating point and the measurements behind it.
+
+        Returns:
+            dict: Status of the controller.
+        """
+        with self.lock:
+            return {
+                "adaptive": self.adaptive,
+                "level": self.level,
+                "levels": len(self.ladder),
+                "codec": self.base.codec,
+                "operating_point": self.point.to_dict(),
+                "target_latency_ms": self.target_latency / 1e6,
+                "latency_ms": self.latency / 1e6 if self.latency is not None else None,
+                "rtt_ms": self.rtt / 1e6 if self.rtt is not None else None,
+                "backlog_bytes": self.backlog,
+                "frame_bytes": self.frame_bytes,
+                "frames_sent": self.frames_sent,
+                "frames_acked": self.frames_acked,
+                "stalls": self.stalls,
+            }
@@ -6,7 +6,26 @@ import struct
 import time
 from abc import ABC, abstractmethod
 from typing import Callable, Any
-from config.settings import HEADER_SIZE
+from config.settings import HEADER_SIZE, STREAM_PROTOCOL, MAX_MESSAGE_SIZE, STREAM_ADAPTIVE, \
+    STREAM_TARGET_LATENCY_MS, STREAM_FEEDBACK
+from camera.capture import StereoFrame
+from utils import frame_protocol
+from utils.file_transfer import file_chunk_of, send_file_chunk
+from utils.stream_codec import EncodedFrame, StreamEncoder, encode_frame
+from utils.command_handler import StreamOptions
+from utils.rate_controller import StreamRateController, get_send_backlog
+
+
+def pack_message(message: Any) -> list:
+    """
+    Serializes a Python object into a length-prefixed message.
+
+    Returns:
+        list: [header, body] buffers.
+    """
+    body = pickle.dumps(message)
+    header = struct.pack("L", len(body))
+    return [header, body]
 
 
 class Streamer(ABC):
@@ -21,6 +40,89 @@ class Streamer(ABC):
         """
         pass
 
+    def get_frame(self):
+        """
+        Returns the next stereo frame with its sequence number and timestamp,
+        or None when the stream has ended.
+        """
+        status, (left, right) = self.get_stream()
+        if not status:
+            return None
+        self.frame_seq = getattr(self, "frame_seq", 0) + 1
+        timestamp = time.monotonic_ns()
+        return StereoFrame(left, right, self.frame_seq, timestamp, timestamp)
+
+    def encode_frame(self, frame, options):
+        """
+        Encodes a frame of this source for the stream, see stream_codec.encode_frame().
+        """
+        return encode_frame(frame, options)
+
+
+class LinkStats:
+    """
+    Byte and message counters of a socket link, with the average rate since
+    the link was created and the rate over the last completed window.
+    """
+
+    WINDOW = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.window_start = self.started
+        self.window_sent = 0
+        self.window_received = 0
+        self.send_rate = 0.0
+        self.recv_rate = 0.0
+
+    def _roll_window(self, now):
+        elapsed = now - self.window_start
+        if elapsed >= self.WINDOW:
+            self.send_rate = self.window_sent / elapsed
+            self.recv_rate = self.window_received / elapsed
+            self.window_start = now
+            self.window_sent = 0
+            self.window_received = 0
+
+    def add_sent(self, nbytes, messages=1):
+        with self.lock:
+            self.bytes_sent += nbytes
+            self.messages_sent += messages
+            self.window_sent += nbytes
+            self._roll_window(time.monotonic())
+
+    def add_received(self, nbytes, messages=1):
+        with self.lock:
+            self.bytes_received += nbytes
+            self.messages_received += messages
+            self.window_received += nbytes
+            self._roll_window(time.monotonic())
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: Totals, average rates and current rates in bytes/sec.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._roll_window(now)
+            elapsed = now - self.started
+            return {
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "messages_sent": self.messages_sent,
+                "messages_received": self.messages_received,
+                "avg_send_rate": self.bytes_sent / elapsed if elapsed else 0.0,
+                "avg_recv_rate": self.bytes_received / elapsed if elapsed else 0.0,
+                "send_rate": self.send_rate,
+                "recv_rate": self.recv_rate,
+            }
+
 
 class SocketHandler:
     """
@@ -29,15 +131,37 @@ class SocketHandler:
     """
     TYPE_CLIENT = 'client'
     TYPE_SERVER = 'server'
+    FRAME_PICKLE = 'pickle'
+    FRAME_BINARY = 'binary'
     print_lock = threading.Lock()
     header_size = HEADER_SIZE # Used for receiving fixed-length headers
 
-    def __init__(self, host: str, port: int, type=TYPE_CLIENT):
+    def __init__(self, host: str, port: int, type=TYPE_CLIENT, frame_protocol=STREAM_PROTOCOL,
+                 max_message_size=MAX_MESSAGE_SIZE, reconnect=True):
         """
         Initializes the socket handler with host, port, logger, and type (client/server).
+
+        Args:
+            frame_protocol (str): Framing of live stream frames, FRAME_BINARY or FRAME_PICKLE.
+            max_message_size (int): Largest message body accepted by recieve(), in bytes.
+            reconnect (bool): Whether a lost connection is handled by waiting for a new
+                client (server) or exiting (client). When False the handler is only
+                marked as disconnected.
         """
         self.logger = logging.getLogger()
         self.type = type
+        self.reconnect = reconnect
+        self.connected = True
+        self.socket = None
+        self.frame_protocol = frame_protocol
+        self.max_message_size = max_message_size
+        self.header_buffer = bytearray(self.header_size)
+        self.recv_buffer = bytearray(64 * 1024)
+        self.stats = LinkStats()
+        self.send_lock = threading.Lock()
+        self.rate_controller = None
+        self.stream_encoder = None
+        self.feedback_thread = None
         self.host = host
         self.port = port
         self.reciever = None
@@ -65,48 +189,84 @@ class SocketHandler:
         """
         Serializes and sends a Python object over the socket connection.
 
+        A FileChunk (or a Reply carrying one) is followed by the bytes of the
+        chunk, sent with sendfile() without passing through Python.
+
         Args:
             message: Any serializable Python object.
         """
         try:
             if show:
                 self.logger.debug(f"Sending message: {message}")
-            body = pickle.dumps(message)
-            header = struct.pack("L", len(body))  # Corrected to use `body` instead of `req`
-            req = header + body
-            self.reciever.sendall(req)
+            buffers = pack_message(message)
+            chunk = file_chunk_of(message)
+            # Messages of concurrent commands must not interleave
+            with self.send_lock:
+                nbytes = frame_protocol.sendmsg_all(self.reciever, buffers)
+                if chunk and chunk.source:
+                    nbytes += send_file_chunk(self.reciever, chunk)
+            self.stats.add_sent(nbytes)
             self.logger.debug("Request sent.")
         except Exception as e:
             self.handle_connection_close()
 
-    def send_live_stream(self, streamer: Streamer, separe_thread=False) -> None:
+    def send_frame(self, frame: StereoFrame) -> None:
+        """
+        Sends a stereo frame using the binary frame protocol, writing the
+        image buffers to the socket without serializing them.
+
+        Args:
+            frame: The StereoFrame or EncodedFrame to send, or None to send
+                the end-of-stream marker.
+
+        Returns:
+            int: Number of bytes sent, 0 if sending failed.
+        """
+        try:
+            if frame is None:
+                nbytes = frame_protocol.send_end(self.reciever)
+            elif isinstance(frame, EncodedFrame):
+                nbytes = frame_protocol.send_payloads(
+                    self.reciever, frame.codec, frame.seq, frame.timestamp,
+                    frame.shape, frame.dtype, frame.left, frame.right
+                )
+            else:
+                nbytes = frame_protocol.send_frame(self.reciever, frame.left, frame.right, frame.seq, frame.timestamp)
+            self.stats.add_sent(nbytes)
+            return nbytes
+        except Exception as e:
+            self.handle_connection_close()
+            return 0
+
+    def send_live_stream(self, streamer: Streamer, separe_thread=False, options: StreamOptions = None) -> None:
         """
         Continuously sends live data from a streamer
 
+        Frames are downscaled and encoded by a StreamEncoder running on its own
+        thread, while this loop only sends. With the binary frame protocol a
+        StreamRateController adapts frame rate, scale and quality to the send
+        backlog and the client's acknowledgements.
+
         Args:
             streamer: An object of a class that implements Streamer.
             separe_thread: Whether to run streaming in a separate thread.
+            options: Codec, quality and scale of the stream. Defaults to the settings.
         """
 
         if not self.is_inilialized:
             self.init_reciever()
-            
-        def loop():
-            count = 0
-            while True:
-                count+=1
-                with self.print_lock:
-                    print("Frame  :"+str(count))
-                status,stream = streamer.get_stream()
-                if not status:
-                    self.send('<END>')
-                    break
-                self.send(stream,show=False)
-                time.sleep(0.03)
 
-              # Send termination message
-            with self.print_lock:
-                print("Live ended.")
+        options = options or StreamOptions()
+        controller = StreamRateController(
+            options, getattr(streamer, "fps", 30), STREAM_TARGET_LATENCY_MS, adaptive=STREAM_ADAPTIVE
+        )
+
+        def loop():
+            encoder = StreamEncoder(streamer.get_frame, options, streamer.encode_frame)
+            self.stream_encoder = encoder
+            encoder.start()
+            self.stream_frames(encoder, controller)
+            encoder.stop()
 
         if separe_thread:
             th = threading.Thread(target=loop)
@@ -115,10 +275,110 @@ class SocketHandler:
         else:
             loop()
 
+    def stream_frames(self, source, controller: StreamRateController) -> None:
+        """
+        Sends encoded frames taken from a source until it runs dry, then sends
+        the end-of-stream marker.
+
+        Args:
+            source: A StreamEncoder, or any object with get(), refresh(frame) and
+                the options and min_interval attributes the controller sets.
+            controller: Rate controller of this connection.
+        """
+        self.rate_controller = controller
+        if self.frame_protocol == self.FRAME_BINARY:
+            self.start_feedback_reader()
+        while True:
+            frame = source.get()
+            if self.frame_protocol == self.FRAME_BINARY:
+                # Keep at most one frame queued in the socket, and send the
+                # newest frame once there is room rather than a stale one
+                stalled = frame is not None and self.wait_for_send_buffer(controller.frame_bytes)
+                if stalled:
+                    frame = source.refresh(frame)
+                nbytes = self.send_frame(frame)
+                if frame is None or not self.connected:
+                    break
+                controller.on_sent(frame.seq, nbytes, get_send_backlog(self.reciever), stalled)
+                source.options = controller.options
+                source.min_interval = controller.min_interval
+                continue
+            if frame is None:
+                self.send('<END>')
+                break
+            self.send(frame,show=False)
+            if not self.connected:
+                break
+
+          # Send termination message
+        with self.print_lock:
+            print("Live ended.")
+
+    def wait_for_send_buffer(self, limit, timeout=1.0):
+        """
+        Waits until no more than limit bytes are queued in the socket's send buffer.
+
+        Args:
+            limit (float): Allowed backlog in bytes, None to not wait at all.
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if the caller had to wait.
+        """
+        if limit is None:
+            return False
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            backlog = get_send_backlog(self.reciever)
+            if backlog is None or backlog <= limit or time.monotonic() > deadline:
+                return waited
+            waited = True
+            time.sleep(0.002)
+
+    def start_feedback_reader(self):
+        """
+        Starts the thread reading frame acknowledgements from the client, once
+        per connection, and hands them to the current rate controller.
+        """
+        if self.feedback_thread and self.feedback_thread.is_alive():
+            return
+
+        def ack_loop():
+            buffer = bytearray(frame_protocol.ACK.size)
+            try:
+                while True:
+                    seq, timestamp = frame_protocol.recv_ack(self.reciever, buffer)
+                    if self.rate_controller:
+                        self.rate_controller.on_ack(seq, timestamp)
+            except Exception as e:
+                self.logger.debug(f"Stream feedback ended: {e}")
+
+        self.feedback_thread = threading.Thread(target=ack_loop, name="stream-feedback", daemon=True)
+        self.feedback_thread.start()
+
+    def subscribe(self, options: StreamOptions) -> None:
+        """
+        Opens a new connection to a server's stream port and subscribes to its
+        live stream with the given options.
+
+        Args:
+            options: Codec, quality and scale this subscriber wants.
+        """
+        if self.is_inilialized:
+            self.close()
+        self.init_reciever()
+        self.send({"options": options.to_dict(), "protocol": self.frame_protocol})
+
     def recive_live_stream(self, stream_callback: Callable[[bool, Any], Any], separe_thread=False) -> None:
         """
         Receives a continuous stream and processes each packet via a callback.
 
+        Raw frames are passed on as a (left, right) tuple, compressed frames as
+        an EncodedFrame to be decoded with stream_codec.decode_frame(). With the
+        binary frame protocol both are received into buffers that are reused
+        for the next frame, so the callback has to copy anything it wants to keep.
+
         Args:
             stream_callback: A function that receives (bool, data).
             separe_thread: Whether to run receiving in a separate thread.
@@ -127,35 +387,41 @@ class SocketHandler:
         if not self.is_inilialized:
             self.init_reciever()
 
-        def loop():
+        def binary_loop():
             self.logger.info('Receiving live stream...')
-            data = b''
-
-            # Receive the fixed-size header
-            msg = self.reciever.recv(self.header_size)
-            msg_size = struct.unpack("L", msg)[0] 
-            while True:
-                # Receive the message based on the size from the header
-                while len(data) < msg_size:
-                    data += self.reciever.recv(4096)
-
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
-
-                frames = pickle.loads(frame_data)
-                if frames == "<END>":
-                    self.logger.info('Ending live capture...')
-                    stream_callback(False, None)
-                    break
-
-                stream_callback(True, frames)
+            receiver = frame_protocol.FrameReceiver(self.max_message_size)
+            try:
+                while True:
+                    header, left, right = receiver.recv(self.reciever)
+                    self.stats.add_received(frame_protocol.FRAME_HEADER.size + header.left_len + header.right_len)
+                    if header.end:
+                        self.logger.info('Ending live capture...')
+                        break
+                    if header.codec == frame_protocol.CODEC_RAW:
+                        stream_callback(True, (left, right))
+                    else:
+                        stream_callback(True, EncodedFrame.from_header(header, left, right))
+                    if STREAM_FEEDBACK:
+                        frame_protocol.send_ack(self.reciever, header.seq, header.timestamp)
+            except Exception as e:
+                self.logger.error(f"Live stream interrupted: {e}")
+            stream_callback(False, None)
 
-                if len(data) < self.header_size:
-                    stream_callback(False, None)
-                    break
-                msg = data[:self.header_size]
-                msg_size = struct.unpack("L", msg)[0] 
-                data = data[self.header_size:]
+        def loop():
+            self.logger.info('Receiving live stream...')
+            try:
+                while True:
+                    frames = self.recv_message()
+                    if isinstance(frames, str) and frames == "<END>":
+                        self.logger.info('Ending live capture...')
+                        break
+                    stream_callback(True, frames)
+            except Exception as e:
+                self.logger.error(f"Live stream interrupted: {e}")
+            stream_callback(False, None)
+
+        if self.frame_protocol == self.FRAME_BINARY:
+            loop = binary_loop
 
         if separe_thread:
             th = threading.Thread(target=loop)
@@ -165,6 +431,11 @@ class SocketHandler:
             loop()
 
     def handle_connection_close(self):
+        if not self.reconnect:
+            if self.connected:
+                self.logger.info(f"Connection to {self.reciever_addr} closed.")
+            self.connected = False
+            return
         if self.type == self.TYPE_CLIENT:
             self.logger.error("Server unavailable!")
             exit(0)
@@ -172,52 +443,81 @@ class SocketHandler:
             self.logger.error("Client disconnected!")
             self.accept_connection()
 
+    def recv_message(self) -> Any:
+        """
+        Receives one length-prefixed message and deserializes it.
+
+        The body is read with recv_into into a receive buffer that is kept and
+        reused for later messages, so a message costs one pass over its bytes.
+
+        Raises:
+            ConnectionError: If the peer closes the connection.
+            ValueError: If the message is larger than max_message_size.
+        """
+        frame_protocol.recv_exact_into(self.reciever, self.header_buffer)
+        msg_len = struct.unpack("L", self.header_buffer)[0]   # returns a tuple, get the first item
+        if msg_len > self.max_message_size:
+            raise ValueError(f"Message of {msg_len} bytes exceeds the {self.max_message_size} byte limit")
+
+        if len(self.recv_buffer) < msg_len:
+            self.recv_buffer = bytearray(msg_len)
+        view = memoryview(self.recv_buffer)[:msg_len]
+        frame_protocol.recv_exact_into(self.reciever, view)
+        self.stats.add_received(self.header_size + msg_len)
+        return pickle.loads(view)
+
     def recieve(self, is_file=False, large_file=False) -> Any:
         """
         Receives and deserializes a complete message from the socket.
 
         Args:
-            is_file: Whether the data is a file.
-            large_file: Whether it's a large file requiring bigger buffer.
+            is_file: Whether the data is a file. Kept for compatibility, messages
+                of any size are received the same way.
+            large_file: Whether it's a large file. Kept for compatibility.
 
         Returns:
             Deserialized Python object.
         """
         try:
             self.logger.debug("Receiving...")
-            res = b''
-            msg_len = 0
-
-            # Unpack the binary header to get message length
-
-            msg = self.reciever.recv(self.header_size)
-            msg_len = struct.unpack("L", msg)[0]   # returns a tuple, get the first item
-
-            buff_size = 4096 if large_file else 1024 if is_file else 16
-
-            while True:
-                msg = self.reciever.recv(buff_size)
-            
-                if not msg:
-                    break
-                
-                res += msg
-
-                if len(res)== msg_len:
-                    break
-
-            res = pickle.loads(res)
+            res = self.recv_message()
             self.logger.debug("Received.")
             return res
         except Exception as e:
+            self.logger.debug(f"Receive failed: {e}")
             self.handle_connection_close()
 
+    def get_stream_status(self):
+        """
+        Returns the operating point of the current or last live stream.
+
+        Returns:
+            dict: See StreamRateController.get_status(), or None if nothing was streamed.
+        """
+        if self.rate_controller is None:
+            return None
+        status = self.rate_controller.get_status()
+        if self.stream_encoder:
+            status["frames"] = self.stream_encoder.get_stats()
+        return status
+
+    def get_link_stats(self):
+        """
+        Returns byte and message counters of this link.
+
+        Returns:
+            dict: See LinkStats.to_dict().
+        """
+        return self.stats.to_dict()
+
     def close(self):
         """
         Closes the socket connection.
         """
         if self.socket:
             self.socket.close()
+        elif self.reciever:
+            self.reciever.close()
         self.logger.info("Socket closed. Bye!")
 
     def accept_connection(self):
@@ -0,0 +1,233 @@
+import threading
+import logging
+import cv2
+import numpy as np
+from utils import frame_protocol
+from utils.command_handler import StreamOptions
+from utils.mailbox import LatestFrameMailbox
+
+WIRE_CODECS = {
+    StreamOptions.CODEC_RAW: frame_protocol.CODEC_RAW,
+    StreamOptions.CODEC_JPEG: frame_protocol.CODEC_JPEG,
+    StreamOptions.CODEC_PNG: frame_protocol.CODEC_PNG,
+    StreamOptions.CODEC_KEYPOINTS: frame_protocol.CODEC_KEYPOINTS,
+}
+EXTENSIONS = {
+    frame_protocol.CODEC_JPEG: '.jpg',
+    frame_protocol.CODEC_PNG: '.png',
+}
+PNG_COMPRESSION = 1
+
+
+class EncodedFrame:
+    """
+    A stereo frame in its wire format.
+
+    Attributes:
+        codec (int): frame_protocol CODEC_* value.
+        seq (int): Frame sequence number.
+        timestamp (int): Capture timestamp (ns).
+        shape (tuple): Shape of the decoded frames.
+        dtype (numpy.dtype): Element type of the decoded frames.
+        left: Left payload, an ndarray for raw frames or the encoded bytes.
+        right: Right payload.
+    """
+
+    def __init__(self, codec, seq, timestamp, shape, dtype, left, right):
+        self.codec = codec
+        self.seq = seq
+        self.timestamp = timestamp
+        self.shape = shape
+        self.dtype = dtype
+        self.left = left
+        self.right = right
+
+    @property
+    def nbytes(self):
+        return memoryview(self.left).nbytes + memoryview(self.right).nbytes
+
+    @classmethod
+    def from_header(cls, header, left, right):
+        return cls(header.codec, header.seq, header.timestamp, header.shape, header.dtype, left, right)
+
+    def __str__(self):
+        return f"seq : {self.seq}, codec : {self.codec}, shape : {self.shape}, bytes : {self.nbytes}"
+
+
+def resize(image, scale):
+    if scale == 1:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, int(width / scale)), max(1, int(height / scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_image(image, codec, quality):
+    if codec == frame_protocol.CODEC_RAW:
+        # Copied: the image is usually a view of a ring slot, which capture
+        # overwrites while the encoded frame waits in a mailbox or in sendmsg()
+        return np.array(image, order="C", copy=True)
+    if codec == frame_protocol.CODEC_JPEG:
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    ok, buffer = cv2.imencode(EXTENSIONS[codec], image, params)
+    if not ok:
+        raise ValueError("Failed to encode frame")
+    return buffer
+
+
+def encode_frame(frame, options):
+    """
+    Downscales and encodes a stereo frame according to the stream options.
+
+    Args:
+        frame (StereoFrame): Frame to encode.
+        options (StreamOptions): Codec, quality and scale to use.
+
+    Returns:
+        EncodedFrame: The encoded frame.
+    """
+    codec = WIRE_CODECS[options.codec]
+    if codec == frame_protocol.CODEC_KEYPOINTS:
+        raise ValueError("Keypoint streams need a streamer that computes keypoints")
+    left = resize(frame.left, options.scale)
+    right = resize(frame.right, options.scale)
+    return EncodedFrame(
+        codec, frame.seq, frame.timestamp, left.shape, left.dtype,
+        encode_image(left, codec, options.quality),
+        encode_image(right, codec, options.quality)
+    )
+
+
+def encode_keypoints(frame, keypoints):
+    """
+    Wraps the sparse stereo keypoints of a frame for sending.
+
+    Args:
+        frame (StereoFrame): Frame the keypoints were computed from.
+        keypoints (numpy.ndarray): float32 Nx4 array of (u, v, disparity, depth).
+
+    Returns:
+        EncodedFrame: The keypoints as the left payload, with an empty right payload.
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    # As bytes: a few kB, and a memoryview can't be cast when no point was found
+    return EncodedFrame(
+        frame_protocol.CODEC_KEYPOINTS, frame.seq, frame.timestamp, keypoints.shape, keypoints.dtype,
+        keypoints.tobytes(), b""
+    )
+
+
+def decode_frame(frame):
+    """
+    Decodes a received frame into a pair of images.
+
+    Args:
+        frame: An EncodedFrame or an already decoded (left, right) tuple.
+
+    Returns:
+        tuple: (left, right) images, or (keypoints, None) for a keypoint stream.
+    """
+    if not isinstance(frame, EncodedFrame):
+        return frame
+    if frame.codec == frame_protocol.CODEC_KEYPOINTS:
+        return np.frombuffer(frame.left, dtype=frame.dtype).reshape(frame.shape), None
+    if frame.codec == frame_protocol.CODEC_RAW:
+        return (
+            np.frombuffer(frame.left, dtype=frame.dtype).reshape(frame.shape),
+            np.frombuffer(frame.right, dtype=frame.dtype).reshape(frame.shape),
+        )
+    return (
+        cv2.imdecode(np.frombuffer(frame.left, np.uint8), cv2.IMREAD_UNCHANGED),
+        cv2.imdecode(np.frombuffer(frame.right, np.uint8), cv2.IMREAD_UNCHANGED),
+    )
+
+
+class StreamEncoder:
+    """
+    Encoding stage of the live stream.
+
+    Pulls frames from a source on its own thread and encodes them, so that
+    encoding overlaps with sending and never runs on the capture thread.
+    Encoded frames go into a LatestFrameMailbox: when the sender is still busy
+    with an older frame, that frame is dropped in favour of the new one, and
+    the stream is paced by capture rather than by the network.
+    Frames captured less than min_interval after the last encoded one are
+    skipped without being encoded.
+    """
+
+    # Accept frames slightly early so capture jitter doesn't halve the frame rate
+    INTERVAL_SLACK = 0.8
+
+    def __init__(self, source, options, encode=encode_frame):
+        """
+        Args:
+            source (callable): Returns the next StereoFrame, or None at the end of the stream.
+            options (StreamOptions): Encoding options, may be replaced while running.
+            encode (callable): Turns a frame and the options into an EncodedFrame.
+        """
+        self.source = source
+        self.options = options
+        self.encode = encode
+        self.logger = logging.getLogger()
+        self.mailbox = LatestFrameMailbox()
+        self.running = threading.Event()
+        self.thread = None
+        self.min_interval = 0
+        self.last_timestamp = None
+        self.frames_skipped = 0
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name="stream-encoder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.mailbox.close()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def loop(self):
+        while self.running.is_set():
+            frame = self.source()
+            if frame is None:
+                break
+            if (self.last_timestamp is not None
+                    and frame.timestamp - self.last_timestamp < self.min_interval * self.INTERVAL_SLACK):
+                self.frames_skipped += 1
+                continue
+            self.last_timestamp = frame.timestamp
+            try:
+                encoded = self.encode(frame, self.options)
+            except Exception as e:
+                self.logger.error(f"Error encoding frame: {e}")
+                continue
+            self.mailbox.put(encoded)
+        self.mailbox.close()
+
+    def get(self, timeout=None):
+        """
+        Returns the newest encoded frame, or None at the end of the stream.
+        """
+        return self.mailbox.get(timeout=timeout)
+
+    def refresh(self, frame):
+        """
+        Returns a newer encoded frame than the one given if one is ready.
+        """
+        return self.mailbox.refresh(frame)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Frames encoded, sent on, dropped for a newer one and skipped for rate.
+        """
+        stats = self.mailbox.get_stats()
+        return {
+            "encoded": stats["put"],
+            "delivered": stats["delivered"],
+            "dropped": stats["dropped"],
+            "skipped": self.frames_skipped,
+        }